@@ -0,0 +1,97 @@
+import sqlite3
+
+from Caches.random_song_sampler import RandomSongSampler
+from Caches.search_cache import SearchCache
+from Caches.shared_state import SharedStateStore
+from Utils.structured_logging import get_logger
+
+log = get_logger("shared_state")
+
+
+class CatalogCaches:
+    """
+    keeps the in-memory caches that depend on the song catalog (the search cache and the random song sampler) up to
+    date when songs are added or deleted.
+
+    the caches are per process, so with a few workers (see server.supervise) a song that was uploaded through one
+    worker would be missing from the other workers' caches. every change is counted in a catalog version that is kept
+    in the SharedStateStore: the worker that made the change updates its own caches, and the other workers see that
+    the version changed the next time they use the caches (see refresh), invalidate the search cache and reload the
+    sampler's song IDs.
+
+    the changes are only applied after they were committed, so that a search that runs in between can't cache a
+    catalog that isn't in the database (or that is about to be rolled back).
+    """
+
+    def __init__(self, search_cache: SearchCache, random_song_sampler: RandomSongSampler):
+        self.search_cache = search_cache
+        self.random_song_sampler = random_song_sampler
+
+        self._shared_store: SharedStateStore | None = None
+
+        self._catalog_version = 0
+        """
+        the last catalog version that the caches are up to date with
+        """
+
+    def use_shared_store(self, shared_store: SharedStateStore):
+        self._shared_store = shared_store
+        self._catalog_version = shared_store.fetch_catalog_version()
+
+    def refresh(self):
+        """drops the cached catalog if another worker changed it. called before the caches are used"""
+
+        if not self._shared_store:
+            return
+
+        catalog_version = self._shared_store.fetch_catalog_version()
+
+        if catalog_version == self._catalog_version:
+            return
+
+        self.search_cache.invalidate()
+        self.random_song_sampler.unload()
+
+        self._catalog_version = catalog_version
+
+    async def song_added(self, song_id: int):
+        """called once the song was committed"""
+
+        self.search_cache.invalidate()
+
+        # a load that is in progress may have fetched the song IDs before the song was committed, so it starts over
+        if self.random_song_sampler.is_loaded:
+            self.random_song_sampler.add(song_id)
+        else:
+            self.random_song_sampler.unload()
+
+        await self._publish_change()
+
+    async def song_deleted(self, song_id: int):
+        """called once the song's deletion was committed"""
+
+        self.search_cache.invalidate()
+
+        if self.random_song_sampler.is_loaded:
+            self.random_song_sampler.remove(song_id)
+        else:
+            self.random_song_sampler.unload()
+
+        await self._publish_change()
+
+    async def _publish_change(self):
+        if not self._shared_store:
+            return
+
+        try:
+            catalog_version = await self._shared_store.increase_catalog_version()
+        except sqlite3.OperationalError:
+            # the change was already committed, so the request shouldn't fail because of it. the other workers' caches
+            # stay outdated until the next change (or until the search results expire)
+            log.warning("failed to publish the catalog change")
+            return
+
+        # if another worker changed the catalog since our last refresh, the version skipped past ours, and the next
+        # refresh reloads the caches
+        if catalog_version == self._catalog_version + 1:
+            self._catalog_version = catalog_version
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+from Caches.client_cache import Address, ClientPackage
+
+
+class CommentSubscriptions:
+    """
+    keeps track of which clients have a song's comments open, so that new comments can be pushed to them (instead of
+    the clients requesting the comments again).
+
+    a client can be subscribed to a limited amount of songs (the least recently subscribed song is removed first), since
+    a client that never unsubscribes (for example, one that crashed) shouldn't be sent every comment forever.
+    """
+
+    def __init__(self, max_songs_per_client: int = 5):
+        self.max_songs_per_client = max_songs_per_client
+
+        self._subscribers: dict[int, dict[Address, ClientPackage]] = {}
+        """
+        dict[song ID -> dict[address -> the subscribed client]]
+        """
+
+        self._client_songs: dict[Address, OrderedDict[int, None]] = {}
+        """
+        dict[address -> OrderedDict[the song IDs the client is subscribed to, oldest first]]
+        """
+
+    def subscribe(self, song_id: int, client_package: ClientPackage):
+        address = client_package.address
+
+        client_songs = self._client_songs.setdefault(address, OrderedDict())
+        client_songs[song_id] = None
+        client_songs.move_to_end(song_id)
+
+        self._subscribers.setdefault(song_id, {})[address] = client_package
+
+        while len(client_songs) > self.max_songs_per_client:
+            oldest_song_id, _ = client_songs.popitem(last=False)
+            self._remove_subscriber(oldest_song_id, address)
+
+    def unsubscribe(self, song_id: int, address: Address):
+        client_songs = self._client_songs.get(address)
+
+        if client_songs is None:
+            return
+
+        client_songs.pop(song_id, None)
+
+        if not client_songs:
+            del self._client_songs[address]
+
+        self._remove_subscriber(song_id, address)
+
+    def unsubscribe_all(self, address: Address):
+        """removes every subscription of the client (used when the client disconnects)"""
+
+        for song_id in self._client_songs.pop(address, {}):
+            self._remove_subscriber(song_id, address)
+
+    def subscribers(self, song_id: int) -> list[ClientPackage]:
+        return list(self._subscribers.get(song_id, {}).values())
+
+    def count_disconnected(self, connected_addresses: set[Address]) -> int:
+        """:returns: the amount of subscribed clients that are no longer connected (they should have been removed)"""
+
+        return sum(1 for address in self._client_songs if address not in connected_addresses)
+
+    def _remove_subscriber(self, song_id: int, address: Address):
+        song_subscribers = self._subscribers.get(song_id)
+
+        if song_subscribers is None:
+            return
+
+        song_subscribers.pop(address, None)
+
+        if not song_subscribers:
+            del self._subscribers[song_id]
+
+    def __len__(self) -> int:
+        """the amount of songs that have at least one subscriber"""
+        return len(self._subscribers)
+
+
+# the subscriptions are shared by all the clients
+comment_subscriptions = CommentSubscriptions()
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import aiofiles
+import aiofiles.os as aos
+
+from Utils.tracing import span
+
+MEGABYTE = 1024 * 1024
+
+
+class MediaCache:
+    """
+    a client-side, content-addressed cache for downloaded media (audio, sheet images and cover art).
+
+    the file bytes are saved under their sha256 digest, and a small index maps a media key (song ID, the song's media
+    version, and the media type) to that digest. this means that two keys with the same content only take up the space
+    once on disk.
+
+    the cache is bounded by size. when it grows above max_size, the least recently used keys are evicted (and their
+    blobs deleted once no other key references them).
+
+    note: songs are never edited after upload, so the server's "media_version" changes only if the song's files change.
+    a key built with an outdated version will simply never be found again, and will be evicted over time.
+
+    a cache hit only changes the key's last_used time, so the index isn't written on every hit. instead, the index is
+    written index_flush_delay seconds after the first hit (batching every hit in between), or with the next put, or by
+    flush. if the client exits before that, only the last few last_used times are lost (which only affects the order
+    of the evictions).
+    """
+
+    def __init__(self, directory: str | None = None, max_size: int = 500 * MEGABYTE, index_flush_delay: float = 5):
+        """:param index_flush_delay: how long (in seconds) after a cache hit the index is written"""
+        if not directory:
+            directory = str(Path.home() / ".jambox" / "media_cache")
+
+        self.directory = directory
+        self.max_size = max_size
+        self.index_flush_delay = index_flush_delay
+
+        self._index_path = os.path.join(self.directory, "index.json")
+
+        self._index: dict[str, dict[str, str | int | float]] | None = None
+        """
+        dict[
+            media key,
+            dict[
+                "digest": str,
+                "size": int,
+                "last_used": float
+            ]
+        ]
+        """
+
+        self._lock = asyncio.Lock()
+
+        # set when the index was changed in memory, but not written yet
+        self._is_index_dirty = False
+        self._index_flush_task: asyncio.Task | None = None
+
+    @staticmethod
+    def create_key(song_id: int, media_version: str, media_type: str, index: int = 0) -> str:
+        """
+        :param song_id: the song's database ID
+        :param media_version: the version that the server sent with the song's preview information
+        :param media_type: "audio", "sheet" or "cover"
+        :param index: the file's index, used for media types that have multiple files (sheets)
+        """
+        return f"{song_id}/{media_version}/{media_type}/{index}"
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    async def _load_index(self):
+        if self._index is not None:
+            return
+
+        await aos.makedirs(self.directory, exist_ok=True)
+
+        try:
+            async with aiofiles.open(self._index_path, "r") as file:
+                self._index = json.loads(await file.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._index = {}
+
+    async def _save_index(self):
+        temp_index_path = f"{self._index_path}.temp"
+
+        async with aiofiles.open(temp_index_path, "w") as file:
+            await file.write(json.dumps(self._index))
+
+        await aos.replace(temp_index_path, self._index_path)
+
+        self._is_index_dirty = False
+
+    def _schedule_index_flush(self):
+        self._is_index_dirty = True
+
+        if self._index_flush_task and not self._index_flush_task.done():
+            return
+
+        self._index_flush_task = asyncio.create_task(self._flush_index_later())
+
+    async def _flush_index_later(self):
+        await asyncio.sleep(self.index_flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        """writes the index if it was changed since it was last written"""
+
+        async with self._lock:
+            if self._is_index_dirty:
+                await self._save_index()
+
+    def _total_size(self) -> int:
+        # the size is counted per blob (and not per key) since keys with the same content share a blob
+        blob_sizes = {entry["digest"]: entry["size"] for entry in self._index.values()}
+        return sum(blob_sizes.values())
+
+    async def _remove_key(self, key: str):
+        entry = self._index.pop(key, None)
+
+        if not entry:
+            return
+
+        digest = entry["digest"]
+
+        # the blob can only be removed once no other key references it
+        if any(other_entry["digest"] == digest for other_entry in self._index.values()):
+            return
+
+        try:
+            await aos.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    async def _evict(self):
+        """removes the least recently used keys until the cache fits inside max_size"""
+
+        least_recently_used = sorted(self._index, key=lambda key: self._index[key]["last_used"])
+
+        for key in least_recently_used:
+            if self._total_size() <= self.max_size:
+                break
+
+            await self._remove_key(key)
+
+    async def get(self, key: str) -> bytes | None:
+        """:returns: the cached bytes of the key, or None if they are not cached (or the cached file is invalid)"""
+
+        async with self._lock:
+            await self._load_index()
+
+            entry = self._index.get(key)
+
+            if not entry:
+                return None
+
+            try:
+                blob_path = self._blob_path(entry["digest"])
+
+                async with span("file.read", bytes=entry["size"]), aiofiles.open(blob_path, "rb") as file:
+                    data = await file.read()
+            except FileNotFoundError:
+                data = None
+
+            # the blob's name is its digest, so we can validate that it wasn't changed or partially written
+            if not data or hashlib.sha256(data).hexdigest() != entry["digest"]:
+                await self._remove_key(key)
+                await self._save_index()
+
+                return None
+
+            entry["last_used"] = time.time()
+            self._schedule_index_flush()
+
+            return data
+
+    async def put(self, key: str, data: bytes) -> str:
+        """
+        saves the data under the given key
+
+        :returns: the data's digest
+        """
+
+        digest = hashlib.sha256(data).hexdigest()
+
+        # files that are larger than the whole cache would immediately evict themselves
+        if len(data) > self.max_size:
+            return digest
+
+        async with self._lock:
+            await self._load_index()
+
+            blob_path = self._blob_path(digest)
+
+            if not await aos.path.exists(blob_path):
+                await aos.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+                temp_blob_path = f"{blob_path}.temp"
+
+                async with span("file.write", bytes=len(data)), aiofiles.open(temp_blob_path, "wb") as file:
+                    await file.write(data)
+
+                await aos.replace(temp_blob_path, blob_path)
+
+            self._index[key] = {
+                "digest": digest,
+                "size": len(data),
+                "last_used": time.time()
+            }
+
+            await self._evict()
+            await self._save_index()
+
+        return digest
+
+    async def contains(self, key: str) -> bool:
+        async with self._lock:
+            await self._load_index()
+
+            return key in self._index
@@ -0,0 +1,181 @@
+import asyncio
+import random
+import secrets
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+
+class RandomSongSampler:
+    """
+    picks random song IDs without sorting the whole song_info table (ORDER BY RANDOM()) on every request.
+
+    all the song IDs are kept in an array (loaded once from the database, then kept up to date by
+    Caches.catalog_caches.CatalogCaches), so that a random song is just a random index into the array.
+
+    every client that scrolls through the random songs gets a "stream". a stream remembers which songs it has already
+    served, so that scrolling never repeats a song until every song was served. the streams are bounded in amount
+    (least recently used streams are removed first), and a stream that was removed simply starts over.
+
+    a stream also starts over once it was served max_served_songs songs, so that a client that keeps scrolling through
+    a large catalog doesn't grow its served set with the whole catalog. the streams' memory is then bounded by
+    max_streams * max_served_songs song IDs, no matter how large the catalog is.
+    """
+
+    def __init__(self, max_streams: int = 1024, max_served_songs: int = 1000):
+        self.max_streams = max_streams
+        self.max_served_songs = max_served_songs
+
+        self._song_ids: list[int] = []
+        self._song_id_indexes: dict[int, int] = {}
+        """
+        dict[song ID -> the song's index inside of self._song_ids], used to remove a song in O(1)
+        """
+
+        self._is_loaded = False
+        self._load_lock = asyncio.Lock()
+
+        self._generation = 0
+        """
+        incremented on every unload, so that a load that fetched the song IDs before the unload fetches them again
+        """
+
+        self._streams: OrderedDict[str, set[int]] = OrderedDict()
+        """
+        OrderedDict[stream ID -> the song IDs that were already served to the stream]
+        """
+
+    async def load(self, fetch_song_ids: Callable[[], Awaitable[list[int]]]):
+        """
+        loads the song IDs if they were not loaded yet
+
+        :param fetch_song_ids: returns all the song IDs in the database (called again after an unload)
+        """
+
+        if self._is_loaded:
+            return
+
+        async with self._load_lock:
+            # another request may have loaded the songs while we were waiting for the lock
+            while not self._is_loaded:
+                generation = self._generation
+
+                song_ids = await fetch_song_ids()
+
+                # unloaded while the song IDs were fetched, so they might already be outdated
+                if generation != self._generation:
+                    continue
+
+                for song_id in song_ids:
+                    self.add(song_id)
+
+                # a stream could have been served songs that were deleted since
+                for served_song_ids in self._streams.values():
+                    served_song_ids.intersection_update(self._song_id_indexes)
+
+                self._is_loaded = True
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._is_loaded
+
+    def unload(self):
+        """forgets the song IDs, so that the next load fetches them again. the streams are kept"""
+
+        self._song_ids.clear()
+        self._song_id_indexes.clear()
+
+        self._is_loaded = False
+        self._generation += 1
+
+    def add(self, song_id: int):
+        if song_id in self._song_id_indexes:
+            return
+
+        self._song_id_indexes[song_id] = len(self._song_ids)
+        self._song_ids.append(song_id)
+
+    def remove(self, song_id: int):
+        index = self._song_id_indexes.pop(song_id, None)
+
+        if index is None:
+            return
+
+        # the last song ID takes the removed song's place, so that nothing has to be shifted
+        last_song_id = self._song_ids.pop()
+
+        if last_song_id != song_id:
+            self._song_ids[index] = last_song_id
+            self._song_id_indexes[last_song_id] = index
+
+        # keeps the served sets as subsets of the song IDs, so that their sizes can be compared
+        for served_song_ids in self._streams.values():
+            served_song_ids.discard(song_id)
+
+    @staticmethod
+    def create_stream_id() -> str:
+        return secrets.token_urlsafe(12)
+
+    def sample(self, stream_id: str, limit: int) -> list[int]:
+        """
+        :param stream_id: the stream that the songs are sampled for (see create_stream_id)
+        :param limit: the maximum amount of songs to sample
+        :returns: up to `limit` random song IDs that the stream was not served yet (since it last started over, see
+        max_served_songs). an empty list means that the stream was served every song.
+        """
+
+        served_song_ids = self._streams.get(stream_id)
+
+        if served_song_ids is None:
+            served_song_ids = set()
+            self._streams[stream_id] = served_song_ids
+
+        # marks the stream as the most recently used one
+        self._streams.move_to_end(stream_id)
+
+        while len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+
+        # the stream starts over, so songs from before this may be served again (a stream that was served every song
+        # still gets an empty list)
+        if self.max_served_songs <= len(served_song_ids) < len(self._song_ids):
+            served_song_ids.clear()
+
+        remaining_amount = len(self._song_ids) - len(served_song_ids)
+
+        if remaining_amount <= 0:
+            return []
+
+        sampled_song_ids: list[int] = []
+
+        if remaining_amount > len(self._song_ids) // 2:
+            # most of the songs were not served yet, so a random pick will rarely hit a served song
+            attempts = limit * 4
+
+            while len(sampled_song_ids) < limit and attempts > 0:
+                attempts -= 1
+
+                song_id = self._song_ids[random.randrange(len(self._song_ids))]
+
+                if song_id in served_song_ids:
+                    continue
+
+                served_song_ids.add(song_id)
+                sampled_song_ids.append(song_id)
+
+        if len(sampled_song_ids) < limit:
+            # when most of the songs were already served, random picks will mostly miss. instead, we go over the
+            # songs that are left and pick from them directly
+            remaining_song_ids = [song_id for song_id in self._song_ids if song_id not in served_song_ids]
+
+            picked_song_ids = random.sample(
+                remaining_song_ids,
+                min(limit - len(sampled_song_ids), len(remaining_song_ids))
+            )
+
+            served_song_ids.update(picked_song_ids)
+            sampled_song_ids.extend(picked_song_ids)
+
+        return sampled_song_ids
+
+    def __len__(self) -> int:
+        return len(self._song_ids)
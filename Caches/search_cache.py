@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class SearchCache:
+    """
+    caches search results by their normalized query (and filters), so that repeated searches (such as the client
+    re-sending the same query while typing or paginating) don't re-run the search queries.
+
+    the cache is bounded both by time (time_to_live, in seconds) and by size (max_entries, least recently used entries
+    are removed first). since any new or deleted song can change the search results, the whole cache is invalidated
+    whenever a song is added or deleted, once the change was committed (see Caches.catalog_caches).
+
+    a search that started before the invalidation could still read the database as it was before the change, so its
+    results are only cached if the cache wasn't invalidated in the meantime (see generation).
+    """
+
+    def __init__(self, time_to_live: float = 60, max_entries: int = 512):
+        self.time_to_live = time_to_live
+        self.max_entries = max_entries
+
+        self._cache: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        """
+        OrderedDict[key -> tuple[expires at timestamp, cached value]]
+        """
+
+        self.generation = 0
+        """
+        incremented on every invalidation. taken before a search runs, and passed to set
+        """
+
+    @staticmethod
+    def normalize_query(search_query: str) -> str:
+        """lowercases the query and removes any extra whitespace, so that similar queries share the same key"""
+        return " ".join(search_query.lower().split())
+
+    @staticmethod
+    def create_key(namespace: str, search_query: str, filters: dict[str, Any] | None = None, **extra) -> tuple:
+        """
+        :param namespace: which search the result belongs to (e.g. "song_ids", "song_info")
+        :param search_query: the search query (it will be normalized)
+        :param filters: the search filters. dict values are turned into sorted tuples so that they can be hashed
+        :param extra: any other parameter that changes the result (such as limit)
+        """
+
+        def freeze(value: Any) -> Any:
+            if isinstance(value, dict):
+                return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+            if isinstance(value, (list, tuple, set)):
+                return tuple(sorted(freeze(item) for item in value))
+
+            return value
+
+        return namespace, SearchCache.normalize_query(search_query), freeze(filters or {}), freeze(extra)
+
+    def get(self, key: tuple) -> Any | None:
+        cached = self._cache.get(key)
+
+        if not cached:
+            return None
+
+        expires_at, value = cached
+
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+
+        # marks the key as the most recently used one
+        self._cache.move_to_end(key)
+
+        return value
+
+    def set(self, key: tuple, value: Any, generation: int | None = None):
+        """
+        :param generation: the generation that was taken before the value was fetched. the value isn't cached if the
+        cache was invalidated since
+        """
+
+        if generation is not None and generation != self.generation:
+            return
+
+        self._cache[key] = (time.monotonic() + self.time_to_live, value)
+        self._cache.move_to_end(key)
+
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def invalidate(self):
+        """removes all the cached search results"""
+        self._cache.clear()
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._cache)
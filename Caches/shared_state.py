@@ -0,0 +1,248 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator
+
+from Utils.structured_logging import get_logger
+
+log = get_logger("shared_state")
+
+# every operation is a single short transaction, so waiting any longer for the write lock means that something is wrong
+# (a stuck worker), and it is better to fail fast than to keep the caller waiting. the sessions and the catalog version
+# are only written on logins, logouts and uploads, so they can wait a little longer than the rate limit (which is
+# checked for most requests)
+BUSY_TIMEOUT_MILLISECONDS = 1000
+RATE_LIMIT_BUSY_TIMEOUT_MILLISECONDS = 100
+
+
+class SharedStateStore:
+    """
+    the sessions, rate limits and catalog version that have to be shared by the server's worker processes (see
+    server.supervise).
+
+    every worker has its own UserCache and RateLimits, but a client that reconnects can land on any worker (the kernel
+    spreads the connections between them), and a user with a few connections must not get a few times the rate limit.
+    so both are kept in a small sqlite database in WAL mode, which every worker opens its own connection to.
+
+    the catalog version is increased whenever a song is added or deleted, so that every worker knows when its search
+    cache and random song sampler are outdated (see Caches.catalog_caches).
+
+    the state is only useful while the server is running, so it isn't synced to disk on every commit (a crash can lose
+    the last few sessions, and those users just log in again).
+
+    a write transaction can wait for another worker's, so every write (and the session lookups, which are done
+    before a request is handled) runs in the store's own thread, off the event loop, and is awaited. only the catalog
+    version is read on the event loop, since a read never waits for a writer in WAL mode.
+    """
+
+    def __init__(self, path: str, session_lifetime: float = 24 * 60 * 60, max_rate_limit_window: float = 60):
+        """
+        :param path: the path of the store's database (the same path has to be given to every worker)
+        :param session_lifetime: how long (in seconds) a session can be resumed after it was created
+        :param max_rate_limit_window: the longest time window in ratelimit.rate_limit_threshold, requests older than
+        it are deleted
+        """
+        self.path = path
+        self.session_lifetime = session_lifetime
+        self.max_rate_limit_window = max_rate_limit_window
+
+        # autocommit, the transactions are started explicitly
+        self._connection = sqlite3.connect(path, isolation_level=None)
+
+        self._connection.execute("PRAGMA journal_mode = WAL;")
+        self._connection.execute("PRAGMA synchronous = OFF;")
+        self._connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MILLISECONDS};")
+
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_token TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at);
+
+            CREATE TABLE IF NOT EXISTS rate_limit_requests (
+                user_id TEXT,
+                endpoint TEXT NOT NULL,
+                requested_at REAL NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_rate_limit_requests_user_endpoint
+            ON rate_limit_requests (user_id, endpoint, requested_at);
+
+            CREATE INDEX IF NOT EXISTS idx_rate_limit_requests_requested_at ON rate_limit_requests (requested_at);
+
+            -- a single row
+            CREATE TABLE IF NOT EXISTS catalog_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            );
+
+            INSERT OR IGNORE INTO catalog_version (id, version) VALUES (0, 0);
+        """)
+
+        # the connections below are only used by the executor's (single) thread. the rate limit has its own connection,
+        # since it fails faster than the rest
+        self._executor_connection = self._connect_executor_connection(BUSY_TIMEOUT_MILLISECONDS)
+        self._rate_limit_connection = self._connect_executor_connection(RATE_LIMIT_BUSY_TIMEOUT_MILLISECONDS)
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+
+    def _connect_executor_connection(self, busy_timeout_milliseconds: int) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+
+        connection.execute("PRAGMA synchronous = OFF;")
+        connection.execute(f"PRAGMA busy_timeout = {busy_timeout_milliseconds};")
+
+        return connection
+
+    async def _run_in_executor(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def reset(self):
+        """forgets every session and request (used by the supervisor before starting the workers)"""
+
+        with self._transaction():
+            self._connection.execute("DELETE FROM sessions")
+            self._connection.execute("DELETE FROM rate_limit_requests")
+
+    async def save_session(self, session_token: str, user_id: str):
+        await self._run_in_executor(self._save_session, session_token, user_id)
+
+    def _save_session(self, session_token: str, user_id: str):
+        connection = self._executor_connection
+
+        with self._transaction(connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_token, user_id, expires_at) VALUES (?, ?, ?)",
+                (session_token, user_id, time.time() + self.session_lifetime)
+            )
+
+        # logins are rare compared to requests, so this is a good time to clean up
+        self._delete_expired()
+
+    async def fetch_session_user(self, session_token: str) -> str | None:
+        """:returns: the user ID of the session, or None if the session doesn't exist (or expired)"""
+        return await self._run_in_executor(self._fetch_session_user, session_token)
+
+    def _fetch_session_user(self, session_token: str) -> str | None:
+        row = self._executor_connection.execute(
+            "SELECT user_id FROM sessions WHERE session_token = ? AND expires_at > ?",
+            (session_token, time.time())
+        ).fetchone()
+
+        return row[0] if row else None
+
+    async def delete_session(self, session_token: str):
+        await self._run_in_executor(self._delete_session, session_token)
+
+    def _delete_session(self, session_token: str):
+        connection = self._executor_connection
+
+        with self._transaction(connection):
+            connection.execute("DELETE FROM sessions WHERE session_token = ?", (session_token,))
+
+    def _delete_expired(self):
+        connection = self._executor_connection
+        current_time = time.time()
+
+        with self._transaction(connection):
+            connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (current_time,))
+            connection.execute(
+                "DELETE FROM rate_limit_requests WHERE requested_at < ?",
+                (current_time - self.max_rate_limit_window,)
+            )
+
+    async def has_reached_rate_limit(self, user_id: str | None, endpoint: str, how_many_requests: int,
+                                     time_window_seconds: float) -> bool:
+        """
+        the same sliding window as RateLimits, shared by every worker: the request is only counted if the limit wasn't
+        reached.
+
+        if another worker holds the write lock for longer than the busy timeout, the request is let through (and not
+        counted), so that a stuck worker can't stop the others from answering requests.
+
+        :returns: whether the user reached the rate limit of the endpoint
+        """
+
+        try:
+            return await self._run_in_executor(
+                self._has_reached_rate_limit,
+                user_id, endpoint, how_many_requests, time_window_seconds
+            )
+        except sqlite3.OperationalError:
+            log.warning("rate limit check failed, letting the request through", sampled=True, endpoint=endpoint)
+            return False
+
+    def _has_reached_rate_limit(self, user_id: str | None, endpoint: str, how_many_requests: int,
+                                time_window_seconds: float) -> bool:
+        current_time = time.time()
+        connection = self._rate_limit_connection
+
+        # the check and the insert are in one write transaction, so two workers can't both let the last request through
+        with self._transaction(connection):
+            # "IS" (and not "=") so that the requests of logged out clients (user ID None) are counted together, like
+            # in RateLimits
+            connection.execute(
+                "DELETE FROM rate_limit_requests WHERE user_id IS ? AND endpoint = ? AND requested_at < ?",
+                (user_id, endpoint, current_time - time_window_seconds)
+            )
+
+            requests_amount, = connection.execute(
+                "SELECT COUNT(*) FROM rate_limit_requests WHERE user_id IS ? AND endpoint = ?",
+                (user_id, endpoint)
+            ).fetchone()
+
+            if requests_amount >= how_many_requests:
+                return True
+
+            connection.execute(
+                "INSERT INTO rate_limit_requests (user_id, endpoint, requested_at) VALUES (?, ?, ?)",
+                (user_id, endpoint, current_time)
+            )
+
+        return False
+
+    def fetch_catalog_version(self) -> int:
+        version, = self._connection.execute("SELECT version FROM catalog_version WHERE id = 0").fetchone()
+        return version
+
+    async def increase_catalog_version(self) -> int:
+        """:returns: the new catalog version"""
+        return await self._run_in_executor(self._increase_catalog_version)
+
+    def _increase_catalog_version(self) -> int:
+        connection = self._executor_connection
+
+        with self._transaction(connection):
+            version, = connection.execute(
+                "UPDATE catalog_version SET version = version + 1 WHERE id = 0 RETURNING version"
+            ).fetchone()
+
+        return version
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+        self._executor_connection.close()
+        self._rate_limit_connection.close()
+        self._connection.close()
+
+    @contextmanager
+    def _transaction(self, connection: sqlite3.Connection | None = None) -> Iterator[None]:
+        connection = connection or self._connection
+
+        # BEGIN IMMEDIATE takes the write lock right away, so a transaction that reads before writing can't fail halfway
+        # with "database is locked" because another worker wrote in between
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        connection.execute("COMMIT")
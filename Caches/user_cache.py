@@ -1,6 +1,11 @@
 import asyncio
+import sqlite3
 from dataclasses import dataclass
 from Caches.client_cache import Address
+from Caches.shared_state import SharedStateStore
+from Utils.structured_logging import get_logger
+
+log = get_logger("shared_state")
 
 
 @dataclass
@@ -53,6 +58,13 @@ class UserCache:
 
         self._lock = asyncio.Lock()
 
+        # when the server runs as multiple workers, the sessions are also saved in the shared store, so that a client
+        # can resume its session on whichever worker it reconnects to (see resume_session)
+        self._shared_store: SharedStateStore | None = None
+
+    def use_shared_store(self, shared_store: SharedStateStore):
+        self._shared_store = shared_store
+
     async def add(self, cache_item: UserCacheItem):
         """Add a Cache Item to the UserCache dictionary"""
         user_session_token: str = cache_item.session_token
@@ -66,6 +78,55 @@ class UserCache:
             # address is a requirement for UserCacheItem meaning we don't need to check for it
             self._cache_via_address[user_address] = cache_item
 
+        if user_session_token and self._shared_store:
+            try:
+                await self._shared_store.save_session(user_session_token, cache_item.user_id)
+            except sqlite3.OperationalError:
+                # the session still works on this worker, the client only has to log in again if it reconnects to
+                # another one
+                log.warning("failed to save a session to the shared store")
+
+    def needs_session_lookup(self, address: Address, token: str | None) -> bool:
+        """
+        :returns: whether the token is a session that this worker doesn't know, which might exist in the shared store
+        (it was created by another worker, or by an earlier connection of the client). see resume_session
+        """
+
+        if not token or not self._shared_store or token in self._cache_dict:
+            return False
+
+        user_data = self._cache_via_address.get(address)
+
+        # a connection that is already logged in keeps its own session
+        return bool(user_data) and not user_data.session_token
+
+    async def resume_session(self, address: Address, token: str):
+        """
+        attaches a session that this worker doesn't know to the client's connection, if the session exists in the shared
+        store (see needs_session_lookup).
+        """
+
+        if not self.needs_session_lookup(address, token):
+            return
+
+        try:
+            user_id = await self._shared_store.fetch_session_user(token)
+        except sqlite3.OperationalError:
+            # the session is treated as unknown, the client can log in again
+            log.warning("failed to look up a session in the shared store")
+            return
+
+        # the connection could have logged in (or disconnected) while the session was looked up
+        if user_id is None or not self.needs_session_lookup(address, token):
+            return
+
+        user_data = self._cache_via_address[address]
+
+        user_data.session_token = token
+        user_data.user_id = user_id
+
+        self._cache_dict[token] = user_data
+
     def is_valid_session(self, token: str):
         """
         returns True when:
@@ -104,12 +165,42 @@ class UserCache:
         self._cache_dict.pop(session_token, None)
         self._cache_via_address.pop(address, None)
 
-    def logout(self,  item: str | Address):
+    async def remove(self, address: Address):
+        """removes the client's cache item (used when the client disconnects)"""
+
+        # the item is added by a task, so removing it under the same lock makes sure that it isn't added back after
+        async with self._lock:
+            user_data = self._cache_via_address.pop(address, None)
+
+            if user_data and user_data.session_token:
+                self._cache_dict.pop(user_data.session_token, None)
+
+    def count_disconnected(self, connected_addresses: set[Address]) -> int:
+        """:returns: the amount of cache items whose client is no longer connected (they should have been removed)"""
+
+        return sum(1 for address in self._cache_via_address if address not in connected_addresses)
+
+    def __len__(self) -> int:
+        return len(self._cache_via_address)
+
+    async def logout(self,  item: str | Address):
         user_data = self.__getitem__(item)
+        session_token = user_data.session_token
+
+        # the session token is no longer valid, on any worker
+        if session_token:
+            self._cache_dict.pop(session_token, None)
 
         user_data.user_id = None
         user_data.session_token = None
 
+        if session_token and self._shared_store:
+            try:
+                await self._shared_store.delete_session(session_token)
+            except sqlite3.OperationalError:
+                # the session expires by itself after SharedStateStore.session_lifetime
+                log.warning("failed to delete a session from the shared store")
+
 # this is an object for the client-side, just to neatly keep track of crucial stuff
 @dataclass
 class ClientSideUserCache:
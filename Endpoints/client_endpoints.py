@@ -2,13 +2,16 @@ import logging
 from typing import Callable
 from client_actions import (
     complete_authentication,
+    answer_heartbeat,
     user_login,
     song_upload_finish,
     DownloadSong,
     buffer_audio,
     load_sheet_images,
+    load_song_preview_cursor,
     load_genre_browser,
     load_song_comments,
+    load_new_song_comment,
     upload_song_search_info,
     upload_user_statistics
 )
@@ -20,14 +23,17 @@ class EndPoints:
 
         self.endpoints: dict[str, Callable] = {
             "authentication/key_exchange": complete_authentication,
+            "connection/heartbeat": answer_heartbeat,
             "user/login": user_login,
             "song/upload/finish": song_upload_finish,
             "song/download/preview": download_song_state.download_preview_details,
             "song/download/preview/file": download_song_state.download_preview_chunks,
+            "song/download/preview/cursor": load_song_preview_cursor,
             "song/download/audio": buffer_audio,
             "song/download/sheet": load_sheet_images,
             "song/genres": load_genre_browser,
             "song/comments": load_song_comments,
+            "song/comments/new": load_new_song_comment,
             "song/search": upload_song_search_info,
             "user/statistics": upload_user_statistics
         }
@@ -1,5 +1,5 @@
 from typing import Callable
-from client_server_errors import pre_message_error, login_error, signup_error, song_upload_error
+from client_server_errors import pre_message_error, login_error, signup_error, song_upload_error, song_preview_error
 
 
 class ErrorEndPoints:
@@ -13,6 +13,10 @@ class ErrorEndPoints:
             "song/upload/finish/error": song_upload_error,
             "song/upload/error": song_upload_error,
             "song/upload/file/error": song_upload_error,
+            "song/download/preview/error": song_preview_error,
+            "song/recommended/download/preview/error": song_preview_error,
+            "song/genres/download/preview/error": song_preview_error,
+            "song/favorite/download/preview/error": song_preview_error,
         }
         # endpoint -> function
 
@@ -1,6 +1,7 @@
 from typing import Callable
 from server_actions import (
     authenticate_client,
+    answer_heartbeat,
     user_signup,
     user_login,
     user_signup_and_login,
@@ -15,6 +16,7 @@ from server_actions import (
     send_songs_by_genre,
     send_song_comments,
     upload_song_comment,
+    unsubscribe_song_comments,
     search_for_songs_by_name,
     get_user_statistics,
     delete_song_request,
@@ -25,6 +27,7 @@ from server_actions import (
     send_songs_by_upload,
     send_songs_by_favorite,
     change_favorite,
+    control_profiler,
 )
 
 from dataclasses import dataclass
@@ -63,6 +66,9 @@ class EndPoints:
         # of the cache, this means we cannot create multiple instances of EndPoints to be used in the same application
         upload_song_cache: UploadSong = UploadSong()
 
+        # the server releases the unfinished uploads of disconnected clients through this reference
+        self.upload_song_cache = upload_song_cache
+
         # these are the endpoints where the client sends to the server
         self.endpoints: dict[str, tuple["EndPointRequires", Callable]] = {
             # authentication/key_exchange is used to share the encryption key between the server and client.
@@ -71,6 +77,13 @@ class EndPoints:
                 authenticate_client
             ),
 
+            # connection/heartbeat is the client's answer to the server's heartbeat, so that it isn't disconnected for
+            # being idle. it never requires authentication, since logged out clients are sent heartbeats as well
+            "connection/heartbeat": (
+                EndPointRequires(method="respond", authentication=False),
+                answer_heartbeat
+            ),
+
             # user/signup is used to create a new user account.
             "user/signup": (
                 EndPointRequires(method="post", authentication=False),
@@ -174,6 +187,12 @@ class EndPoints:
                 upload_song_comment
             ),
 
+            # song/comments/unsubscribe stops pushing a song's new comments to the client
+            "song/comments/unsubscribe": (
+                EndPointRequires(method="post", authentication=True),
+                unsubscribe_song_comments
+            ),
+
             "song/search": (
                 EndPointRequires(method="get", authentication=True),
                 search_for_songs_by_name
@@ -208,6 +227,12 @@ class EndPoints:
                 EndPointRequires(method="delete", authentication=True),
                 delete_user_request
             ),
+
+            # admin/profiler starts and stops the sampling profiler (only for the users in ADMIN_USER_IDS)
+            "admin/profiler": (
+                EndPointRequires(method="post", authentication=True),
+                control_profiler
+            ),
         }
         # endpoint -> (requirements, function)
 
@@ -5,7 +5,9 @@ import asyncio
 import time
 
 import aiofiles
-import asqlite
+from Utils.sqlite3_ext import DatabasePool
+from Utils.tracing import span
+from Utils.structured_logging import get_logger
 
 from Utils.chunk import FileTypes
 from FileSystem.file_extension import Extension
@@ -18,14 +20,20 @@ from MediaHandling.images import compress_to_webp, compress_to_low_res_webp
 
 from Errors.raised_errors import InvalidCodec
 
+log = get_logger("file_system")
+
 
 class System:
-    def __init__(self, db_pool: asqlite.Pool):
+    # the directory that every new System saves its clusters under. a System is created for every upload, so the server
+    # changes this once on startup when it is given a different storage directory (see server.main)
+    default_main_directory = "SavedFiles"
+
+    def __init__(self, db_pool: DatabasePool):
         self.db_pool = db_pool
 
         # setting default values inside the __init__ so that its clear that these shouldn't just be chosen randomly.
         # to change their value, check the set_... functions.
-        self._main_directory = "SavedFiles"
+        self._main_directory = System.default_main_directory
         self._cluster_size = 100
 
     # I have created set_... for directory and cluster size so that it is clear that these values are not "just" part of the constructor.
@@ -111,7 +119,7 @@ class System:
         cluster_id = await self._create_cluster_id()
 
         # 2) save cluster
-        async with self.db_pool.acquire() as connection:
+        async with self.db_pool.acquire_writer() as connection:
             await FileSystem.create_new_cluster(connection=connection, cluster_id=cluster_id)
 
         # 3) create cluster under dir (main_dir/cluster_id)
@@ -146,7 +154,7 @@ class System:
         # create a random file ID to save the file under
         file_id = await self._create_file_id()
 
-        print(f"created IDs: {save_directory}/{file_id}")
+        log.debug("created a file ID", save_directory=save_directory, file_id=file_id)
 
         return save_directory, cluster_id, file_id
 
@@ -165,7 +173,12 @@ class System:
             # saves the file under main_dir/cluster_dir/file_id
             await chunk.save()
         except Exception as e:
-            print(f"error: {e}: save dir: {chunk.save_directory}, file ID: {chunk.file_id}, user ID: {uploaded_by_id}")
+            log.exception(
+                "failed to save the chunk",
+                save_directory=chunk.save_directory,
+                file_id=chunk.file_id,
+                user_id=uploaded_by_id
+            )
             raise e
 
         if is_last_chunk:
@@ -340,7 +353,7 @@ class FileChunk:
         return None, None
 
     async def _write(self, path: str):
-        async with aiofiles.open(path, "ab") as file:
+        async with span("file.write", bytes=len(self.chunk)), aiofiles.open(path, "ab") as file:
             await file.write(self.chunk)
 
     async def save(self, last_chunk_number: int | None = None) -> str:
@@ -410,9 +423,12 @@ class BaseFile:
 
         # read bytes if a path is passed
         if self.path:
-            async with aiofiles.open(self.path, "rb") as file:
+            async with span("file.read") as read_span, aiofiles.open(self.path, "rb") as file:
                 self._file = await file.read()
 
+                if read_span:
+                    read_span.set(bytes=len(self._file))
+
         self.file_type, self.file_extension = Extension(self._file).get_file_type()
 
         # set the loaded trigger to True after loading the file.
@@ -434,7 +450,7 @@ class BaseFile:
 
         try:
             # write bytes
-            async with aiofiles.open(path, "wb") as file:
+            async with span("file.write", bytes=len(self._file)), aiofiles.open(path, "wb") as file:
                 await file.write(self._file)
         except Exception as e:
             logging.error(e, exc_info=True)
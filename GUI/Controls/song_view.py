@@ -16,8 +16,10 @@ from GUI.Controls.subwindow import SubWindow
 
 from encryptions import EncryptedTransport
 from Caches.user_cache import ClientSideUserCache
+from Caches.media_cache import MediaCache
 
 from Utils.format import format_length_from_milliseconds
+from Utils.chunk_assembler import ChunkAssembler
 
 from pseudo_http_protocol import ClientMessage
 
@@ -157,7 +159,7 @@ class SongPlayer(ft.Container):
         self.progress_bar.update()
 
     async def _play_audio(self, *args):
-        self.load_audio()
+        await self.load_audio()
 
         if not hasattr(self, "audio_player") or not self.audio_player:
             return
@@ -198,12 +200,18 @@ class SongPlayer(ft.Container):
 
 
 class SheetView(ft.Container):
-    def __init__(self, **kwargs):
+    def __init__(self, on_sheet_loaded: typing.Callable | None = None, **kwargs):
         super().__init__(**kwargs)
 
+        # called with (sheet index, sheet bytes) once a full sheet image arrives, used to save it to the media cache
+        self.on_sheet_loaded = on_sheet_loaded
+
         self.sheet_images: list[tuple[str, ft.Container]] = []
         """list[tuple[file id, sheet image]]]"""
 
+        # the sheet chunks are gathered here and only rendered once the full image arrives
+        self.chunk_assembler = ChunkAssembler()
+
         self.expand = True
 
         self.sheet_row: ft.GridView = ft.GridView(
@@ -254,7 +262,9 @@ class SheetView(ft.Container):
 
         return None
 
-    def add_chunk(self, file_id: str, song_id: int, b64_chunk: str, is_last_chunk: bool = False):
+    def add_chunk(self, file_id: str, song_id: int, b64_chunk: str, is_last_chunk: bool = False,
+                  is_cached: bool = False):
+        """:param is_cached: whether the sheet was loaded from the media cache (so it isn't saved to the cache again)"""
         if not self.has_started_loading:
             self.content = ft.Container(
                 ft.Column(
@@ -281,18 +291,17 @@ class SheetView(ft.Container):
             image_container = ft.Container(
                 width=150,
                 height=200,
-                content=ft.Image(
-                    src_base64=b64_chunk,
-                    fit=ft.ImageFit.FILL,
-                    width=150,
-                    height=200,
-                    border_radius=10,
-                    gapless_playback=True,
-                ),
                 on_click=self._upsize_image,
                 border_radius=10,
                 bgcolor=ft.Colors.GREY_600,
-                border=ft.border.all(width=2, color=ft.Colors.GREY_400)
+                border=ft.border.all(width=2, color=ft.Colors.GREY_400),
+                alignment=ft.Alignment(0, 0),
+                content=ft.ProgressRing(
+                    color=ft.Colors.GREY_300,
+                    stroke_width=2,
+                    width=20,
+                    height=20,
+                )
             )
 
             self.sheet_images.append(
@@ -300,14 +309,34 @@ class SheetView(ft.Container):
             )
 
             self.sheet_row.controls.append(image_container)
-        else:
-            image: ft.Image = image_container.content
-            image.src_base64 += b64_chunk
 
-        self.update()
+            self.update()
+
+        b64_image = self.chunk_assembler.add_chunk(file_id, b64_chunk, is_last_chunk)
+
+        # the image is only rebuilt (and sent to flet) when the assembler decides it should be rendered
+        if b64_image is None:
+            return
+
+        image_container.content = ft.Image(
+            src_base64=b64_image,
+            fit=ft.ImageFit.FILL,
+            width=150,
+            height=200,
+            border_radius=10,
+            gapless_playback=True,
+        )
+
+        image_container.update()
+
+        if is_last_chunk and self.on_sheet_loaded and not is_cached:
+            sheet_index = [saved_file_id for saved_file_id, _ in self.sheet_images].index(file_id)
+            self.on_sheet_loaded(sheet_index, base64.b64decode(b64_image))
 
 
 class CommentView(ft.Container):
+    COMMENTS_PAGE_SIZE = 50
+
     def __init__(self, transport: EncryptedTransport, user_cache: ClientSideUserCache, song_id: int, **kwargs):
         super().__init__(**kwargs)
 
@@ -327,7 +356,20 @@ class CommentView(ft.Container):
         ]
         """
 
-        self.comments_exclude_ids: list[int] = []
+        self.comments_cursor: str | None = None
+        """the cursor that the server sent with the last comments, used to request the comments after them"""
+
+        self.comment_ids: set[int] = set()
+        """the IDs of the shown comments, a pushed comment can also be a part of a later page"""
+
+        self.is_waiting_for_comments: bool = False
+        self.has_loaded_last_page: bool = False
+
+        self.is_waiting_for_new_comments: bool = False
+        """whether the comments that are being waited for are the ones since the newest shown comment (see open)"""
+
+        self.is_reopened_while_waiting: bool = False
+        """the view was reopened before the last requested comments arrived, so it has to catch up once they do"""
 
         self.temporary_comments: list[ft.Container] = []
         """these are for comments that we add during the open view, and need to be removed when closing and reopening"""
@@ -360,6 +402,7 @@ class CommentView(ft.Container):
             spacing=5,
             padding=5,
             expand=True,
+            on_scroll=self._automatically_load_more
         )
 
         self.username_colors_cache: dict[str, str] = {}
@@ -480,13 +523,69 @@ class CommentView(ft.Container):
         self.update()
 
     def close(self):
+        self.is_reopened_while_waiting = False
+
         for comment in self.temporary_comments:
             try:
                 self.comment_list.controls.remove(comment)
             except ValueError:
                 pass
 
-    def add_comments(self, comments: list[dict], ai_summary: str):
+        # the view is closed, so there is no need for the server to keep pushing new comments
+        self.transport.write(
+            ClientMessage(
+                authentication=self.user_cache.session_token,
+                method="POST",
+                endpoint="song/comments/unsubscribe",
+                payload={
+                    "song_id": self.song_id
+                }
+            ).encode()
+        )
+
+    def open(self):
+        """
+        called whenever the view is shown. the first time, the first page of comments is requested. after that, only the
+        comments since the newest shown comment are, since the server only pushes a new comment to the clients that are
+        connected to the same worker as the uploader (see server.supervise), and nothing is pushed while the view is
+        closed
+        """
+
+        # a second request would be mistaken for the one that is still waited for (both are answered on song/comments)
+        if self.is_waiting_for_comments:
+            self.is_reopened_while_waiting = True
+            return
+
+        if self.comment_ids:
+            self.request_new_comments()
+        else:
+            self.request_comments()
+
+    def add_comments(self, comments: list[dict], ai_summary: str, cursor: str | None = None):
+        self.is_waiting_for_comments = False
+
+        if self.is_waiting_for_new_comments:
+            self.is_waiting_for_new_comments = False
+
+            # the cursor isn't kept, since it points after the newest comment, and would skip the pages that weren't
+            # loaded yet
+            self._add_new_comments(comments)
+
+            # a full page means that there may be even newer comments
+            if len(comments) == self.COMMENTS_PAGE_SIZE:
+                self.request_new_comments()
+            else:
+                self._catch_up_if_reopened()
+
+            return
+
+        if cursor:
+            self.comments_cursor = cursor
+
+        # the comments are requested again when the view is reopened (or scrolled to the end), a partial page means
+        # there are no more comments for now
+        self.has_loaded_last_page = len(comments) < self.COMMENTS_PAGE_SIZE
+
         if not self.loaded_ai_comment:
             ai_summary_view = ft.Container(
                 content=ft.Column(
@@ -509,7 +608,9 @@ class CommentView(ft.Container):
 
             self.loaded_ai_comment = True
 
-        if len(comments) == 0 and len(self.comments) == 0:
+        if comments:
+            self._remove_no_comments_placeholder()
+        elif len(self.comments) == 0 and not self._is_showing_no_comments_placeholder():
             no_comments_found = ft.Container(
                 ft.Text("No Comments Found"),
                 expand_loose=True,
@@ -521,71 +622,111 @@ class CommentView(ft.Container):
             self.comment_list.controls.append(no_comments_found)
 
         for comment in comments:
-            self.comments.append(comment)
+            self._add_comment_view(comment)
 
-            comment_id: int = comment["comment_id"]
-            self.comments_exclude_ids.append(comment_id)
+        self.comment_list.update()
 
-            content: str = comment["text"]
-            uploaded_by: str = comment["uploaded_by"]
-            uploaded_by_display_name: str = comment["uploaded_by_display"]
-            uploaded_at: int = comment["uploaded_at"]
+        self._catch_up_if_reopened()
 
-            # this is basically the same as comparing user IDs
-            is_own_comment = uploaded_by == self.user_cache.username
+    def _catch_up_if_reopened(self):
+        if not self.is_reopened_while_waiting:
+            return
 
-            comment_content_view = ft.Container(
-                content=ft.Row(
-                    [
-                        ft.Container(
-                            content=ft.Text(uploaded_by_display_name[0]),
-                            bgcolor=self._string_to_hex_color(uploaded_by),
-                            border_radius=360,
-                            alignment=ft.Alignment(0, 0),
-                            width=40,
-                            height=40
-                        ),
-                        ft.Column(
-                            [
-                                ft.Row(
-                                    [
-                                        ft.Row(
-                                            [
-                                                ft.Text(uploaded_by_display_name),
-                                                ft.Text(self._convert_timestamp(uploaded_at), color=ft.Colors.GREY_500,
-                                                        size=10)
-                                            ]
-                                        )
-                                    ],
-                                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN
-                                ),
-                                ft.Text(content)
-                            ],
-                            expand=True,
-                            expand_loose=True,
-                        )
-                    ],
-                    vertical_alignment=ft.CrossAxisAlignment.START
-                ),
-                width=200,
-                bgcolor=ft.Colors.GREY_200,
-                border_radius=10,
-                padding=10,
-                data=comment_id
-            )
+        self.is_reopened_while_waiting = False
+
+        # close() unsubscribed the view after the request was sent, so the view is subscribed again by requesting
+        self.open()
+
+    def _is_showing_no_comments_placeholder(self) -> bool:
+        return bool(self.comment_list.controls) and self.comment_list.controls[-1].data == 999
+
+    def _remove_no_comments_placeholder(self):
+        if self._is_showing_no_comments_placeholder():
+            self.comment_list.controls.pop(-1)
+
+    def add_new_comment(self, comment: dict):
+        """adds a comment that the server pushed (a comment that another user just uploaded)"""
+
+        self._add_new_comments([comment])
 
-            if is_own_comment:
-                comment_content_view.content.controls[1].controls[0].controls.append(
+    def _add_new_comments(self, comments: list[dict]):
+        if not comments:
+            return
+
+        self._remove_no_comments_placeholder()
+
+        for comment in comments:
+            self._add_comment_view(comment)
+
+        self.comment_list.update()
+
+    def _add_comment_view(self, comment: dict):
+        comment_id: int = comment["comment_id"]
+
+        if comment_id in self.comment_ids:
+            return
+
+        self.comment_ids.add(comment_id)
+        self.comments.append(comment)
+
+        content: str = comment["text"]
+        uploaded_by: str = comment["uploaded_by"]
+        uploaded_by_display_name: str = comment["uploaded_by_display"]
+        uploaded_at: int = comment["uploaded_at"]
+
+        # this is basically the same as comparing user IDs
+        is_own_comment = uploaded_by == self.user_cache.username
+
+        comment_content_view = ft.Container(
+            content=ft.Row(
+                [
                     ft.Container(
-                        ft.Icon(ft.Icons.DELETE, color=ft.Colors.RED_700),
-                        on_click=self._delete_comment,
-                        data=comment_content_view
+                        content=ft.Text(uploaded_by_display_name[0]),
+                        bgcolor=self._string_to_hex_color(uploaded_by),
+                        border_radius=360,
+                        alignment=ft.Alignment(0, 0),
+                        width=40,
+                        height=40
+                    ),
+                    ft.Column(
+                        [
+                            ft.Row(
+                                [
+                                    ft.Row(
+                                        [
+                                            ft.Text(uploaded_by_display_name),
+                                            ft.Text(self._convert_timestamp(uploaded_at), color=ft.Colors.GREY_500,
+                                                    size=10)
+                                        ]
+                                    )
+                                ],
+                                alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                            ),
+                            ft.Text(content)
+                        ],
+                        expand=True,
+                        expand_loose=True,
                     )
-                )
+                ],
+                vertical_alignment=ft.CrossAxisAlignment.START
+            ),
+            width=200,
+            bgcolor=ft.Colors.GREY_200,
+            border_radius=10,
+            padding=10,
+            data=comment_id
+        )
 
-            self.comment_list.controls.append(comment_content_view)
+        if is_own_comment:
+            comment_content_view.content.controls[1].controls[0].controls.append(
+                ft.Container(
+                    ft.Icon(ft.Icons.DELETE, color=ft.Colors.RED_700),
+                    on_click=self._delete_comment,
+                    data=comment_content_view
+                )
+            )
 
-        self.comment_list.update()
+        self.comment_list.controls.append(comment_content_view)
 
     def _delete_comment(self, event: ft.ControlEvent):
         comment = event.control.data
@@ -607,18 +748,53 @@ class CommentView(ft.Container):
         self.comment_list.update()
 
     def request_comments(self):
+        self.is_waiting_for_comments = True
+
         self.transport.write(
             ClientMessage(
                 authentication=self.user_cache.session_token,
                 method="GET",
                 endpoint="song/comments",
                 payload={
-                    "exclude": self.comments_exclude_ids,
-                    "song_id": self.song_id
+                    "cursor": self.comments_cursor,
+                    "song_id": self.song_id,
+                    "limit": self.COMMENTS_PAGE_SIZE,
+                    # new comments are pushed while the view is open (until close() is called)
+                    "subscribe": True
                 }
             ).encode()
         )
 
+    def request_new_comments(self):
+        """requests the comments that were uploaded since the newest shown comment"""
+
+        self.is_waiting_for_comments = True
+        self.is_waiting_for_new_comments = True
+
+        self.transport.write(
+            ClientMessage(
+                authentication=self.user_cache.session_token,
+                method="GET",
+                endpoint="song/comments",
+                payload={
+                    "since_comment_id": max(self.comment_ids),
+                    "song_id": self.song_id,
+                    "limit": self.COMMENTS_PAGE_SIZE,
+                    # close() unsubscribed the view
+                    "subscribe": True
+                }
+            ).encode()
+        )
+
+    def _automatically_load_more(self, e: ft.OnScrollEvent):
+        if e.pixels != e.max_scroll_extent:
+            return
+
+        if self.is_waiting_for_comments or self.has_loaded_last_page:
+            return
+
+        self.request_comments()
+
 
 class SongView(ft.AlertDialog):
     def __init__(
@@ -635,6 +811,7 @@ class SongView(ft.AlertDialog):
             is_favorite_song: bool,
             uploaded_by: str,
             song_data: dict,
+            media_cache: MediaCache | None = None,
             **kwargs
     ):
         super().__init__(**kwargs)
@@ -643,6 +820,11 @@ class SongView(ft.AlertDialog):
         self.transport = transport
         self.user_cache = user_cache
 
+        # the local media cache. media is only cached if the server sent a media version for the song
+        self.media_cache = media_cache
+        self.media_version: str = song_data.get("media_version", "")
+        self.sheet_count: int = song_data.get("sheet_count", 0)
+
         self.audio_player = fta.Audio(
             src_base64="0",
             data={"playing": False},
@@ -783,7 +965,7 @@ class SongView(ft.AlertDialog):
         self.is_viewing_comments = False
         self.is_viewing_sheets = False
 
-        self.sheet_music_view_control = SheetView()
+        self.sheet_music_view_control = SheetView(on_sheet_loaded=self._cache_sheet_image)
         self.has_loaded_sheets = False
 
         self.comment_view = CommentView(
@@ -795,7 +977,7 @@ class SongView(ft.AlertDialog):
         self.content = self.view
         self.on_dismiss = self._on_dismiss
 
-    def _open_sheet_music_popup(self, event):
+    async def _open_sheet_music_popup(self, event):
         if self.is_viewing_sheets:
             return
 
@@ -813,7 +995,7 @@ class SongView(ft.AlertDialog):
 
         self.update()
 
-        self._request_song_sheet_chunks()
+        await self._request_song_sheet_chunks()
 
     def _open_comment_view_popup(self, event):
         if self.is_viewing_comments:
@@ -833,7 +1015,7 @@ class SongView(ft.AlertDialog):
 
         self.update()
 
-        self.comment_view.request_comments()
+        self.comment_view.open()
 
     def _close_sheet_music_popup(self):
         self.is_viewing_sheets = False
@@ -857,6 +1039,12 @@ class SongView(ft.AlertDialog):
         if not self.is_waiting_for_local_download:
             self.audio_player.update()
 
+        if is_last_chunk and self.media_cache and self.media_version:
+            await self.media_cache.put(
+                MediaCache.create_key(self.song_id, self.media_version, "audio"),
+                base64.b64decode(self.audio_player.src_base64)
+            )
+
         if is_last_chunk and self.is_waiting_for_local_download:
             self.view.controls.remove(self.downloading_audio_cover)
             self.view.update()
@@ -866,13 +1054,22 @@ class SongView(ft.AlertDialog):
     async def stream_sheet_chunks(self, file_id: str, song_id: int, b64_chunk: str, is_last_chunk: bool = False):
         self.sheet_music_view_control.add_chunk(file_id, song_id, b64_chunk, is_last_chunk)
 
-    async def add_comments(self, comments: list[dict], ai_summary: str):
-        self.comment_view.add_comments(comments, ai_summary=ai_summary)
+    async def add_comments(self, comments: list[dict], ai_summary: str, cursor: str | None = None):
+        self.comment_view.add_comments(comments, ai_summary=ai_summary, cursor=cursor)
+
+    async def add_new_comment(self, song_id: int, comment: dict):
+        if not song_id == self.song_id or not self.is_viewing_comments:
+            return
+
+        self.comment_view.add_new_comment(comment)
 
     def _on_dismiss(self, *args):
         self.audio_player.pause()
         self.audio_player.release()
 
+        if self.is_viewing_comments:
+            self._close_comment_popup()
+
         self.audio_player.update()
 
         if hasattr(self.page, "view"):
@@ -932,19 +1129,46 @@ class SongView(ft.AlertDialog):
     async def _locally_download_audio(self, *args):
         self.is_waiting_for_local_download = True
 
-        if self.audio_player.src_base64 == "0":
+        if self.audio_player.src_base64 == "0" and not await self._load_cached_audio():
             self.view.controls.append(self.downloading_audio_cover)
             self.update()
 
-            self._request_song_chunks()
+            await self._request_song_chunks()
         else:
             await self._download_audio()
 
-    def _request_song_chunks(self):
+    async def _load_cached_audio(self) -> bool:
+        """
+        loads the song's audio from the local media cache (if it was cached)
+
+        :returns: whether the audio was loaded from the cache
+        """
+        if not self.media_cache or not self.media_version:
+            return False
+
+        audio_bytes = await self.media_cache.get(
+            MediaCache.create_key(self.song_id, self.media_version, "audio")
+        )
+
+        if not audio_bytes:
+            return False
+
+        self.audio_player.src_base64 = base64.b64encode(audio_bytes).decode()
+
+        if not self.is_waiting_for_local_download:
+            self.audio_player.update()
+
+        return True
+
+    async def _request_song_chunks(self):
         # if the src == "0" it means the song wasn't loaded yet
         if self.audio_player.src_base64 != "0":
             return
 
+        # the audio is only requested from the server if it isn't cached locally
+        if not self.is_waiting_for_local_download and await self._load_cached_audio():
+            return
+
         self.transport.write(
             ClientMessage(
                 authentication=self.user_cache.session_token,
@@ -988,10 +1212,58 @@ class SongView(ft.AlertDialog):
 
         self.favorite_song_icon.update()
 
-    def _request_song_sheet_chunks(self):
+    async def _load_cached_sheet_images(self) -> bool:
+        """
+        loads the song's sheet images from the local media cache. the images are only loaded if all of them are cached.
+
+        :returns: whether the sheet images were loaded from the cache
+        """
+        if not self.media_cache or not self.media_version or not self.sheet_count:
+            return False
+
+        sheet_images: list[bytes] = []
+        for sheet_index in range(self.sheet_count):
+            sheet_bytes = await self.media_cache.get(
+                MediaCache.create_key(self.song_id, self.media_version, "sheet", sheet_index)
+            )
+
+            if not sheet_bytes:
+                return False
+
+            sheet_images.append(sheet_bytes)
+
+        for sheet_index, sheet_bytes in enumerate(sheet_images):
+            self.sheet_music_view_control.add_chunk(
+                file_id=f"cached-{self.song_id}-{sheet_index}",
+                song_id=self.song_id,
+                b64_chunk=base64.b64encode(sheet_bytes).decode(),
+                is_last_chunk=True,
+                is_cached=True
+            )
+
+        return True
+
+    def _cache_sheet_image(self, sheet_index: int, sheet_bytes: bytes):
+        if not self.media_cache or not self.media_version:
+            return
+
+        asyncio.create_task(
+            self.media_cache.put(
+                MediaCache.create_key(self.song_id, self.media_version, "sheet", sheet_index),
+                sheet_bytes
+            )
+        )
+
+    async def _request_song_sheet_chunks(self):
         if self.has_loaded_sheets:
             return
 
+        self.has_loaded_sheets = True
+
+        # the sheets are only requested from the server if they aren't cached locally
+        if await self._load_cached_sheet_images():
+            return
+
         self.transport.write(
             ClientMessage(
                 authentication=self.user_cache.session_token,
@@ -1002,5 +1274,3 @@ class SongView(ft.AlertDialog):
                 }
             ).encode()
         )
-
-        self.has_loaded_sheets = True
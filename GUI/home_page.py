@@ -6,6 +6,8 @@ from Caches.user_cache import ClientSideUserCache
 from GUI.Controls.navigation_sidebar import NavigationSidebar
 from GUI.Controls.song_view import SongView
 
+from Utils.chunk_assembler import ChunkAssembler
+
 from pseudo_http_protocol import ClientMessage
 
 import hashlib
@@ -15,6 +17,14 @@ import logging
 
 
 class HomePage:
+    # the endpoints whose pages are requested using the cursor sent by the server (instead of an exclude list)
+    CURSOR_PAGINATED_ENDPOINTS = {
+        "song/download/preview",
+        "song/recommended/download/preview",
+        "song/genres/download/preview",
+        "song/favorite/download/preview",
+    }
+
     def __init__(self, page: ft.Page):
         self.page = page
         self.page.padding = 0
@@ -41,6 +51,9 @@ class HomePage:
 
         self.loading_song_items: dict[str, ft.Container] = {}
 
+        # the cover art chunks are gathered per file ID, and are only rendered when the cover fully arrives
+        self.cover_art_assembler = ChunkAssembler()
+
         self.loaded_song_ids: list[int] = []
         """
             this list is the "exclude" list.
@@ -89,6 +102,24 @@ class HomePage:
         self.navigate_data = {}
         """the data that the current navigate tab is on, this is used for the "load more" button"""
 
+        self.page_cursor: str | None = None
+        """the cursor that the server sent for the next page of the current tab (None means the first page)"""
+
+        self.has_loaded_last_page = False
+        """set when the server sends an empty cursor, meaning that there are no more songs to load in the current tab"""
+
+        self.is_waiting_for_page_cursor = False
+        """
+            set while a page was requested but its cursor has not arrived yet. requesting another page in the meantime 
+            would request the same page twice (since the cursor has not changed yet)
+        """
+
+        self.page_key: tuple[str, str | None] | None = None
+        """
+            the endpoint and the search query (or genre) that the current pages are requested for. a cursor is only 
+            saved if it was sent for the same endpoint and query, so that a previous search's late cursor isn't used
+        """
+
         self.page.recently_viewed_songs = []
         """the list of the recently viewed song IDs, saved to page as to be persistent per-run instead of per-page"""
 
@@ -105,7 +136,9 @@ class HomePage:
             song_name: str,
             song_length: int,  # milliseconds
             genres: list[str],
-            is_favorite_song: bool
+            is_favorite_song: bool,
+            media_version: str = "",
+            sheet_count: int = 0,
     ) -> ft.Container:
         song_cover_art_loading = ft.Container(
             **self.preview_image_value_dict,
@@ -199,6 +232,8 @@ class HomePage:
                 "song_length": song_length,
                 "genres": genres,
                 "is_favorite_song": is_favorite_song,
+                "media_version": media_version,
+                "sheet_count": sheet_count,
             },
             on_click=self._open_song_view
         )
@@ -239,6 +274,7 @@ class HomePage:
             is_favorite_song=song_data["is_favorite_song"],
             uploaded_by=song_data["username"],
             song_data=song_data,
+            media_cache=getattr(self.page, "media_cache", None),
             open=True,
         )
 
@@ -255,6 +291,39 @@ class HomePage:
 
         self.song_item_gridview.update()
 
+    @staticmethod
+    def _create_page_key(endpoint: str, payload: dict) -> tuple[str, str | None]:
+        return endpoint, payload.get("query", payload.get("genre"))
+
+    def set_page_cursor(self, endpoint: str, query: str | None, cursor: str | None):
+        """
+        saves the cursor of the next page of song previews
+
+        :param endpoint: the endpoint that the page was requested from
+        :param query: the search query (or genre) that the page was requested for
+        :param cursor: the next page's cursor, None if there are no more pages
+        """
+
+        # the cursor may belong to a tab that was already navigated away from, or to a previous search
+        if (endpoint, query) != self.page_key:
+            return
+
+        self.page_cursor = cursor
+        self.has_loaded_last_page = cursor is None
+        self.is_waiting_for_page_cursor = False
+
+    def page_request_failed(self, endpoint: str):
+        """
+        called when the server sent an error instead of a page (for example, when the rate limit was reached), so that
+        the page can be requested again
+
+        :param endpoint: the endpoint that the page was requested from
+        """
+
+        # the error doesn't say which query it was sent for, but allowing another request is harmless either way
+        if self.page_key and endpoint == self.page_key[0]:
+            self.is_waiting_for_page_cursor = False
+
     def _add_excluded_song_id(self, song_id: int):
         if len(self.loaded_song_ids) >= 100:
             self.loaded_song_ids.pop(0)
@@ -381,6 +450,8 @@ class HomePage:
             song_length: int,
             genres: list[str],
             is_favorite_song: bool,
+            media_version: str = "",
+            sheet_count: int = 0,
     ):
         loading_song_item: ft.Container = self._create_loading_item(
             song_id=song_id,
@@ -392,7 +463,9 @@ class HomePage:
             song_name=song_name,
             song_length=song_length,
             genres=genres,
-            is_favorite_song=is_favorite_song
+            is_favorite_song=is_favorite_song,
+            media_version=media_version,
+            sheet_count=sheet_count
         )
         self._add_song_item(loading_song_item)
 
@@ -473,29 +546,33 @@ class HomePage:
         self.loading_song_items[file_id] = loading_song_item
 
     def stream_cover_art_chunks(self, file_id: str, song_id: int, b64_chunk: str, is_last_chunk: bool = False):
-        song_item: ft.Container = self.loading_song_items[file_id]
-        loading_song_content_stack: ft.Stack = song_item.content
+        b64_cover_art = self.cover_art_assembler.add_chunk(file_id, b64_chunk, is_last_chunk)
 
-        if not loading_song_content_stack.data["has_loaded_initial_cover_bytes"]:
-            image_container = ft.Container(
-                ft.Image(
-                    src_base64=b64_chunk,
-                    fit=ft.ImageFit.FILL,
-                    # images below a certain resolution did not fully cover the container when using ImageFit, so i set
-                    # a manual width and height that will be equal to what the gridview allows and thus will always fit
-                    width=self.gridview_extent,
-                    height=self.gridview_extent,
-                ),
-                **self.preview_image_value_dict,
-            )
+        # the loading item stays as-is until the assembler has an image that is ready to be rendered
+        if b64_cover_art is None:
+            return
 
-            loading_song_content_stack.controls[0] = image_container
-            loading_song_content_stack.data["has_loaded_initial_cover_bytes"] = True
-        else:
-            image_container: ft.Container = loading_song_content_stack.controls[0]
-            image: ft.Image = image_container.content
+        song_item: ft.Container | None = self.loading_song_items.get(file_id)
+
+        if not song_item:
+            return
+
+        loading_song_content_stack: ft.Stack = song_item.content
+
+        image_container = ft.Container(
+            ft.Image(
+                src_base64=b64_cover_art,
+                fit=ft.ImageFit.FILL,
+                # images below a certain resolution did not fully cover the container when using ImageFit, so i set
+                # a manual width and height that will be equal to what the gridview allows and thus will always fit
+                width=self.gridview_extent,
+                height=self.gridview_extent,
+            ),
+            **self.preview_image_value_dict,
+        )
 
-            image.src_base64 += b64_chunk
+        loading_song_content_stack.controls[0] = image_container
+        loading_song_content_stack.data["has_loaded_initial_cover_bytes"] = True
 
         try:
             song_item.update()
@@ -505,7 +582,7 @@ class HomePage:
             self.loading_song_items.pop(file_id, None)
 
         if is_last_chunk:
-            del self.loading_song_items[file_id]
+            self.loading_song_items.pop(file_id, None)
 
     async def stream_audio_chunks(self, file_id: str, song_id: int, b64_chunk: str, is_last_chunk: bool = False):
         if self.song_view_popup:
@@ -525,11 +602,19 @@ class HomePage:
                 is_last_chunk=is_last_chunk
             )
 
-    async def add_song_comments(self, comments: list[dict], ai_summary: str):
+    async def add_song_comments(self, comments: list[dict], ai_summary: str, cursor: str | None = None):
         if self.song_view_popup:
             await self.song_view_popup.add_comments(
                 comments=comments,
-                ai_summary=ai_summary
+                ai_summary=ai_summary,
+                cursor=cursor
+            )
+
+    async def add_new_song_comment(self, song_id: int, comment: dict):
+        if self.song_view_popup:
+            await self.song_view_popup.add_new_comment(
+                song_id=song_id,
+                comment=comment
             )
 
     @staticmethod
@@ -565,7 +650,6 @@ class HomePage:
                 data={
                     "endpoint": "song/genres/download/preview",
                     "payload": {
-                        "exclude": self.loaded_song_ids,
                         "limit": 10,
                         "genre": genre
                     }
@@ -589,13 +673,30 @@ class HomePage:
             "payload",
             {
                 "query": query,
-                "exclude": self.loaded_song_ids,
                 "limit": 10,
                 # filters is a required parameter, but it can be an empty dict to indicate none
                 "filters": self.current_filters
             }
         )
 
+        if endpoint in self.CURSOR_PAGINATED_ENDPOINTS:
+            page_key = self._create_page_key(endpoint, payload)
+
+            # the search query was changed (without searching again), so the previous query's cursor can't be used
+            if page_key != self.page_key:
+                self.page_key = page_key
+                self.page_cursor = None
+                self.has_loaded_last_page = False
+                self.is_waiting_for_page_cursor = False
+
+            if self.has_loaded_last_page or self.is_waiting_for_page_cursor:
+                return
+
+            # a copy is made so that the tab's saved payload isn't changed
+            payload = {**payload, "cursor": self.page_cursor}
+
+            self.is_waiting_for_page_cursor = True
+
         self.transport.write(
             ClientMessage(
                 authentication=self.user_cache.session_token,
@@ -627,6 +728,15 @@ class HomePage:
         self.song_item_gridview.controls.clear()
         self.loaded_song_ids.clear()
 
+        self.page_cursor = None
+        self.has_loaded_last_page = False
+        self.is_waiting_for_page_cursor = False
+        self.page_key = None
+
+        # the song items are no longer shown, so any cover art that is still being gathered for them can be dropped
+        self.loading_song_items.clear()
+        self.cover_art_assembler.clear()
+
         if update:
             self.page.update()
 
@@ -834,7 +944,6 @@ class HomePage:
                 "color": ft.Colors.BLUE,
                 "endpoint": "song/recommended/download/preview",
                 "payload": {
-                    "exclude": self.loaded_song_ids,
                     "limit": 10
                 }
             }
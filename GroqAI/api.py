@@ -11,34 +11,52 @@ class Response:
 
 
 class Model:
-    def __init__(self, key: str, model: str):
+    def __init__(self, key: str, model: str, base_url: str = "https://api.groq.com/openai/v1"):
+        """
+        :param base_url: the OpenAI compatible API to send the requests to (can be pointed at a local server)
+        """
         self.key = key
         self.model = model
+        self.base_url = base_url.rstrip("/")
 
         self._client_timeout = ClientTimeout(60)
 
+        # a single session is kept for every request, so that the connections (and their TLS handshakes) are reused
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # the session is created lazily, since it has to be created inside of the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self._client_timeout)
+
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+        self._session = None
+
     async def _get(self, url: str, headers: dict[str, str], **kwargs) -> dict:
         """returns the json of the response"""
-        async with aiohttp.ClientSession(timeout=self._client_timeout) as session:
-            async with session.get(
-                    url=url,
-                    headers=headers,
-                    **kwargs,
-            ) as response:
-                return await response.json()
+        async with self._get_session().get(
+                url=url,
+                headers=headers,
+                **kwargs,
+        ) as response:
+            return await response.json()
 
     async def _post(self, url: str, headers: dict[str, str], **kwargs) -> dict:
         """returns the json of the response"""
-        async with aiohttp.ClientSession(timeout=self._client_timeout) as session:
-            async with session.post(
-                    url=url,
-                    headers=headers,
-                    **kwargs,
-            ) as response:
-                return await response.json()
+        async with self._get_session().post(
+                url=url,
+                headers=headers,
+                **kwargs,
+        ) as response:
+            return await response.json()
 
     async def prompt(self, messages: str | list[dict[str, str]], max_completion_tokens: int = None, temperature: float = 1.0) -> Response:
-        url = "https://api.groq.com/openai/v1/chat/completions"
+        url = f"{self.base_url}/chat/completions"
 
         headers = {
             "Content-Type": "application/json",
@@ -76,3 +94,24 @@ def hybrid_token_estimate(text: str) -> int:
     num_words = len(words)
     num_chars = len(text)
     return int(0.75 * num_words + 0.25 * (num_chars / 4))
+
+
+def is_spam_comment(text: str) -> bool:
+    """an approximation to detect comments that shouldn't be summarized (whitespace and gibberish comments)"""
+    words = text.split()
+
+    # we dont care for whitespace comments
+    if not words:
+        return True
+
+    # in order to prevent spam comments (like, gibberish), we add an approximation feature to detect
+    # common spam structures (few words with a lot of total length)
+    if len(words) <= 3 and len(text) > 25:
+        return True
+
+    # on average, sentences will have an average of 5 letters per word, so we add a bit of leeway. but this
+    # with combination of the first statement should be a good way to remove most spam comments
+    if len(text) / len(words) > 9:
+        return True
+
+    return False
@@ -8,10 +8,15 @@ dotenv.load_dotenv(dotenv_path)
 
 api_key = os.getenv("GROQ_API_KEY")
 
+# the model is shared by every summary, so that its HTTP session is reused (see Model.close)
+model = Model(
+    key=api_key,
+    model="llama-3.3-70b-versatile",
+    base_url=os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+)
 
-async def summarize(comments: list[str], song_name: str):
-    model = Model(key=api_key, model="llama-3.3-70b-versatile")
 
+async def summarize(comments: list[str], song_name: str):
     try:
         message = [
             {
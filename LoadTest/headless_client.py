@@ -0,0 +1,340 @@
+import asyncio
+from collections import defaultdict
+from typing import Any
+
+from encryptions import EncryptedTransport
+from pseudo_http_protocol import ClientMessage, ServerMessage
+from Utils.chunk import send_chunk
+from Utils.key_exchange import complete_key_exchange
+
+# the server signs its IP, and the key exchange checks the signature against the address the client connected to, so
+# the client has to connect to the same IP that the server uses (see server.py)
+IP = "127.0.0.1"
+PORT = 5555
+
+
+class ServerError(Exception):
+    """an error that the server answered a request with (sent to the request's endpoint + /error)"""
+
+    def __init__(self, endpoint: str, code: int, message: str, extra: dict | None = None):
+        super().__init__(f"{endpoint} failed with {code}: {message}")
+
+        self.endpoint = endpoint
+        self.code = code
+        self.message = message
+        self.extra = extra or {}
+
+
+class _HeadlessProtocol(asyncio.Protocol):
+    """
+    sorts the server's messages by endpoint, so that the client can wait for the answer of a specific request.
+
+    unlike EncryptedTransport.read (which only returns the first message of the received data), the data is split into
+    its length prefixed messages first, since under load a single read often holds multiple messages.
+    """
+
+    def __init__(self):
+        self.transport: EncryptedTransport | None = None
+
+        self.messages: defaultdict[str, asyncio.Queue[ServerMessage]] = defaultdict(asyncio.Queue)
+        """
+        dict[endpoint -> the endpoint's messages that weren't received yet]
+        """
+
+        self.errors: defaultdict[str, asyncio.Queue[ServerError]] = defaultdict(asyncio.Queue)
+        """
+        dict[requested endpoint -> the endpoint's errors that weren't received yet]
+        """
+
+        self.closed: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        self._buffer = b""
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = EncryptedTransport(transport=transport)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+    def data_received(self, data: bytes) -> None:
+        # the key exchange message is the only message that isn't encrypted (or length prefixed)
+        if not self.transport.key:
+            self._message_received(data)
+            return
+
+        self._buffer += data
+
+        while len(self._buffer) >= 16:
+            message_length = int(self._buffer[:16].decode())
+
+            if len(self._buffer) < 16 + message_length:
+                break
+
+            message = self._buffer[:16 + message_length]
+            self._buffer = self._buffer[16 + message_length:]
+
+            self._message_received(self.transport.read(message))
+
+    def _message_received(self, data: bytes):
+        server_message = ServerMessage.from_bytes(data)
+        endpoint = server_message.endpoint
+
+        # the server disconnects clients that don't answer its heartbeats
+        if endpoint == "connection/heartbeat":
+            self.transport.write(
+                ClientMessage(
+                    authentication=None,
+                    method="respond",
+                    endpoint="connection/heartbeat",
+                    payload={
+                        "alive": True
+                    }
+                ).encode()
+            )
+            return
+
+        if endpoint.endswith("/error"):
+            requested_endpoint = endpoint.removesuffix("/error")
+            payload = server_message.payload if isinstance(server_message.payload, dict) else {}
+
+            self.errors[requested_endpoint].put_nowait(
+                ServerError(
+                    endpoint=requested_endpoint,
+                    code=server_message.status.get("code"),
+                    message=server_message.status.get("message"),
+                    extra=payload
+                )
+            )
+            return
+
+        self.messages[endpoint].put_nowait(server_message)
+
+
+class HeadlessClient:
+    """
+    a client without a GUI, that speaks the same protocol as client.py (the same messages, encryption and key
+    exchange). used by the load test (see LoadTest.load_test_runner), and by anything else that needs to act like a
+    user.
+
+    requests are answered on fixed endpoints (and not by request IDs), so a client should only have one request of each
+    kind waiting for an answer at a time.
+    """
+
+    def __init__(self, host: str = IP, port: int = PORT, timeout: float = 30):
+        """:param timeout: how long (in seconds) to wait for any single answer of the server"""
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self.session_token: str | None = None
+        self.user_id: str | None = None
+
+        self._protocol: _HeadlessProtocol | None = None
+
+    async def connect(self):
+        """connects to the server, and completes the key exchange"""
+
+        event_loop = asyncio.get_running_loop()
+
+        _, self._protocol = await event_loop.create_connection(_HeadlessProtocol, host=self.host, port=self.port)
+
+        key_exchange_message = await self.receive("authentication/key_exchange")
+
+        await complete_key_exchange(self._protocol.transport, key_exchange_message)
+
+    async def close(self):
+        if not self._protocol:
+            return
+
+        self._protocol.transport.close()
+
+        await asyncio.wait({self._protocol.closed}, timeout=self.timeout)
+
+    @property
+    def is_connected(self) -> bool:
+        return self._protocol is not None and not self._protocol.closed.done()
+
+    @property
+    def transport(self) -> EncryptedTransport:
+        return self._protocol.transport
+
+    def send(self, endpoint: str, method: str, payload: dict[str, Any], is_authenticated: bool = True):
+        self._protocol.transport.write(
+            ClientMessage(
+                authentication=self.session_token if is_authenticated else None,
+                method=method,
+                endpoint=endpoint,
+                payload=payload
+            ).encode()
+        )
+
+    async def receive(self, endpoint: str, requested_endpoint: str | None = None) -> ServerMessage:
+        """
+        waits for the next message on the endpoint.
+
+        :param requested_endpoint: the endpoint of the request that the message answers, if it isn't the same endpoint
+        (e.g. song previews that were requested from song/recommended/download/preview arrive on song/download/preview)
+        :raises ServerError: if the server answered the request with an error
+        :raises ConnectionError: if the server closed the connection
+        :raises asyncio.TimeoutError: if no message arrived in time
+        """
+
+        message = asyncio.ensure_future(self._protocol.messages[endpoint].get())
+        error = asyncio.ensure_future(self._protocol.errors[requested_endpoint or endpoint].get())
+
+        try:
+            done, _ = await asyncio.wait(
+                {message, error, self._protocol.closed},
+                timeout=self.timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            message.cancel()
+            error.cancel()
+
+        # a message that arrived together with the closing of the connection is still returned
+        if message in done:
+            # an error that arrived at the same time belongs to a later request, so it is kept for it
+            if error in done:
+                self._protocol.errors[requested_endpoint or endpoint].put_nowait(error.result())
+
+            return message.result()
+
+        if error in done:
+            raise error.result()
+
+        if self._protocol.closed in done:
+            raise ConnectionError(f"the server closed the connection while waiting for {endpoint}")
+
+        raise asyncio.TimeoutError(f"the server didn't answer {endpoint} in {self.timeout} seconds")
+
+    def poll_error(self, requested_endpoint: str) -> ServerError | None:
+        """:returns: the next error of a request that isn't answered otherwise (e.g. song/comments/upload), if any"""
+
+        errors = self._protocol.errors[requested_endpoint]
+
+        return None if errors.empty() else errors.get_nowait()
+
+    async def request(self, endpoint: str, method: str, payload: dict[str, Any],
+                      response_endpoint: str | None = None, is_authenticated: bool = True) -> ServerMessage:
+        """sends a request, and waits for its answer (on the same endpoint, unless a response endpoint is given)"""
+
+        self.send(endpoint, method, payload, is_authenticated=is_authenticated)
+
+        return await self.receive(response_endpoint or endpoint, requested_endpoint=endpoint)
+
+    async def receive_file(self, endpoint: str, requested_endpoint: str | None = None) -> int:
+        """
+        waits for every chunk of a file that is sent to the endpoint (see Utils.send_to_client_chunk)
+
+        :returns: the size of the file's (b64 encoded) chunks
+        """
+
+        file_size = 0
+
+        while True:
+            chunk_message = await self.receive(endpoint, requested_endpoint=requested_endpoint)
+            file_size += len(chunk_message.payload["chunk"])
+
+            if chunk_message.payload["is_last_chunk"]:
+                return file_size
+
+    async def signup_and_login(self, username: str, password: str, display_name: str):
+        response = await self.request(
+            "user/signup/login", "post",
+            {
+                "username": username,
+                "password": password,
+                "display_name": display_name
+            },
+            response_endpoint="user/login",
+            is_authenticated=False
+        )
+
+        self.session_token = response.payload["session_token"]
+        self.user_id = response.payload["user_id"]
+
+    async def login(self, username: str, password: str):
+        response = await self.request(
+            "user/login", "post",
+            {
+                "username": username,
+                "password": password
+            },
+            is_authenticated=False
+        )
+
+        self.session_token = response.payload["session_token"]
+        self.user_id = response.payload["user_id"]
+
+    async def search(self, name: str) -> list[dict]:
+        response = await self.request("song/search", "get", {"name": name})
+
+        return response.payload["songs"]
+
+    async def fetch_previews(self, endpoint: str = "song/recommended/download/preview", limit: int = 10,
+                             cursor: str | None = None, **payload: Any) -> tuple[list[dict], str | None]:
+        """
+        loads a page of song previews (the song information and the cover art) like the home page's grid does
+
+        :param endpoint: any of the song preview endpoints (e.g. song/download/preview, song/genres/download/preview)
+        :param payload: the endpoint's other payload values (e.g. the query of song/download/preview)
+        :returns: tuple[the previews' song information, the cursor of the next page]
+        """
+
+        self.send(endpoint, "get", {"limit": limit, "cursor": cursor, **payload})
+
+        cursor_message = await self.receive("song/download/preview/cursor", requested_endpoint=endpoint)
+
+        previews: list[dict] = []
+
+        for _ in range(cursor_message.payload["count"]):
+            preview_message = await self.receive("song/download/preview", requested_endpoint=endpoint)
+            await self.receive_file("song/download/preview/file", requested_endpoint=endpoint)
+
+            previews.append(preview_message.payload)
+
+        return previews, cursor_message.payload["cursor"]
+
+    async def download_audio(self, song_id: int) -> int:
+        """:returns: the size of the song's (b64 encoded) audio"""
+
+        self.send("song/download/audio", "get", {"song_id": song_id})
+
+        return await self.receive_file("song/download/audio")
+
+    def upload_comment(self, song_id: int, text: str):
+        """the server doesn't answer comment uploads, use poll_error("song/comments/upload") to find failed uploads"""
+
+        self.send("song/comments/upload", "post", {"song_id": song_id, "text": text})
+
+    async def fetch_comments(self, song_id: int, limit: int = 50, cursor: str | None = None) -> dict:
+        response = await self.request("song/comments", "get", {"song_id": song_id, "limit": limit, "cursor": cursor})
+
+        return response.payload
+
+    async def upload_song(self, song_path: str, song_name: str, artist_name: str, album_name: str, tags: list[str],
+                          cover_art_path: str | None = None) -> bool:
+        """
+        uploads a song the same way the upload page does (see Utils.chunk.send_chunk)
+
+        :returns: whether the server saved the song
+        """
+
+        await send_chunk(
+            transport=self._protocol.transport,
+            session_token=self.session_token,
+            tags=tags,
+            artist_name=artist_name,
+            album_name=album_name,
+            song_name=song_name,
+            song_path=song_path,
+            covert_art_path=cover_art_path
+        )
+
+        # the chunks' errors are only sent to song/upload/file, but they make the finish fail as well
+        response = await self.receive("song/upload/finish")
+
+        return response.payload["success"]
@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from LoadTest.headless_client import IP, HeadlessClient, ServerError
+from LoadTest.local_server import LocalServer
+
+SEARCH_QUERIES = ["a", "e", "the", "love", "night", "song", "rock", "blue"]
+
+COMMENTS = ["great song", "love this one", "the chorus is amazing", "on repeat", "underrated"]
+
+# dict[scenario -> how often it is picked, relatively to the others]
+SCENARIO_WEIGHTS: dict[str, int] = {
+    "search": 30,
+    "browse": 30,
+    "download": 20,
+    "comment": 15,
+    "upload": 5,
+}
+
+
+def _error_counts() -> defaultdict[str, int]:
+    # a module level function (and not a lambda), so that the recorders can be pickled back from the client processes
+    return defaultdict(int)
+
+
+@dataclass
+class LatencyRecorder:
+    """
+    latencies - dict[endpoint -> the latency (in seconds) of every successful request]
+    errors - dict[endpoint -> dict[error -> how many requests failed with it]]
+    """
+
+    latencies: defaultdict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: defaultdict[str, defaultdict[str, int]] = field(default_factory=lambda: defaultdict(_error_counts))
+
+    @asynccontextmanager
+    async def measure(self, endpoint: str) -> AsyncIterator[None]:
+        """
+        measures the request that runs inside the block, an exception counts the request as failed (and isn't raised,
+        so that a virtual user keeps going after a failed request)
+        """
+
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        except ServerError as error:
+            self.add_error(endpoint, f"{error.code} {error.message}")
+        except (ConnectionError, asyncio.TimeoutError) as error:
+            self.add_error(endpoint, type(error).__name__)
+        else:
+            self.latencies[endpoint].append(time.perf_counter() - start_time)
+
+    def add_error(self, endpoint: str, error: str):
+        self.errors[endpoint][error] += 1
+
+    def merge(self, other: "LatencyRecorder"):
+        for endpoint, latencies in other.latencies.items():
+            self.latencies[endpoint].extend(latencies)
+
+        for endpoint, errors in other.errors.items():
+            for error, amount in errors.items():
+                self.errors[endpoint][error] += amount
+
+    def report(self, duration: float) -> dict[str, dict]:
+        """:returns: dict[endpoint -> the endpoint's requests, errors, requests per second and latency percentiles]"""
+
+        report = {}
+
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(endpoint, []))
+            errors_amount = sum(self.errors.get(endpoint, {}).values())
+
+            report[endpoint] = {
+                "requests": len(latencies) + errors_amount,
+                "errors": errors_amount,
+                "requests_per_second": (len(latencies) + errors_amount) / duration,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p95_ms": _percentile(latencies, 95) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+                "error_kinds": dict(self.errors.get(endpoint, {})),
+            }
+
+        return report
+
+
+def _percentile(sorted_values: list[float], percent: float) -> float:
+    """the nearest rank percentile (0 when there are no values)"""
+
+    if not sorted_values:
+        return 0
+
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+
+    return sorted_values[int(rank) - 1]
+
+
+@dataclass
+class _VirtualUserState:
+    """the songs that the virtual user saw so far, the download and comment scenarios pick from them"""
+
+    song_ids: set[int] = field(default_factory=set)
+
+
+async def _search(client: HeadlessClient, state: _VirtualUserState, recorder: LatencyRecorder, _):
+    async with recorder.measure("song/search"):
+        await client.search(random.choice(SEARCH_QUERIES))
+
+
+async def _browse(client: HeadlessClient, state: _VirtualUserState, recorder: LatencyRecorder, _):
+    async with recorder.measure("song/recommended/download/preview"):
+        previews, _ = await client.fetch_previews("song/recommended/download/preview", limit=10)
+
+        state.song_ids.update(preview["song_id"] for preview in previews)
+
+
+async def _download(client: HeadlessClient, state: _VirtualUserState, recorder: LatencyRecorder, _):
+    if not state.song_ids:
+        await _browse(client, state, recorder, _)
+        return
+
+    async with recorder.measure("song/download/audio"):
+        await client.download_audio(random.choice(list(state.song_ids)))
+
+
+async def _comment(client: HeadlessClient, state: _VirtualUserState, recorder: LatencyRecorder, _):
+    if not state.song_ids:
+        await _browse(client, state, recorder, _)
+        return
+
+    song_id = random.choice(list(state.song_ids))
+
+    # the upload isn't answered, so it is measured together with the fetch that shows the new comment
+    async with recorder.measure("song/comments/upload+song/comments"):
+        client.upload_comment(song_id, random.choice(COMMENTS))
+        await client.fetch_comments(song_id)
+
+    upload_error = client.poll_error("song/comments/upload")
+
+    if upload_error:
+        recorder.add_error("song/comments/upload", f"{upload_error.code} {upload_error.message}")
+
+
+async def _upload(client: HeadlessClient, state: _VirtualUserState, recorder: LatencyRecorder, audio_path: str | None):
+    if not audio_path:
+        return
+
+    async with recorder.measure("song/upload"):
+        is_saved = await client.upload_song(
+            song_path=audio_path,
+            song_name=f"load test {random.randrange(10 ** 6)}",
+            artist_name="load test",
+            album_name="load test",
+            tags=["rock"]
+        )
+
+    if not is_saved:
+        recorder.add_error("song/upload", "not saved")
+
+
+SCENARIOS = {
+    "search": _search,
+    "browse": _browse,
+    "download": _download,
+    "comment": _comment,
+    "upload": _upload,
+}
+
+
+async def _virtual_user(user_number: int, port: int, deadline: float, start_delay: float, think_time: float,
+                        scenarios: list[str], audio_path: str | None, recorder: LatencyRecorder):
+    """a user that connects, signs up, and then does random scenarios (with some thinking in between) until the deadline"""
+
+    await asyncio.sleep(start_delay)
+
+    client = HeadlessClient(host=IP, port=port)
+    state = _VirtualUserState()
+
+    weights = [SCENARIO_WEIGHTS[scenario] for scenario in scenarios]
+
+    try:
+        # a failed connection or signup leaves the user without a session, so it stops here
+        async with recorder.measure("authentication/key_exchange"):
+            await client.connect()
+
+        if not client.is_connected:
+            return
+
+        async with recorder.measure("user/signup/login"):
+            # usernames are limited to 20 characters
+            await client.signup_and_login(
+                username=f"vu{os.getpid() % 10 ** 6}_{user_number}"[:20],
+                password="load-test-password",
+                display_name=f"virtual user {user_number}"
+            )
+
+        if not client.session_token:
+            return
+
+        while time.monotonic() < deadline:
+            scenario = random.choices(scenarios, weights=weights)[0]
+            await SCENARIOS[scenario](client, state, recorder, audio_path)
+
+            # the think time is randomized, so that the users don't all send their requests at the same moments
+            await asyncio.sleep(random.uniform(0, 2 * think_time))
+    except Exception as error:
+        # an unexpected answer (e.g. a missing payload key) shouldn't stop the rest of the users
+        recorder.add_error("unexpected", f"{type(error).__name__}: {error}")
+    finally:
+        await client.close()
+
+
+async def _generate_load(first_user_number: int, users: int, port: int, duration: float, ramp_up: float,
+                         think_time: float, scenarios: list[str], audio_path: str | None) -> LatencyRecorder:
+    recorder = LatencyRecorder()
+    deadline = time.monotonic() + duration
+
+    await asyncio.gather(*(
+        _virtual_user(
+            user_number=first_user_number + user_index,
+            port=port,
+            deadline=deadline,
+            start_delay=ramp_up * user_index / users,
+            think_time=think_time,
+            scenarios=scenarios,
+            audio_path=audio_path,
+            recorder=recorder
+        )
+        for user_index in range(users)
+    ))
+
+    return recorder
+
+
+def _run_client_process(*arguments) -> LatencyRecorder:
+    return asyncio.run(_generate_load(*arguments))
+
+
+def _silence_client_process():
+    # the client modules print every message they handle, which would drown the report
+    sys.stdout = open(os.devnull, "w")
+
+
+async def _seed_songs(port: int, audio_path: str, amount: int):
+    """uploads songs for the virtual users to find (a new server starts with an empty database)"""
+
+    client = HeadlessClient(host=IP, port=port)
+
+    await client.connect()
+
+    try:
+        await client.signup_and_login(username="seed_user", password="load-test-password", display_name="seed user")
+
+        for song_number in range(amount):
+            await client.upload_song(
+                song_path=audio_path,
+                song_name=f"seed song {song_number}",
+                artist_name="seed artist",
+                album_name="seed album",
+                tags=["rock"]
+            )
+    finally:
+        await client.close()
+
+
+def run_load_test(port: int, users: int, client_processes: int, duration: float, ramp_up: float, think_time: float,
+                  scenarios: list[str], audio_path: str | None) -> dict[str, dict]:
+    """
+    runs the virtual users from multiple client processes (the key exchange and the decryption are CPU heavy, one
+    process can't keep up with a few hundred users) against a server that is already listening on the port.
+
+    :returns: the merged report (see LatencyRecorder.report)
+    """
+
+    client_processes = max(1, min(client_processes, users))
+
+    # spreads the users between the processes, the first processes get the remainder
+    users_per_process = [
+        users // client_processes + (1 if process_index < users % client_processes else 0)
+        for process_index in range(client_processes)
+    ]
+    first_user_numbers = [sum(users_per_process[:process_index]) for process_index in range(client_processes)]
+
+    with multiprocessing.Pool(client_processes, initializer=_silence_client_process) as pool:
+        recorders = pool.starmap(
+            _run_client_process,
+            [
+                (first_user_number, process_users, port, duration, ramp_up, think_time, scenarios, audio_path)
+                for first_user_number, process_users in zip(first_user_numbers, users_per_process)
+            ]
+        )
+
+    recorder = LatencyRecorder()
+
+    for process_recorder in recorders:
+        recorder.merge(process_recorder)
+
+    return recorder.report(duration)
+
+
+def _print_report(report: dict[str, dict]):
+    print(f"{'endpoint':<40} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+    for endpoint, row in report.items():
+        print(
+            f"{endpoint:<40} {row['requests']:>9} {row['errors']:>7} {row['requests_per_second']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+        )
+
+    for endpoint, row in report.items():
+        for error, amount in row["error_kinds"].items():
+            print(f"  {endpoint}: {amount} x {error}")
+
+
+def main() -> int:
+    """
+    python -m LoadTest.load_test_runner [--users 200] [--duration 60] [--audio song.mp3]
+
+    starts the server (on an empty temporary database, see LoadTest.local_server), seeds it with songs, and then runs
+    virtual users that search, browse the home page's grid, download audio and comment, the way real users do.
+    prints the latency percentiles, the errors and the throughput of every endpoint.
+
+    use --no-server to test a server that is already running (e.g. with production like data).
+    run it from the project's root directory.
+    """
+
+    parser = argparse.ArgumentParser(description="runs virtual users against the server, and reports the latencies")
+    parser.add_argument("--users", type=int, default=200, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run the load for")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds until every user is connected")
+    parser.add_argument("--think-time", type=float, default=1, help="average seconds between a user's requests")
+    parser.add_argument("--client-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--workers", type=int, default=1, help="the server's workers (see server.supervise)")
+    parser.add_argument("--port", type=int, default=5600)
+    parser.add_argument("--no-server", action="store_true", help="use a server that is already running on the port")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--audio", help="an audio file to seed the server with (and to upload in the upload scenario)")
+    parser.add_argument("--seed-songs", type=int, default=20)
+    parser.add_argument("--json", help="also write the report to this path")
+
+    arguments = parser.parse_args()
+
+    def run() -> dict[str, dict]:
+        if arguments.audio and arguments.seed_songs:
+            asyncio.run(_seed_songs(arguments.port, arguments.audio, arguments.seed_songs))
+
+        return run_load_test(
+            port=arguments.port,
+            users=arguments.users,
+            client_processes=arguments.client_processes,
+            duration=arguments.duration,
+            ramp_up=arguments.ramp_up,
+            think_time=arguments.think_time,
+            scenarios=arguments.scenarios,
+            audio_path=arguments.audio
+        )
+
+    if arguments.no_server:
+        report = run()
+    else:
+        with LocalServer(port=arguments.port, workers=arguments.workers):
+            report = run()
+
+    _print_report(report)
+
+    if arguments.json:
+        with open(arguments.json, "w") as report_file:
+            json.dump(report, report_file, indent=4)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
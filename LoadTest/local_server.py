@@ -0,0 +1,95 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from LoadTest.headless_client import IP
+
+
+class LocalServer:
+    """
+    runs server.py in a separate process, on a temporary database and storage directory (which are deleted once the
+    server stops), so that load tests and benchmarks never touch the real database.
+
+        with LocalServer(port=5600, workers=4) as server:
+            ...
+
+    it has to be used from the project's root directory, since the server loads its keys and assets by relative paths.
+    """
+
+    def __init__(self, port: int, workers: int = 1, startup_timeout: float = 30):
+        self.port = port
+        self.workers = workers
+        self.startup_timeout = startup_timeout
+
+        self.directory: str | None = None
+        self._temporary_directory: tempfile.TemporaryDirectory | None = None
+        self._process: subprocess.Popen | None = None
+        self._log = None
+
+    def __enter__(self) -> "LocalServer":
+        self._temporary_directory = tempfile.TemporaryDirectory()
+        self.directory = self._temporary_directory.name
+
+        # the server's output is kept in the temporary directory, it is only useful when the server fails to start
+        self._log = open(os.path.join(self.directory, "server.log"), "wb")
+
+        self._process = subprocess.Popen(
+            [
+                sys.executable, "server.py",
+                "--workers", str(self.workers),
+                "--database", os.path.join(self.directory, "database.db"),
+                "--storage", os.path.join(self.directory, "SavedFiles"),
+                "--port", str(self.port),
+            ],
+            stdout=self._log,
+            stderr=subprocess.STDOUT
+        )
+
+        try:
+            self._wait_until_listening()
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # SIGINT stops the server the same way ctrl+c does, so that it flushes its state before exiting
+        if self._process.poll() is None:
+            self._process.send_signal(signal.SIGINT)
+
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+
+        self._log.close()
+        self._temporary_directory.cleanup()
+
+    def _wait_until_listening(self):
+        deadline = time.monotonic() + self.startup_timeout
+
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                # the log is deleted together with the temporary directory, so its end is shown here
+                with open(os.path.join(self.directory, "server.log"), "rb") as log:
+                    log_end = log.read()[-2000:].decode(errors="replace")
+
+                raise RuntimeError(f"the server exited with code {self._process.returncode}:\n{log_end}")
+
+            try:
+                with socket.create_connection((IP, self.port), timeout=1):
+                    break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            raise TimeoutError(f"the server didn't start listening on port {self.port} in {self.startup_timeout} seconds")
+
+        # the first worker to listen answered, give the rest of them a moment
+        if self.workers > 1:
+            time.sleep(1)
@@ -3,6 +3,8 @@ from MediaHandling.ffmpeg import FFmpegAudio, Codec
 
 import asyncio
 
+from Utils.tracing import span
+
 
 async def compress_to_aac(
         file_extension: str,
@@ -61,14 +63,15 @@ async def get_audio_length(
             "-of", "csv=p=0"
         ]
 
-        # Run ffprobe asynchronously
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        async with span("subprocess", program="ffprobe"):
+            # Run ffprobe asynchronously
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
 
-        stdout, stderr = await process.communicate()
+            stdout, stderr = await process.communicate()
 
         # If ffprobe fails, log the error and return -1
         if process.returncode != 0:
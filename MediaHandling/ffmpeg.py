@@ -6,6 +6,8 @@ from enum import Enum
 
 import aiofiles.os as aos
 
+from Utils.tracing import span
+
 
 class Codec(Enum):
     AAC = "aac"  # Advanced Audio Codec
@@ -116,14 +118,15 @@ async def is_valid_file(file_path: str) -> bool:
             file_path  # The file to validate
         ]
 
-        # Run ffprobe asynchronously
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        async with span("subprocess", program="ffprobe"):
+            # Run ffprobe asynchronously
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
 
-        stdout, stderr = await process.communicate()
+            stdout, stderr = await process.communicate()
 
         # If ffprobe fails, stderr will contain an error message
         if process.returncode != 0:
@@ -165,14 +168,15 @@ async def compress(input_file: str, output_file: str, flag_values: dict[str, str
         # Append the output file to the command
         command.append(output_file)
 
-        # Run the FFmpeg command asynchronously
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        async with span("subprocess", program="ffmpeg"):
+            # Run the FFmpeg command asynchronously
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
 
-        stdout, stderr = await process.communicate()
+            stdout, stderr = await process.communicate()
 
         if process.returncode != 0:
             raise Exception(f"FFmpeg error: {stderr.decode()}")
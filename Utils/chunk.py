@@ -11,8 +11,12 @@ from pseudo_http_protocol import ClientMessage
 from base64 import b64encode
 from time import time
 
+from Utils.structured_logging import get_logger
+
 KILOBYTE: int = 1024
 
+log = get_logger("upload")
+
 
 class FileTypes(enum.Enum):
     SHEET = "sheet"
@@ -188,13 +192,14 @@ async def send_file_chunks(
         while True:
             chunk = await file.read(chunk_size)
 
-            print(len(chunk))
             if not chunk:
                 break
 
             is_last_chunk = await file.peek(1) == b""
             chunk_number += 1
 
+            log.debug("read a chunk", sampled=True, file_id=file_id, chunk_number=chunk_number, size=len(chunk))
+
             payload = {
                 "request_id": request_id,
                 "file_type": file_type,
@@ -0,0 +1,57 @@
+import base64
+
+
+class ChunkAssembler:
+    """
+    gathers the base64 file chunks that the server sends (song/download/sheet, song/download/preview/file) and combines
+    them into a single file per file ID.
+
+    appending to a control's src_base64 for every chunk copies the whole string each time and forces flet to re-send
+    the entire image on every update. instead, we keep the raw bytes of every file and only build the base64 string
+    when the image actually needs to be rendered (at a progressive checkpoint, or when the last chunk arrives).
+    """
+
+    def __init__(self, checkpoint_chunks: tuple[int, ...] = ()):
+        """
+        :param checkpoint_chunks: the chunk counts at which a partial render is allowed (e.g. (4, 16) will render once
+        after 4 chunks and once after 16 chunks). the last chunk is always rendered.
+        """
+        self.checkpoint_chunks = set(checkpoint_chunks)
+
+        self._assemblies: dict[str, list[bytes]] = {}
+        """
+        dict[file_id -> list[raw chunk bytes]]
+        """
+
+    def add_chunk(self, file_id: str, b64_chunk: str, is_last_chunk: bool = False) -> str | None:
+        """
+        adds a chunk to the file's assembly.
+
+        :returns: the full base64 of the file (so far) if it should be rendered now, else None. once the last chunk
+        arrives the assembly is evicted, and the complete base64 is returned.
+        """
+
+        file_chunks = self._assemblies.setdefault(file_id, [])
+        file_chunks.append(base64.b64decode(b64_chunk))
+
+        if is_last_chunk:
+            file_bytes = b"".join(self._assemblies.pop(file_id))
+            return base64.b64encode(file_bytes).decode()
+
+        if len(file_chunks) in self.checkpoint_chunks:
+            return base64.b64encode(b"".join(file_chunks)).decode()
+
+        return None
+
+    def discard(self, file_id: str):
+        """removes an unfinished assembly (for example, when the control it belongs to is no longer shown)"""
+        self._assemblies.pop(file_id, None)
+
+    def clear(self):
+        self._assemblies.clear()
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self._assemblies
+
+    def __len__(self) -> int:
+        return len(self._assemblies)
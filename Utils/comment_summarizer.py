@@ -0,0 +1,140 @@
+import asyncio
+import time
+import traceback
+
+from Utils.sqlite3_ext import DatabasePool
+
+from GroqAI import generate_comment_summary
+from queries import Comments
+
+
+class CommentSummaryRefresher:
+    """
+    generates the AI comment summaries in the background, so that opening a song's comments never waits for the LLM
+    (and never holds a database connection while waiting for it).
+
+    requests are served the saved summary right away (even if it is stale), and schedule a refresh when the summary is
+    missing, or when the song got new comments since it was generated (see queries.Comments.fetch_ai_summary).
+    refreshes are coalesced per song: while a song's summary is being refreshed, scheduling another refresh for it does
+    nothing (single-flight).
+
+    a refresh only holds a database connection while reading the comments and while saving the summary, never during the
+    LLM request itself.
+    """
+
+    def __init__(self, max_concurrent_refreshes: int = 4, retry_interval: float = 60):
+        """
+        :param max_concurrent_refreshes: the maximum amount of LLM requests that are sent at the same time
+        :param retry_interval: how long (in seconds) to wait before retrying a song whose refresh failed (or that didn't
+        have enough comments to summarize)
+        """
+        self.retry_interval = retry_interval
+
+        self._db_pool: DatabasePool | None = None
+
+        self._refreshes: dict[int, asyncio.Task] = {}
+        """
+        dict[song ID -> the song's running refresh]
+        """
+
+        self._unsuccessful_refreshes: dict[int, float] = {}
+        """
+        dict[song ID -> when the song's last unsuccessful refresh finished (time.monotonic)]
+        """
+
+        self._refresh_semaphore = asyncio.Semaphore(max_concurrent_refreshes)
+
+    def start(self, db_pool: DatabasePool):
+        self._db_pool = db_pool
+
+    async def stop(self):
+        """cancels the running refreshes, and closes the LLM's HTTP session"""
+
+        refreshes = list(self._refreshes.values())
+
+        for refresh in refreshes:
+            refresh.cancel()
+
+        await asyncio.gather(*refreshes, return_exceptions=True)
+
+        await generate_comment_summary.model.close()
+
+    def is_refreshing(self, song_id: int) -> bool:
+        return song_id in self._refreshes
+
+    def schedule_refresh(self, song_id: int):
+        """starts refreshing the song's summary, unless it is already being refreshed (or was recently unsuccessful)"""
+
+        if not self._db_pool or song_id in self._refreshes:
+            return
+
+        unsuccessful_at = self._unsuccessful_refreshes.get(song_id)
+
+        if unsuccessful_at is not None and time.monotonic() - unsuccessful_at < self.retry_interval:
+            return
+
+        refresh = asyncio.create_task(self._refresh(song_id))
+        self._refreshes[song_id] = refresh
+
+        refresh.add_done_callback(lambda _: self._refreshes.pop(song_id, None))
+
+    async def _refresh(self, song_id: int):
+        try:
+            async with self._refresh_semaphore:
+                is_successful = await self._generate_and_save(song_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            traceback.print_exc()
+            is_successful = False
+
+        if is_successful:
+            self._unsuccessful_refreshes.pop(song_id, None)
+        else:
+            self._mark_unsuccessful(song_id)
+
+    async def _generate_and_save(self, song_id: int) -> bool:
+        """:returns: whether a new summary was saved"""
+
+        async with self._db_pool.acquire() as connection:
+            song_name, comments, last_comment_id = await Comments.fetch_comments_for_summary(
+                connection=connection,
+                song_id=song_id
+            )
+
+        if not comments:
+            return False
+
+        # the connection was already released, the LLM request can take seconds
+        summary = await generate_comment_summary.summarize(comments, song_name=song_name)
+
+        if not summary:
+            return False
+
+        async with self._db_pool.acquire_writer() as connection:
+            await Comments.save_ai_summary(
+                connection=connection,
+                song_id=song_id,
+                summary=summary,
+                last_updated=int(time.time()),
+                last_comment_id=last_comment_id
+            )
+
+        return True
+
+    def _mark_unsuccessful(self, song_id: int):
+        current_time = time.monotonic()
+
+        # forgets the songs that can already be retried, so that the dict doesn't grow forever
+        if len(self._unsuccessful_refreshes) > 1000:
+            self._unsuccessful_refreshes = {
+                unsuccessful_song_id: unsuccessful_at
+                for unsuccessful_song_id, unsuccessful_at in self._unsuccessful_refreshes.items()
+                if current_time - unsuccessful_at < self.retry_interval
+            }
+
+        self._unsuccessful_refreshes[song_id] = current_time
+
+
+# the refresher is shared by all the clients, it is started (and stopped) by the server's main function
+comment_summary_refresher = CommentSummaryRefresher()
@@ -0,0 +1,229 @@
+import asyncio
+import inspect
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from Caches.client_cache import Address, ClientPackage
+from pseudo_http_protocol import ServerMessage
+from Utils.structured_logging import get_logger
+
+log = get_logger("connections")
+
+
+@dataclass
+class ConnectionState:
+    """
+    client_package - the connected client
+    connected_at - when the client connected (time.monotonic)
+    last_activity - when the client last sent any data (time.monotonic)
+    tasks - the client's server actions that are still running
+    is_heartbeat_sent - whether the client was sent a heartbeat that it didn't answer yet
+    """
+
+    client_package: ClientPackage
+    connected_at: float
+    last_activity: float
+    tasks: set[asyncio.Task] = field(default_factory=set)
+    is_heartbeat_sent: bool = False
+
+
+class ConnectionLifecycle:
+    """
+    keeps track of every connected client, and reclaims everything that the server keeps per client once it disconnects.
+
+    when a client disconnects, its running server actions are cancelled (there is no one to answer), and then every
+    disconnect handler is called with the client's address (the user cache entry, the comment subscriptions and the
+    unfinished uploads are all registered as disconnect handlers by the server's main function).
+
+    clients that stop sending data are sent a heartbeat (connection/heartbeat), and clients that don't answer it (or send
+    anything else) in time are disconnected, so that a client that vanished without closing its socket doesn't keep its
+    state forever.
+    """
+
+    def __init__(self, heartbeat_interval: float = 30, idle_timeout: float = 90, report_interval: float = 300):
+        """
+        :param heartbeat_interval: how long (in seconds) a client can be idle before it is sent a heartbeat
+        :param idle_timeout: how long (in seconds) a client can be idle before it is disconnected
+        :param report_interval: how often (in seconds) the gauges are printed
+        """
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.report_interval = report_interval
+
+        self._connections: dict[Address, ConnectionState] = {}
+
+        # the teardowns of disconnected clients that didn't finish yet (releasing an upload can take a while)
+        self._teardowns: set[asyncio.Task] = set()
+
+        self._disconnect_handlers: list[Callable[[Address], Awaitable[None] | None]] = []
+
+        self._gauges: dict[str, Callable[[], int]] = {}
+        """
+        dict[gauge name -> a function that returns the gauge's current value]
+        """
+
+        self._monitor: asyncio.Task | None = None
+
+    def start(self):
+        self._monitor = asyncio.create_task(self._monitor_connections())
+
+    async def stop(self):
+        """stops disconnecting idle clients, and waits for the running teardowns"""
+
+        if self._monitor:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+
+        await asyncio.gather(*self._teardowns, return_exceptions=True)
+
+    def add_disconnect_handler(self, handler: Callable[[Address], Awaitable[None] | None]):
+        """
+        :param handler: called with the address of every client that disconnects (after its server actions were
+        cancelled), can be either a function or a coroutine function
+        """
+        self._disconnect_handlers.append(handler)
+
+    def add_gauge(self, name: str, gauge: Callable[[], int]):
+        self._gauges[name] = gauge
+
+    def connection_made(self, client_package: ClientPackage):
+        current_time = time.monotonic()
+
+        self._connections[client_package.address] = ConnectionState(
+            client_package=client_package,
+            connected_at=current_time,
+            last_activity=current_time
+        )
+
+    def activity(self, address: Address):
+        """marks that the client sent data (any data counts as an answer to the heartbeat)"""
+
+        state = self._connections.get(address)
+
+        if state is None:
+            return
+
+        state.last_activity = time.monotonic()
+        state.is_heartbeat_sent = False
+
+    def track_task(self, address: Address, task: asyncio.Task):
+        """keeps the client's server action, so that it can be cancelled if the client disconnects"""
+
+        state = self._connections.get(address)
+
+        if state is None:
+            return
+
+        state.tasks.add(task)
+        task.add_done_callback(state.tasks.discard)
+
+    def connection_lost(self, address: Address):
+        state = self._connections.pop(address, None)
+
+        if state is None:
+            return
+
+        teardown = asyncio.create_task(self._teardown(address, state))
+        self._teardowns.add(teardown)
+
+        teardown.add_done_callback(self._teardowns.discard)
+
+    def is_connected(self, address: Address) -> bool:
+        return address in self._connections
+
+    def addresses(self) -> set[Address]:
+        return set(self._connections)
+
+    def gauges(self) -> dict[str, int]:
+        """:returns: dict[gauge name -> current value], including the gauges that were added with add_gauge"""
+
+        gauges = {
+            "live_connections": len(self._connections),
+            "running_actions": sum(len(state.tasks) for state in self._connections.values()),
+            "running_teardowns": len(self._teardowns),
+        }
+
+        for name, gauge in self._gauges.items():
+            try:
+                gauges[name] = gauge()
+            except Exception:
+                traceback.print_exc()
+
+        return gauges
+
+    async def _teardown(self, address: Address, state: ConnectionState):
+        tasks = list(state.tasks)
+
+        for task in tasks:
+            task.cancel()
+
+        # the handlers run only after the actions stopped, so that an action can't re-add state that was just removed
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for handler in self._disconnect_handlers:
+            try:
+                result = handler(address)
+
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                traceback.print_exc()
+
+    async def _monitor_connections(self):
+        # the connections are checked a few times per heartbeat interval, so that a client is never idle for much
+        # longer than the timeouts
+        check_interval = min(self.heartbeat_interval, self.idle_timeout) / 3
+        last_report = time.monotonic()
+
+        while True:
+            await asyncio.sleep(check_interval)
+
+            try:
+                self._check_idle_connections()
+
+                if time.monotonic() - last_report >= self.report_interval:
+                    last_report = time.monotonic()
+                    log.info("connection gauges", **self.gauges())
+            except Exception:
+                traceback.print_exc()
+
+    def _check_idle_connections(self):
+        current_time = time.monotonic()
+
+        for state in list(self._connections.values()):
+            idle_time = current_time - state.last_activity
+            transport = state.client_package.client
+
+            # the connection is already being closed, connection_lost will tear it down
+            if transport.is_closing():
+                continue
+
+            if idle_time >= self.idle_timeout:
+                # closing the transport calls the protocol's connection_lost, which tears the connection down
+                log.info("closing idle connection", address=state.client_package.address, idle_seconds=round(idle_time))
+                transport.close()
+            elif idle_time >= self.heartbeat_interval and not state.is_heartbeat_sent:
+                # the heartbeat can only be sent once the key exchange is done
+                if not transport.key or not transport.iv:
+                    continue
+
+                transport.write(
+                    ServerMessage(
+                        status={
+                            "code": 200,
+                            "message": "success"
+                        },
+                        method="POST",
+                        endpoint="connection/heartbeat",
+                        payload={
+                            "idle_timeout": self.idle_timeout
+                        }
+                    ).encode()
+                )
+                state.is_heartbeat_sent = True
+
+
+# the lifecycle is shared by all the clients, it is started (and stopped) by the server's main function
+connection_lifecycle = ConnectionLifecycle()
@@ -0,0 +1,43 @@
+import base64
+import binascii
+import json
+
+from Errors.raised_errors import InvalidValue
+
+
+def encode_cursor(**values: int | float | str) -> str:
+    """
+    creates an opaque pagination cursor from the given values (for example, the last song ID that was sent).
+
+    the cursor is only meant to be sent back to the server as-is by the client, the client should never build or read it.
+    """
+    cursor_json = json.dumps(values, separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(cursor_json.encode()).decode()
+
+
+def decode_cursor(cursor: str | None, expected_keys: tuple[str, ...]) -> dict[str, int | float | str] | None:
+    """
+    :param cursor: the cursor that the client sent back (None means the first page)
+    :param expected_keys: the keys that the cursor must have
+    :returns: the cursor's values, or None if no cursor was given
+    """
+    if cursor is None:
+        return None
+
+    if not isinstance(cursor, str):
+        raise InvalidValue(f"expected data type for \"cursor\" is str, got {type(cursor)} instead")
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidValue("the given cursor is invalid")
+
+    if not isinstance(values, dict) or any(key not in values for key in expected_keys):
+        raise InvalidValue("the given cursor is invalid")
+
+    # the values are used as query parameters, so we only allow simple types
+    if not all(isinstance(values[key], (int, float, str)) for key in expected_keys):
+        raise InvalidValue("the given cursor is invalid")
+
+    return values
@@ -0,0 +1,105 @@
+import asyncio
+import traceback
+
+from Utils.sqlite3_ext import DatabasePool
+
+from queries import RecommendationAlgorithm
+
+
+class GenreScoreSink:
+    """
+    collects the listening events (a user played a song's audio or opened its sheets) that increase the user's genre
+    scores, and writes them to the database in batches, instead of writing on every request before the file is sent.
+
+    events of the same user and song are combined into a single score increase, which is then split to the song's
+    genres (and combined per user and genre) when flushing (see RecommendationAlgorithm.bulk_increase_genre_scores_by_song_id).
+
+    the events are flushed every flush_interval seconds, or as soon as max_pending different (user, song) pairs are
+    waiting. stop() flushes whatever is left, so no events are lost when the server shuts down.
+    """
+
+    def __init__(self, flush_interval: float = 5, max_pending: int = 500):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending: dict[tuple[str, int], int] = {}
+        """
+        dict[tuple[user ID, song ID] -> score increase]
+        """
+
+        self._db_pool: DatabasePool | None = None
+        self._flush_task: asyncio.Task | None = None
+
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+
+    def start(self, db_pool: DatabasePool):
+        self._db_pool = db_pool
+
+        if not self._flush_task:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """stops the periodic flushing and flushes all the remaining events"""
+
+        if self._flush_task:
+            self._flush_task.cancel()
+
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+
+            self._flush_task = None
+
+        await self.flush()
+
+    def add(self, user_id: str, song_id: int, score_increase: int):
+        key = (user_id, song_id)
+        self._pending[key] = self._pending.get(key, 0) + score_increase
+
+        if len(self._pending) >= self.max_pending:
+            self._flush_requested.set()
+
+    async def flush(self):
+        if not self._db_pool:
+            return
+
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            # new events are added to a new dict while this batch is written
+            batch, self._pending = self._pending, {}
+
+            try:
+                async with self._db_pool.acquire_writer() as connection:
+                    async with connection.transaction():
+                        await RecommendationAlgorithm.bulk_increase_genre_scores_by_song_id(
+                            connection=connection,
+                            score_increases=batch
+                        )
+            except Exception:
+                traceback.print_exc()
+
+                # the batch is returned, so that it will be written on the next flush
+                for key, score_increase in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + score_increase
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._flush_requested.clear()
+
+            await self.flush()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+# the sink is shared by all the clients, it is started (and stopped) by the server's main function
+genre_score_sink = GenreScoreSink()
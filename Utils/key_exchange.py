@@ -0,0 +1,78 @@
+import os
+
+from DHE.dhe import DHE, generate_dhe_response
+from encryptions import EncryptedTransport
+from pseudo_http_protocol import ClientMessage, ServerMessage
+from RSASigning.public import verify_async, async_rsa_encrypt
+
+
+async def complete_key_exchange(transport: EncryptedTransport, server_message: ServerMessage):
+    """
+    the client's side of the key exchange: answers the server's authentication/key_exchange (INITIATE) message with the
+    client's DHE public value and HMAC key (both encrypted with the server's RSA public key), and then sets the derived
+    AES key, IV and HMAC key on the transport.
+
+    used by client_actions.complete_authentication and by the headless client (LoadTest.headless_client).
+
+    expected payload:
+    {
+        "base": int,
+        "mod": int,
+        "public": int,
+        "iv": bytes,
+        "signature": bytes
+    }
+    """
+
+    payload = server_message.payload
+
+    try:
+        dhe_base = payload["base"]
+        dhe_mod = payload["mod"]
+        server_public_value = payload["public"]
+
+        aes_iv = payload["iv"]
+
+        signature = payload["signature"]
+    except KeyError:
+        raise Exception("invalid message sent from server. this is likely a hacking attempt")
+
+    server_ip, server_port = transport.get_extra_info('peername')
+
+    is_message_from_server = await verify_async(server_ip.encode(), signature)
+
+    if not is_message_from_server:
+        raise Exception("invalid message sent from server. this is likely a hacking attempt")
+
+    client_dhe: DHE = generate_dhe_response(mod=dhe_mod, base=dhe_base)
+
+    client_public_value = client_dhe.calculate_public()
+
+    # this is used for anti-bit flipping. the key is encrypted with the hard-coded RSA public key, and decrypted server
+    # side using the hard-coded private key.
+    hmac_key = os.urandom(32)
+
+    # we use this to fully stop MITM during DHE, because IPs can be faked.
+    rsa_encrypted_public_value = await async_rsa_encrypt(str(client_public_value).encode())
+
+    rsa_encrypted_hmac_key = await async_rsa_encrypt(hmac_key)
+
+    transport.write(
+        ClientMessage(
+            authentication=None,
+            method="respond",
+            endpoint="authentication/key_exchange",
+            payload={
+                "public": rsa_encrypted_public_value,
+                "HMAC_key": rsa_encrypted_hmac_key
+            }
+        ).encode()
+    )
+
+    mutual_key_value = client_dhe.calculate_mutual(peer_public_value=server_public_value)
+
+    aes_key = client_dhe.kdf_derive(mutual_key=mutual_key_value, iterations=10000, size=16)
+
+    transport.iv = aes_iv
+    transport.key = aes_key
+    transport.hmac_key = hmac_key
@@ -0,0 +1,313 @@
+import asyncio
+import math
+import os
+import time
+import traceback
+from collections import defaultdict
+from typing import Callable
+
+# the quantiles that are exported for every latency histogram
+EXPORTED_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """
+    an HDR style histogram of latencies: the latencies are kept in microseconds, in buckets that are linear inside every
+    power of 2 (e.g. with 4 sub-bucket bits, 1024-2047 µs are split into 8 buckets of 128 µs). so every latency is kept
+    with the same relative precision (1/8 = 12.5% here), from a few microseconds to minutes, in a few hundred buckets.
+
+    recording is O(1) and doesn't allocate (other than the first time a bucket is used), so it is cheap enough to run
+    for every request.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 5):
+        """:param sub_bucket_bits: the precision of the buckets, every bucket is at most 1/2^(bits - 1) of its values"""
+
+        self.sub_bucket_bits = sub_bucket_bits
+
+        self._counts: defaultdict[tuple[int, int], int] = defaultdict(int)
+        """
+        dict[(shift, top bits) -> the amount of latencies in the bucket], the bucket has every value whose top bits
+        (after shifting right by shift) are the same
+        """
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        microseconds = max(0, int(seconds * 1_000_000))
+
+        # values that fit in the sub-bucket bits are kept exactly (shift 0)
+        shift = max(0, microseconds.bit_length() - self.sub_bucket_bits)
+
+        self._counts[(shift, microseconds >> shift)] += 1
+
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, quantile: float) -> float:
+        """:returns: the latency (in seconds) that the given fraction of the latencies are at or below"""
+
+        if not self.count:
+            return 0.0
+
+        # the nearest rank
+        rank = max(1, math.ceil(quantile * self.count))
+        seen = 0
+
+        # buckets with a bigger shift always hold bigger values, so sorting the keys sorts the buckets
+        for (shift, top_bits), bucket_count in sorted(self._counts.items()):
+            seen += bucket_count
+
+            if seen >= rank:
+                # the highest value in the bucket (like HDR histograms), but never above the highest recorded value
+                bucket_end = ((top_bits + 1) << shift) - 1
+                return min(bucket_end / 1_000_000, self.max)
+
+        return self.max
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f"{name}=\"{_escape_label(str(value))}\"" for name, value in labels.items()) + "}"
+
+
+class ServerMetrics:
+    """
+    the server's metrics: a latency histogram and response counters (by status code) for every endpoint, the actions
+    that are currently running, the bytes that were received and sent, and any gauge that is registered (e.g. the
+    connection gauges of Utils.connection_lifecycle and the write connection's queue).
+
+    the metrics are exported in the prometheus text format, either on a local-only HTTP port (GET /metrics), or to a
+    file that is rewritten every few seconds (e.g. for node_exporter's textfile collector), or both.
+    """
+
+    def __init__(self):
+        self._latencies: defaultdict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        """
+        dict[endpoint -> the latencies of the endpoint's actions]
+        """
+
+        self._responses: defaultdict[tuple[str, str], int] = defaultdict(int)
+        """
+        dict[(endpoint, status code) -> the amount of responses]
+        """
+
+        self._in_flight: defaultdict[str, int] = defaultdict(int)
+        """
+        dict[endpoint -> the amount of the endpoint's actions that are running]
+        """
+
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self._gauges: dict[str, Callable[[], dict[str, int | float]]] = {}
+        """
+        dict[metric name prefix -> a function that returns dict[name -> current value]]
+        """
+
+        self._labeled_metrics: dict[str, tuple[str, str, Callable[[], dict[str, int | float]]]] = {}
+        """
+        dict[metric name -> (metric type, label name, a function that returns dict[label value -> current value])]
+        """
+
+        self._started_at = time.time()
+
+        self._http_server: asyncio.Server | None = None
+        self._dump_task: asyncio.Task | None = None
+        self._dump_path: str | None = None
+
+    def action_started(self, endpoint: str):
+        self._in_flight[endpoint] += 1
+
+    def action_finished(self, endpoint: str, seconds: float):
+        """records the latency of an action that finished (in any way, including cancelled actions)"""
+
+        self._in_flight[endpoint] -= 1
+        self._latencies[endpoint].record(seconds)
+
+    def count_response(self, endpoint: str, status_code: int | str):
+        self._responses[(endpoint, str(status_code))] += 1
+
+    def add_bytes_received(self, amount: int):
+        self.bytes_received += amount
+
+    def add_bytes_sent(self, amount: int):
+        self.bytes_sent += amount
+
+    def add_gauges(self, prefix: str, gauges: Callable[[], dict[str, int | float]]):
+        """:param gauges: returns dict[name -> current value], every name is exported as the gauge {prefix}_{name}"""
+
+        self._gauges[prefix] = gauges
+
+    def add_labeled_metric(self, name: str, metric_type: str, label: str,
+                           values: Callable[[], dict[str, int | float]]):
+        """
+        :param metric_type: the prometheus type of the metric (counter or gauge)
+        :param values: returns dict[label value -> current value], e.g. the calls of every SQL statement
+        """
+
+        self._labeled_metrics[name] = (metric_type, label, values)
+
+    def render(self) -> str:
+        """:returns: every metric in the prometheus text format"""
+
+        lines: list[str] = []
+
+        def add_metric(name: str, metric_type: str, help_text: str, samples: list[tuple[str, dict[str, str], float]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+
+        latency_samples = []
+
+        for endpoint, histogram in sorted(self._latencies.items()):
+            for quantile in EXPORTED_QUANTILES:
+                latency_samples.append((
+                    "server_action_latency_seconds",
+                    {"endpoint": endpoint, "quantile": str(quantile)},
+                    histogram.quantile(quantile)
+                ))
+
+            latency_samples.append(("server_action_latency_seconds_sum", {"endpoint": endpoint}, histogram.total))
+            latency_samples.append(("server_action_latency_seconds_count", {"endpoint": endpoint}, histogram.count))
+
+        add_metric("server_action_latency_seconds", "summary", "how long the server actions took", latency_samples)
+
+        add_metric(
+            "server_responses_total", "counter", "the responses to requests, by status code",
+            [
+                ("server_responses_total", {"endpoint": endpoint, "code": code}, amount)
+                for (endpoint, code), amount in sorted(self._responses.items())
+            ]
+        )
+
+        add_metric(
+            "server_actions_in_flight", "gauge", "the server actions that are currently running",
+            [
+                ("server_actions_in_flight", {"endpoint": endpoint}, amount)
+                for endpoint, amount in sorted(self._in_flight.items())
+            ]
+        )
+
+        add_metric(
+            "server_received_bytes_total", "counter", "the bytes received from clients",
+            [("server_received_bytes_total", {}, self.bytes_received)]
+        )
+        add_metric(
+            "server_sent_bytes_total", "counter", "the bytes sent to clients (after encryption)",
+            [("server_sent_bytes_total", {}, self.bytes_sent)]
+        )
+        add_metric(
+            "server_start_time_seconds", "gauge", "when the server started (unix time)",
+            [("server_start_time_seconds", {}, self._started_at)]
+        )
+
+        # a broken gauge shouldn't break the rest of the export
+        for prefix, gauges in self._gauges.items():
+            try:
+                values = gauges()
+            except Exception:
+                traceback.print_exc()
+                continue
+
+            for name, value in values.items():
+                add_metric(f"{prefix}_{name}", "gauge", f"{prefix} {name}", [(f"{prefix}_{name}", {}, value)])
+
+        for name, (metric_type, label, values_function) in self._labeled_metrics.items():
+            try:
+                values = values_function()
+            except Exception:
+                traceback.print_exc()
+                continue
+
+            add_metric(
+                name, metric_type, name.replace("_", " "),
+                [(name, {label: label_value}, value) for label_value, value in values.items()]
+            )
+
+        return "\n".join(lines) + "\n"
+
+    async def start(self, port: int | None = None, dump_path: str | None = None, dump_interval: float = 15):
+        """
+        :param port: the port of the HTTP endpoint (only listens on localhost, the metrics aren't meant to be public)
+        :param dump_path: the file to write the metrics to every dump_interval seconds
+        """
+
+        if port is not None:
+            self._http_server = await asyncio.start_server(self._answer_scrape, host="127.0.0.1", port=port)
+
+        if dump_path:
+            self._dump_path = dump_path
+            self._dump_task = asyncio.create_task(self._dump_periodically(dump_interval))
+
+    async def stop(self):
+        if self._http_server:
+            self._http_server.close()
+            await self._http_server.wait_closed()
+
+        if self._dump_task:
+            self._dump_task.cancel()
+            await asyncio.gather(self._dump_task, return_exceptions=True)
+
+            # the last metrics (e.g. the final counts after a load test) are kept
+            self.dump()
+
+    def dump(self):
+        if not self._dump_path:
+            return
+
+        # written to a temporary file and then renamed, so that whoever reads the file never sees half of it
+        temporary_path = f"{self._dump_path}.tmp"
+
+        with open(temporary_path, "w") as metrics_file:
+            metrics_file.write(self.render())
+
+        os.replace(temporary_path, self._dump_path)
+
+    async def _dump_periodically(self, dump_interval: float):
+        while True:
+            await asyncio.sleep(dump_interval)
+
+            try:
+                self.dump()
+            except Exception:
+                traceback.print_exc()
+
+    async def _answer_scrape(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """a minimal HTTP server, that only answers GET /metrics"""
+
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            request_line = request.split(b"\r\n", 1)[0].decode(errors="replace").split()
+
+            if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# the metrics are shared by all the clients, the export is started (and stopped) by the server's main function
+server_metrics = ServerMetrics()
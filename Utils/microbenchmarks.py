@@ -0,0 +1,354 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import timeit
+from dataclasses import dataclass
+from typing import Callable
+
+from AES_128 import api, cbc
+from DHE.dhe import KDF, generate_prime
+from encryptions import HMAC, aes_cbc_encrypt
+from pseudo_http_protocol import ServerMessage, deserialize_data, serialize_data
+from Utils.chunk import KILOBYTE
+
+DEFAULT_BASELINE_PATH = "Utils/microbenchmark_baselines.json"
+
+# the sizes that the hot paths actually see: a small request (a search, a comment), and a chunk message of a file (the
+# server sends 30 KB chunks that are b64 encoded, the client uploads raw 32 KB chunks, see Utils.send_to_client_chunk
+# and Utils.chunk)
+REQUEST_SIZE = 256
+SERVER_CHUNK_SIZE = 30 * 1000
+CLIENT_CHUNK_SIZE = 32 * KILOBYTE
+
+# the HMAC is compared with the old implementation on a chunk message and on a big message
+HMAC_LARGE_MESSAGE_SIZE = 1000 * KILOBYTE
+
+# the pure python AES is a few orders of magnitude slower than the C one, so it is measured on a smaller message
+PURE_AES_MESSAGE_SIZE = 1 * KILOBYTE
+
+KEY = bytes(range(16))
+IV = bytes(range(16, 32))
+
+
+@dataclass
+class Microbenchmark:
+    """
+    name - the benchmark's name in the report and in the baselines
+    function - a single call of the measured code (with everything it needs already prepared)
+    bytes_per_call - how much data one call processes, used to show the cost per MB (0 for benchmarks that don't process
+    data, like generate_prime)
+    """
+
+    name: str
+    function: Callable[[], object]
+    bytes_per_call: int = 0
+
+
+def _chunk_payload(chunk: bytes | str) -> dict:
+    return {
+        "chunk": chunk,
+        "song_id": 1,
+        "file_id": "0" * 32,
+        "chunk_number": 1,
+        "is_last_chunk": False,
+    }
+
+
+def _concatenating_hmac(key: bytes) -> Callable[[bytes], bytes]:
+    """
+    the HMAC as encryptions.HMAC computed it before it kept the hashed keys: the key is put in front of every message,
+    which copies the whole message. kept as a reference, so the saving shows next to encryptions.HMAC.derive
+    """
+
+    key_1, key_2 = HMAC(key).create_expanded_keys()
+
+    def derive(data: bytes) -> bytes:
+        return hashlib.sha256(key_2 + hashlib.sha256(key_1 + data).digest()).digest()
+
+    return derive
+
+
+def _seeded(function: Callable[[], object], seed: int = 0) -> Callable[[], object]:
+    """makes a function that uses the random module do the same work on every call (e.g. try the same prime candidates)"""
+
+    def seeded_function():
+        random.seed(seed)
+        return function()
+
+    return seeded_function
+
+
+def create_microbenchmarks() -> list[Microbenchmark]:
+    # random data (and not zeros), so that nothing in the measured code gets an easier case
+    data_random = random.Random(0)
+
+    block = data_random.randbytes(16)
+    # cbc_decrypt checks that the decrypted message is valid utf-8, so the message is text
+    pure_aes_message = "".join(data_random.choices(string.ascii_letters, k=PURE_AES_MESSAGE_SIZE)).encode()
+    request_message = data_random.randbytes(REQUEST_SIZE)
+    client_chunk = data_random.randbytes(CLIENT_CHUNK_SIZE)
+    server_chunk = base64.b64encode(data_random.randbytes(SERVER_CHUNK_SIZE)).decode()
+
+    encrypted_block = api.encrypt(block, KEY)
+    encrypted_pure_aes_message = cbc.cbc_encrypt(pure_aes_message, KEY, IV)
+
+    chunk_message = ServerMessage(
+        status={"code": 200, "message": "success"},
+        method="POST",
+        endpoint="song/download/audio",
+        payload=_chunk_payload(server_chunk)
+    )
+    encoded_chunk_message = chunk_message.encode()
+
+    serialized_client_chunk = json.loads(json.dumps(serialize_data(_chunk_payload(client_chunk))))
+
+    hmac_message = data_random.randbytes(SERVER_CHUNK_SIZE)
+    large_hmac_message = data_random.randbytes(HMAC_LARGE_MESSAGE_SIZE)
+
+    hmac = HMAC(KEY)
+    concatenating_hmac = _concatenating_hmac(KEY)
+
+    # an encrypted message with its HMAC, as EncryptedTransport.read gets it
+    tagged_large_message = large_hmac_message + hmac.derive(large_hmac_message)
+
+    return [
+        Microbenchmark("AES_128.api.encrypt", lambda: api.encrypt(block, KEY), len(block)),
+        Microbenchmark("AES_128.api.decrypt", lambda: api.decrypt(encrypted_block, KEY), len(block)),
+
+        Microbenchmark(
+            "AES_128.cbc.cbc_encrypt[1KB]",
+            lambda: cbc.cbc_encrypt(pure_aes_message, KEY, IV),
+            len(pure_aes_message)
+        ),
+        Microbenchmark(
+            "AES_128.cbc.cbc_decrypt[1KB]",
+            lambda: cbc.cbc_decrypt(encrypted_pure_aes_message, KEY, IV),
+            len(pure_aes_message)
+        ),
+
+        Microbenchmark(
+            "encryptions.aes_cbc_encrypt[request]",
+            lambda: aes_cbc_encrypt(request_message, KEY, IV),
+            len(request_message)
+        ),
+        Microbenchmark(
+            "encryptions.aes_cbc_encrypt[chunk]",
+            lambda: aes_cbc_encrypt(encoded_chunk_message, KEY, IV),
+            len(encoded_chunk_message)
+        ),
+
+        Microbenchmark("encryptions.HMAC.derive[request]", lambda: hmac.derive(request_message), len(request_message)),
+        Microbenchmark(
+            "encryptions.HMAC.derive[chunk]",
+            lambda: hmac.derive(encoded_chunk_message),
+            len(encoded_chunk_message)
+        ),
+        Microbenchmark("encryptions.HMAC.derive[30KB]", lambda: hmac.derive(hmac_message), len(hmac_message)),
+        Microbenchmark(
+            "encryptions.HMAC.derive[1MB]",
+            lambda: hmac.derive(large_hmac_message),
+            len(large_hmac_message)
+        ),
+        Microbenchmark(
+            "reference: concatenating HMAC[30KB]",
+            lambda: concatenating_hmac(hmac_message),
+            len(hmac_message)
+        ),
+        Microbenchmark(
+            "reference: concatenating HMAC[1MB]",
+            lambda: concatenating_hmac(large_hmac_message),
+            len(large_hmac_message)
+        ),
+        # the verification that EncryptedTransport.read does, on a view of the message (so the message isn't copied)
+        Microbenchmark(
+            "encryptions.HMAC.verify[1MB]",
+            lambda: hmac.verify(memoryview(tagged_large_message)[:-32], memoryview(tagged_large_message)[-32:]),
+            len(large_hmac_message)
+        ),
+
+        # the same KDF that the key exchange runs (see DHE.kdf_derive), a new KDF every call since derive_key changes it
+        Microbenchmark(
+            "DHE.KDF.derive_key[10000 iterations]",
+            lambda: KDF(str(2 ** 199 + 12345).encode(), size=16, iterations=10000).derive_key()
+        ),
+
+        # the server generates a 200 bit prime for every connection (see DHE.generate_initial_dhe)
+        Microbenchmark("DHE.generate_prime[200 bits]", _seeded(lambda: generate_prime(200))),
+
+        Microbenchmark(
+            "pseudo_http_protocol.serialize_data[client chunk]",
+            lambda: serialize_data(_chunk_payload(client_chunk)),
+            len(client_chunk)
+        ),
+        Microbenchmark(
+            "pseudo_http_protocol.deserialize_data[client chunk]",
+            lambda: deserialize_data(serialized_client_chunk),
+            len(client_chunk)
+        ),
+
+        Microbenchmark("ServerMessage.encode[chunk]", chunk_message.encode, len(encoded_chunk_message)),
+    ]
+
+
+def measure(microbenchmark: Microbenchmark, repeat: int = 5, minimum_time: float = 0.2) -> dict[str, float]:
+    """
+    runs the benchmark in batches that take at least minimum_time seconds each (see timeit.Timer.autorange).
+
+    the fastest batch is the one that is compared to the baseline, since the slower ones mostly measure whatever else
+    the machine was doing at the time.
+
+    :returns: dict with the best and the median seconds per call, and the milliseconds per MB
+    """
+
+    timer = timeit.Timer(microbenchmark.function)
+
+    calls_per_batch, batch_time = timer.autorange()
+
+    # autorange stops at the first amount that takes at least 0.2 seconds, so the amount is scaled up to the wanted time
+    if batch_time < minimum_time:
+        calls_per_batch = max(1, int(calls_per_batch * minimum_time / batch_time))
+
+    batch_times = timer.repeat(repeat=repeat, number=calls_per_batch)
+    seconds_per_call = [batch_time / calls_per_batch for batch_time in batch_times]
+
+    result = {
+        "seconds_per_call": min(seconds_per_call),
+        "median_seconds_per_call": statistics.median(seconds_per_call),
+        "calls_per_batch": calls_per_batch,
+    }
+
+    if microbenchmark.bytes_per_call:
+        result["milliseconds_per_mb"] = min(seconds_per_call) * 1000 * 1_000_000 / microbenchmark.bytes_per_call
+
+    return result
+
+
+def find_regressions(results: dict[str, dict], baselines: dict[str, dict],
+                     threshold: float) -> dict[str, float]:
+    """
+    :param threshold: how much slower (relatively) a benchmark can get before it counts as a regression, e.g. 0.15
+    :returns: dict[benchmark name -> how much slower it got (relatively)] for every benchmark that got too slow
+    """
+
+    regressions = {}
+
+    for name, result in results.items():
+        baseline = baselines.get(name)
+
+        if not baseline:
+            continue
+
+        slowdown = result["seconds_per_call"] / baseline["seconds_per_call"] - 1
+
+        if slowdown > threshold:
+            regressions[name] = slowdown
+
+    return regressions
+
+
+def _environment() -> dict[str, str]:
+    # baselines are only comparable on the same machine and python
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.system(),
+    }
+
+
+def _format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+
+    return f"{seconds * 1e6:.2f} µs"
+
+
+def main() -> int:
+    """
+    python -m Utils.microbenchmarks [--save] [--threshold 0.15] [--filter aes]
+
+    measures the crypto and serialization hot paths (the AES implementations, the HMAC, the key exchange's KDF and
+    prime generation, and the message encoding) at the sizes they are used with, and compares every result with the
+    saved baseline. exits with 1 if any benchmark got slower than the threshold allows.
+
+    run it with --save once on a machine (before changing any of these paths) to create its baseline.
+    run it from the project's root directory.
+    """
+
+    parser = argparse.ArgumentParser(description="measures the crypto and serialization hot paths")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="the JSON file of the baselines")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baselines")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown, relatively to the baseline")
+    parser.add_argument("--repeat", type=int, default=5, help="batches per benchmark")
+    parser.add_argument("--filter", help="only run the benchmarks whose name contains this text")
+
+    arguments = parser.parse_args()
+
+    baselines: dict[str, dict] = {}
+    baseline_environment = None
+
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baseline_file:
+            baseline_data = json.load(baseline_file)
+
+        baselines = baseline_data["results"]
+        baseline_environment = baseline_data["environment"]
+
+    if baseline_environment and baseline_environment != _environment():
+        print(f"warning: the baselines were saved on a different environment ({baseline_environment})")
+
+    microbenchmarks = [
+        microbenchmark for microbenchmark in create_microbenchmarks()
+        if not arguments.filter or arguments.filter.lower() in microbenchmark.name.lower()
+    ]
+
+    print(f"{'benchmark':<52} {'per call':>11} {'median':>11} {'ms/MB':>10} {'vs baseline':>12}")
+
+    results: dict[str, dict] = {}
+
+    for microbenchmark in microbenchmarks:
+        result = measure(microbenchmark, repeat=arguments.repeat)
+        results[microbenchmark.name] = result
+
+        baseline = baselines.get(microbenchmark.name)
+        change = f"{result['seconds_per_call'] / baseline['seconds_per_call'] - 1:+.1%}" if baseline else "-"
+        milliseconds_per_mb = f"{result['milliseconds_per_mb']:.1f}" if "milliseconds_per_mb" in result else "-"
+
+        print(
+            f"{microbenchmark.name:<52} {_format_time(result['seconds_per_call']):>11} "
+            f"{_format_time(result['median_seconds_per_call']):>11} {milliseconds_per_mb:>10} {change:>12}"
+        )
+
+    if arguments.save:
+        # benchmarks that weren't ran this time (see --filter) keep their old baselines
+        with open(arguments.baseline, "w") as baseline_file:
+            json.dump({"environment": _environment(), "results": {**baselines, **results}}, baseline_file, indent=4)
+
+        print(f"saved the baselines to {arguments.baseline}")
+        return 0
+
+    if not baselines:
+        print(f"no baselines found at {arguments.baseline}, run with --save to create them")
+        return 0
+
+    regressions = find_regressions(results, baselines, arguments.threshold)
+
+    for name, slowdown in regressions.items():
+        print(f"{name} regressed by {slowdown:.1%} (more than {arguments.threshold:.0%})")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import os
+import sys
+import sqlite3
+import tempfile
+
+from initiate_database import DatabaseMigrations
+from Utils.sqlite3_ext import init_connection
+from Utils.statement_registry import StatementRegistry
+
+# importing queries registers all of its statements
+from queries import statements
+
+EXPECTED_SCANS: dict[str, str] = {
+    # dict[statement name -> why the statement is allowed to scan a whole table]
+    "music_search.fetch_all_song_ids": "loads every song ID once, for the random song sampler",
+    "music_search.fetch_genre_names": "lists genre names until it has 100 of them, so it stops early",
+    "music_search.search_song_by_length": "song lengths are not indexed, the search is paged and rarely used",
+    "user_stats.backfill": "recounts every user, only ran by Utils.user_stats_check",
+    "user_stats.find_inconsistencies": "checks every user, only ran by Utils.user_stats_check",
+}
+
+
+def explain(connection: sqlite3.Connection, sql: str) -> list[str]:
+    """:returns: the details of every step in the statement's query plan"""
+
+    # the plan doesn't depend on the parameters' values, only on their amount
+    parameters = [None] * sql.count("?")
+
+    return [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()]
+
+
+def find_full_scans(connection: sqlite3.Connection, registry: StatementRegistry) -> dict[str, list[str]]:
+    """
+    :returns: dict[statement name -> the steps that scan a whole table] for every statement that scans a table and isn't
+    in EXPECTED_SCANS
+    """
+
+    # only scans of real tables are checked, scanning a CTE (e.g. the ranked candidates of the song name search) only
+    # goes over the rows that the CTE already found
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    full_scans: dict[str, list[str]] = {}
+
+    for name, sql in registry:
+        if name in EXPECTED_SCANS:
+            continue
+
+        # "SCAN table" goes over every row of the table, while "SEARCH table USING INDEX" only reads the matching rows.
+        # virtual tables (FTS5, spellfix1, json_each) are searched through their own indexes, so they are fine
+        scans = [
+            detail for detail in explain(connection, sql)
+            if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail and detail.split()[1] in tables
+        ]
+
+        if scans:
+            full_scans[name] = scans
+
+    return full_scans
+
+
+def main() -> int:
+    """
+    creates an empty database with the latest schema, and makes sure that no statement in queries.py does a full table
+    scan (unless it is expected to). run it after changing a query or the schema:
+
+        python -m Utils.query_plan_check
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "query_plan_check.db")
+
+        DatabaseMigrations(database).migrate()
+
+        connection = sqlite3.connect(database)
+
+        try:
+            connection.enable_load_extension(True)
+            init_connection(connection)
+
+            full_scans = find_full_scans(connection, statements)
+        finally:
+            connection.close()
+
+    for name, scans in full_scans.items():
+        print(f"{name} scans a whole table:")
+
+        for scan in scans:
+            print(f"    {scan}")
+
+    print(f"checked {len(statements)} statements, {len(full_scans)} of them scan a whole table")
+
+    return 1 if full_scans else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import CodeType
+
+from Utils.stall_detector import PROJECT_ROOT
+
+# the frames that a thread is in while it waits for work, samples that end in them are counted as idle (and left out of
+# the profile, otherwise the waiting executor threads and the loop's select would take most of the flamegraph)
+IDLE_FRAMES: set[tuple[str, str]] = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _frame_label(filename: str, function: str) -> str:
+    path = os.path.abspath(filename)
+    path = os.path.relpath(path, PROJECT_ROOT) if path.startswith(PROJECT_ROOT) else os.path.basename(path)
+
+    return f"{function} ({path})"
+
+
+def _thread_label(thread_name: str) -> str:
+    # the executor's threads are numbered (asyncio_0, asyncio_1...), they are combined into a single root
+    return re.sub(r"_\d+$", "", thread_name).replace(";", ":")
+
+
+class SamplingProfiler:
+    """
+    a sampling profiler that can be started and stopped while the server runs: a background thread takes the stacks of
+    every other thread (including the default executor's threads, which run the RSA decryption and the aiofiles calls)
+    every interval, and counts every distinct stack.
+
+    the result is written in the collapsed stack format (one "thread;outer frame;...;inner frame count" line per stack),
+    which flamegraph.pl, speedscope and inferno read directly.
+
+    the overhead is bounded: taking a sample holds the GIL, so the sampler waits long enough between samples for the
+    sampling to take at most max_overhead of the time, and the amount of distinct stacks is capped (with the rest
+    counted under a single [other stacks] entry). so it is safe to leave running for a few minutes in production.
+    """
+
+    def __init__(self, output_directory: str = "Profiles", interval: float = 0.01, max_overhead: float = 0.02,
+                 max_stacks: int = 20000):
+        """
+        :param output_directory: where the collapsed stack files are written
+        :param interval: how often (in seconds) to sample, if the sampling overhead allows it
+        :param max_overhead: the maximum fraction of the time that can be spent on sampling
+        :param max_stacks: the maximum amount of distinct stacks that are kept
+        """
+        self.output_directory = output_directory
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.max_stacks = max_stacks
+
+        self.last_output_path: str | None = None
+
+        self._stacks: Counter[str] = Counter()
+        self._samples = 0
+        self._idle_samples = 0
+        self._started_at = 0.0
+
+        # dict[code object -> its label in the profile], so that every function's label is only built once
+        self._frame_labels: dict[CodeType, str] = {}
+
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float | None = None) -> bool:
+        """
+        :param duration: stops on its own after this many seconds (runs until stop() is called if not given)
+        :returns: False if the profiler is already running
+        """
+
+        with self._lock:
+            if self.is_running:
+                return False
+
+            self._stacks = Counter()
+            self._samples = 0
+            self._idle_samples = 0
+            self._started_at = time.time()
+            self._stopped.clear()
+
+            self._thread = threading.Thread(
+                target=self._sample_until_stopped,
+                args=(duration,),
+                name="sampling-profiler",
+                daemon=True
+            )
+            self._thread.start()
+
+        print(f"started the sampling profiler (pid {os.getpid()})")
+
+        return True
+
+    def stop(self, wait: bool = True) -> str | None:
+        """
+        :param wait: whether to wait for the profile to be written (the sampler writes it right after stopping)
+        :returns: the path of the written profile (only known when waiting)
+        """
+
+        thread = self._thread
+
+        if thread is None:
+            return None
+
+        self._stopped.set()
+
+        if not wait:
+            return None
+
+        thread.join()
+
+        return self.last_output_path
+
+    def toggle(self):
+        """starts the profiler if it isn't running, and stops it (without waiting) if it is, e.g. from a signal handler"""
+
+        if self.is_running:
+            self.stop(wait=False)
+        else:
+            self.start()
+
+    def _sample_until_stopped(self, duration: float | None):
+        deadline = time.monotonic() + duration if duration is not None else None
+        own_thread_id = threading.get_ident()
+
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                sample_started = time.perf_counter()
+
+                self._sample(own_thread_id)
+
+                sample_time = time.perf_counter() - sample_started
+
+                # sample_time / (sample_time + wait) <= max_overhead
+                wait = max(self.interval, sample_time * (1 / self.max_overhead - 1))
+
+                if self._stopped.wait(wait):
+                    break
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._write_profile()
+
+    def _sample(self, own_thread_id: int):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+
+            self._samples += 1
+
+            leaf_code = frame.f_code
+            if (os.path.basename(leaf_code.co_filename), leaf_code.co_name) in IDLE_FRAMES:
+                self._idle_samples += 1
+                continue
+
+            # the frames are walked by hand (and not with traceback.extract_stack), since looking up the source lines
+            # would cost more than everything else in a sample
+            labels = []
+
+            while frame is not None:
+                code = frame.f_code
+
+                label = self._frame_labels.get(code)
+                if label is None:
+                    label = self._frame_labels[code] = _frame_label(code.co_filename, code.co_name)
+
+                labels.append(label)
+                frame = frame.f_back
+
+            labels.append(_thread_label(thread_names.get(thread_id, f"thread-{thread_id}")))
+
+            collapsed_stack = ";".join(reversed(labels))
+
+            if collapsed_stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                collapsed_stack = "[other stacks]"
+
+            self._stacks[collapsed_stack] += 1
+
+    def _write_profile(self):
+        os.makedirs(self.output_directory, exist_ok=True)
+
+        timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started_at))
+        output_path = os.path.join(self.output_directory, f"profile_{os.getpid()}_{timestamp}.collapsed")
+
+        with open(output_path, "w") as output_file:
+            for collapsed_stack, count in self._stacks.most_common():
+                output_file.write(f"{collapsed_stack} {count}\n")
+
+        self.last_output_path = output_path
+
+        print(
+            f"wrote the sampling profile to {output_path} ({self._samples} samples, {self._idle_samples} of them idle, "
+            f"{len(self._stacks)} distinct stacks)"
+        )
+
+
+# toggled by SIGUSR2 or by the admin/profiler endpoint (see server.main and server_actions.control_profiler)
+sampling_profiler = SamplingProfiler()
@@ -10,19 +10,23 @@ import aiofiles.os as aos
 from encryptions import EncryptedTransport
 from pseudo_http_protocol import ServerMessage
 from Utils.chunk import fast_create_unique_id
+from Utils.tracing import span
+from Utils.structured_logging import get_logger
 
 import logging
 
-import asqlite
+from Utils.sqlite3_ext import DatabasePool
 from queries import (
     Music,
     MediaFiles
 )
 
+log = get_logger("preview")
+
 
 async def send_song_preview_chunks(
         transport: EncryptedTransport,
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         song_ids: list[int],
         user_id: str,
 ):
@@ -38,14 +42,12 @@ async def send_song_preview_chunks(
             default_cover_image_path=default_cover_image_path
         )
 
-        print("here")
-
         favorite_song_ids: set[int] = await Music.bulk_fetch_favorite_song_ids(
             connection=connection,
             user_id=user_id
         )
 
-        print(favorite_song_ids)
+        log.debug("fetched favorite song IDs", songs=len(song_ids), favorites=len(favorite_song_ids))
 
     try:
         for song_path, song_dict in song_path_and_data:
@@ -72,7 +74,11 @@ async def send_song_preview_chunks(
                 # the username who uploaded the song
                 "username": song_dict["username"],
 
-                "is_favorite_song": song_id in favorite_song_ids
+                "is_favorite_song": song_id in favorite_song_ids,
+
+                # used by the client in order to validate its locally cached media (audio, sheets) for the song
+                "media_version": song_dict["media_version"],
+                "sheet_count": song_dict["sheet_count"],
             }
 
             transport.write(
@@ -99,9 +105,47 @@ async def send_song_preview_chunks(
         raise e
 
 
+def send_song_preview_cursor(
+        transport: EncryptedTransport,
+        requested_endpoint: str,
+        cursor: str | None,
+        previews_amount: int,
+        query: str | None = None
+):
+    """
+    sends the client the cursor of the next page of song previews. it is sent before the previews themselves, so that
+    the client can already request the next page while the current one is still loading.
+
+    :param requested_endpoint: the endpoint that the previews were requested from (e.g. song/download/preview), so that
+    the client knows which list the cursor belongs to
+    :param cursor: the cursor of the next page, None if there are no more pages
+    :param previews_amount: the amount of previews that are sent after the cursor, so that the client knows when the
+    page finished loading
+    :param query: the search query (or genre) that the previews were requested for, so that the client doesn't use a
+    cursor of a previous search of the same endpoint
+    """
+
+    transport.write(
+        ServerMessage(
+            status={
+                "code": 200,
+                "message": "success"
+            },
+            method="POST",
+            endpoint="song/download/preview/cursor",
+            payload={
+                "cursor": cursor,
+                "endpoint": requested_endpoint,
+                "query": query,
+                "count": previews_amount
+            }
+        ).encode()
+    )
+
+
 async def resend_file_chunks(
         transport: EncryptedTransport,
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         song_id: int,
         original_file_id: str
 ):
@@ -129,7 +173,7 @@ async def resend_file_chunks(
 
 async def send_song_audio_chunks(
     transport: EncryptedTransport,
-    db_pool: asqlite.Pool,
+    db_pool: DatabasePool,
     song_id: int,
 ):
     file_id = fast_create_unique_id(song_id)
@@ -155,7 +199,7 @@ async def send_song_audio_chunks(
 
 async def send_song_sheet_chunks(
     transport: EncryptedTransport,
-    db_pool: asqlite.Pool,
+    db_pool: DatabasePool,
     song_id: int,
 ):
     async with db_pool.acquire() as connection:
@@ -215,7 +259,8 @@ async def send_file_chunks(
         chunk_number = 0
 
         while True:
-            chunk = await file.read(chunk_size)
+            async with span("file.read", bytes=chunk_size):
+                chunk = await file.read(chunk_size)
 
             if not chunk:
                 break
@@ -1,21 +1,223 @@
 import asqlite
-
+from asqlite import ProxiedConnection
 
 import os
+import time
+import sqlite3
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from Utils.tracing import record_span
+
+# no file suffix, sqlite adds the platform's own (spellfix.dll on windows, spellfix.so on linux, see
+# Sqlite3Extensions/README.md)
+spell_fix_extension = os.path.abspath("./Sqlite3Extensions/spellfix")
+
+# note: asqlite already sets journal_mode=wal and foreign_keys=ON on every connection it opens
+SHARED_PRAGMAS = (
+    # negative values are in KiB, so this is ~20MB of page cache per connection
+    "PRAGMA cache_size = -20000;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA temp_store = MEMORY;",
+    # how long (in milliseconds) a connection waits for a lock before raising "database is locked"
+    "PRAGMA busy_timeout = 5000;",
+)
 
-spell_fix_extension = os.path.abspath("./Sqlite3Extensions/spellfix.dll")
+# with a few workers (see server.supervise) every worker has its own write connection, and they wait for each other's
+# transactions through sqlite's lock. a write transaction takes the lock when it begins, waits for it for up to
+# WRITER_BUSY_TIMEOUT_MILLISECONDS, and if it still couldn't get it, begins again after a short delay
+WRITER_BUSY_TIMEOUT_MILLISECONDS = 5000
+WRITER_BEGIN_ATTEMPTS = 3
+WRITER_BEGIN_RETRY_DELAY = 0.1
 
 
-def init_connection(conn):
+def init_connection(conn: sqlite3.Connection):
     conn.enable_load_extension(True)
     conn.execute(f"SELECT load_extension('{spell_fix_extension}');")
 
+    for pragma in SHARED_PRAGMAS:
+        conn.execute(pragma)
+
+
+def init_reader_connection(conn: sqlite3.Connection):
+    init_connection(conn)
+
+    # any write attempted on a reader is a bug, this makes it fail instead of competing with the writer for the lock
+    conn.execute("PRAGMA query_only = ON;")
+
+
+def init_writer_connection(conn: sqlite3.Connection):
+    init_connection(conn)
+
+    # in WAL mode, NORMAL is still safe from corruption, and only syncs to disk on checkpoints instead of every commit
+    conn.execute("PRAGMA synchronous = NORMAL;")
+
+    conn.execute(f"PRAGMA busy_timeout = {WRITER_BUSY_TIMEOUT_MILLISECONDS};")
+
+
+class WriterTransaction:
+    """
+    a transaction that takes the write lock when it begins (BEGIN IMMEDIATE), instead of on its first write.
+
+    asqlite begins deferred transactions, which only ask for the write lock on their first write. if another process
+    committed since the transaction's first read, sqlite can't wait for the lock (the transaction's snapshot is
+    outdated), and the write fails with "database is locked" right away, in the middle of the transaction. beginning
+    with the lock means the only place that waits for (or fails to get) it is the BEGIN, which is safe to retry.
+    """
+
+    def __init__(self, connection: ProxiedConnection):
+        self._connection = connection
+
+    async def start(self):
+        for attempt in range(1, WRITER_BEGIN_ATTEMPTS + 1):
+            try:
+                await self._connection.execute("BEGIN IMMEDIATE;")
+                return
+            except sqlite3.OperationalError as error:
+                if "locked" not in str(error) or attempt == WRITER_BEGIN_ATTEMPTS:
+                    raise
+
+            await asyncio.sleep(WRITER_BEGIN_RETRY_DELAY * attempt)
+
+    async def commit(self):
+        await self._connection.commit()
+
+    async def rollback(self):
+        await self._connection.rollback()
+
+    async def __aenter__(self) -> "WriterTransaction":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+
+
+class WriterConnection:
+    """the write connection, whose transactions begin with the write lock (see WriterTransaction)"""
+
+    def __init__(self, connection: ProxiedConnection):
+        self._connection = connection
+
+    def transaction(self) -> WriterTransaction:
+        return WriterTransaction(self._connection)
+
+    def __getattr__(self, name: str):
+        return getattr(self._connection, name)
+
+
+class DatabasePool:
+    """
+    sqlite allows a single writer at a time, so having every pooled connection write causes "database is locked"
+    stalls once there are concurrent writes.
+
+    instead, there is a single write connection (which requests wait for in order) and multiple read-only connections.
+    in WAL mode the readers never block the writer (and the writer never blocks the readers).
+
+    the single writer is per process: with --workers N (see server.supervise) there are N write connections, one per
+    worker, that wait for each other through sqlite's lock. their transactions begin with the lock (see
+    WriterTransaction), so a worker waits up to WRITER_BUSY_TIMEOUT_MILLISECONDS (and a few retries) for the other
+    workers' transactions, and only then fails with "database is locked".
+
+    use acquire() for reading, and acquire_writer() for anything that changes the database.
+    """
+
+    def __init__(self, reader_pool: asqlite.Pool, writer_pool: asqlite.Pool, recent_waits_amount: int = 1000):
+        self._reader_pool = reader_pool
+        self._writer_pool = writer_pool
+
+        self.writer_queue_length = 0
+        """the amount of requests that are currently waiting for the write connection"""
+
+        self._writer_wait_count = 0
+        self._writer_total_wait = 0.0
+        self._writer_max_wait = 0.0
+        self._writer_recent_waits: deque[float] = deque(maxlen=recent_waits_amount)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[ProxiedConnection]:
+        """acquires a read-only connection"""
+
+        queued_at = time.perf_counter()
+
+        async with self._reader_pool.acquire() as connection:
+            record_span("db.acquire", queued_at)
+
+            yield connection
+
+    @asynccontextmanager
+    async def acquire_writer(self) -> AsyncIterator[WriterConnection]:
+        """acquires the write connection, waiting for any requests that asked for it before"""
+
+        queued_at = time.perf_counter()
+        self.writer_queue_length += 1
+
+        is_waiting = True
+        try:
+            async with self._writer_pool.acquire() as connection:
+                is_waiting = False
+                self.writer_queue_length -= 1
+
+                self._record_writer_wait(time.perf_counter() - queued_at)
+                record_span("db.acquire_writer", queued_at)
+
+                yield WriterConnection(connection)
+        finally:
+            # the request was cancelled while waiting
+            if is_waiting:
+                self.writer_queue_length -= 1
+
+    def _record_writer_wait(self, wait: float):
+        self._writer_wait_count += 1
+        self._writer_total_wait += wait
+        self._writer_max_wait = max(self._writer_max_wait, wait)
+        self._writer_recent_waits.append(wait)
+
+    def writer_queue_metrics(self) -> dict[str, int | float]:
+        """
+        :returns: the time requests spent waiting for the write connection (in seconds). the percentiles are of the
+        recent waits only.
+        """
+
+        recent_waits = sorted(self._writer_recent_waits)
+
+        def percentile(fraction: float) -> float:
+            if not recent_waits:
+                return 0.0
+
+            return recent_waits[min(len(recent_waits) - 1, int(len(recent_waits) * fraction))]
+
+        return {
+            "queue_length": self.writer_queue_length,
+            "wait_count": self._writer_wait_count,
+            "average_wait": self._writer_total_wait / self._writer_wait_count if self._writer_wait_count else 0.0,
+            "max_wait": self._writer_max_wait,
+            "p50_wait": percentile(0.5),
+            "p99_wait": percentile(0.99),
+        }
+
+    async def close(self):
+        await self._reader_pool.close()
+        await self._writer_pool.close()
+
 
 # Create the connection pool with the init function
-async def create_connection_pool(database: str):
-    pool = await asqlite.create_pool(
+async def create_connection_pool(database: str, readers: int = 8) -> DatabasePool:
+    reader_pool = await asqlite.create_pool(
+        database,
+        init=init_reader_connection,
+        size=readers
+    )
+
+    writer_pool = await asqlite.create_pool(
         database,
-        init=init_connection,
-        size=10
+        init=init_writer_connection,
+        size=1
     )
-    return pool
+
+    return DatabasePool(reader_pool=reader_pool, writer_pool=writer_pool)
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+
+from Utils.metrics import LatencyHistogram
+from Utils.structured_logging import get_logger
+
+log = get_logger("event_loop")
+
+# frames under the project's root (and not under a virtual environment inside it) are the project's own code
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class StallSite:
+    """
+    call_site - the innermost frame of the project's own code that was running when the loop stalled
+    stalls - how many stalls were caught at the call site
+    total_stall_time - the sum of those stalls (in seconds)
+    max_stall_time - the longest of those stalls (in seconds)
+    example_stack - the whole stack of the longest stall
+    """
+
+    call_site: str
+    stalls: int = 0
+    total_stall_time: float = 0.0
+    max_stall_time: float = 0.0
+    example_stack: str = ""
+
+
+def _is_project_frame(filename: str) -> bool:
+    path = os.path.abspath(filename)
+
+    return path.startswith(PROJECT_ROOT) and "site-packages" not in path
+
+
+def find_call_site(stack: traceback.StackSummary) -> str:
+    """:returns: "path:line in function" of the innermost frame of the project's code (or of the innermost frame)"""
+
+    frame = next((frame for frame in reversed(stack) if _is_project_frame(frame.filename)), stack[-1])
+    filename = os.path.relpath(frame.filename, PROJECT_ROOT) if _is_project_frame(frame.filename) else frame.filename
+
+    return f"{filename}:{frame.lineno} in {frame.name}"
+
+
+class LoopStallDetector:
+    """
+    finds the code that blocks the event loop (synchronous CPU work or IO inside a coroutine or a protocol callback),
+    which delays every other client while it runs.
+
+    a heartbeat task on the loop wakes up every heartbeat_interval seconds and measures how late it woke up (the loop's
+    lag). a watchdog thread checks the heartbeat, and once the loop didn't beat for longer than the threshold it
+    captures the loop thread's stack while it is still blocked (sys._current_frames works from any thread). when the
+    loop beats again, the stall's length is added to the stack's call site.
+
+    the report is logged every report_interval seconds and when the detector stops, the call sites that stalled the
+    loop for the longest (in total) first.
+    """
+
+    def __init__(self, threshold: float = 0.1, heartbeat_interval: float = 0.05, report_interval: float = 300):
+        """
+        :param threshold: how long (in seconds) the loop can be blocked before it counts as a stall
+        :param heartbeat_interval: how often (in seconds) the heartbeat task wakes up
+        :param report_interval: how often (in seconds) the report is logged
+        """
+        self.threshold = threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.report_interval = report_interval
+
+        self.lag = LatencyHistogram()
+        """the loop's lag on every heartbeat"""
+
+        self._sites: dict[str, StallSite] = {}
+        """
+        dict[call site -> the stalls that were caught at it]
+        """
+
+        self._lock = threading.Lock()
+
+        # written by the heartbeat task, read by the watchdog thread
+        self._last_beat = time.monotonic()
+        self._beat_number = 0
+
+        # the stack that the watchdog captured during the current stall: tuple[beat number, stack]
+        self._captured_stack: tuple[int, traceback.StackSummary] | None = None
+
+        self._loop_thread_id: int | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """starts watching the running loop (has to be called from the loop's thread)"""
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+
+        self._heartbeat = asyncio.create_task(self._beat())
+
+        self._watchdog = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+
+        if self._watchdog:
+            # joined in a thread, so that the loop isn't blocked while the watchdog finishes its last check
+            await asyncio.to_thread(self._watchdog.join)
+
+        self.log_report()
+
+    def report(self) -> list[StallSite]:
+        """:returns: every call site that stalled the loop, the longest (in total) first"""
+
+        with self._lock:
+            sites = list(self._sites.values())
+
+        return sorted(sites, key=lambda site: site.total_stall_time, reverse=True)
+
+    def gauges(self) -> dict[str, int | float]:
+        """the loop's lag percentiles (in seconds) and the amount of stalls, for the metrics export"""
+
+        return {
+            "lag_p50_seconds": self.lag.quantile(0.5),
+            "lag_p99_seconds": self.lag.quantile(0.99),
+            "lag_max_seconds": self.lag.max,
+            "stalls": sum(site.stalls for site in self.report()),
+        }
+
+    def log_report(self, top: int = 10):
+        sites = self.report()
+
+        if not sites:
+            return
+
+        for site in sites[:top]:
+            log.warning(
+                "event loop stalls by call site",
+                call_site=site.call_site,
+                threshold_ms=round(self.threshold * 1000),
+                stalls=site.stalls,
+                total_stall_ms=round(site.total_stall_time * 1000),
+                max_stall_ms=round(site.max_stall_time * 1000)
+            )
+
+        log.warning("longest event loop stall", call_site=sites[0].call_site, stack=sites[0].example_stack)
+
+    async def _beat(self):
+        last_report = time.monotonic()
+
+        while True:
+            sleep_started = time.monotonic()
+
+            await asyncio.sleep(self.heartbeat_interval)
+
+            beat_time = time.monotonic()
+            lag = max(0.0, beat_time - sleep_started - self.heartbeat_interval)
+
+            self.lag.record(lag)
+
+            with self._lock:
+                captured_stack = self._captured_stack
+                self._captured_stack = None
+
+                self._last_beat = beat_time
+                self._beat_number += 1
+
+            # the stall ended, it is added to the call site that the watchdog saw while it was happening (a stall that
+            # was too short for the watchdog to catch has no stack, and is only counted in the lag)
+            if lag >= self.threshold and captured_stack:
+                self._add_stall(captured_stack[1], lag)
+
+            if beat_time - last_report >= self.report_interval:
+                last_report = beat_time
+
+                try:
+                    self.log_report()
+                except Exception:
+                    log.exception("failed to log the event loop stalls report")
+
+    def _add_stall(self, stack: traceback.StackSummary, stall_time: float):
+        call_site = find_call_site(stack)
+
+        with self._lock:
+            site = self._sites.setdefault(call_site, StallSite(call_site=call_site))
+
+            site.stalls += 1
+            site.total_stall_time += stall_time
+
+            if stall_time >= site.max_stall_time:
+                site.max_stall_time = stall_time
+                site.example_stack = "".join(stack.format())
+
+    def _watch(self):
+        # checked a few times per threshold, so that a stall is caught soon after it passes the threshold
+        check_interval = self.threshold / 4
+
+        while not self._stopped.wait(check_interval):
+            with self._lock:
+                blocked_time = time.monotonic() - self._last_beat - self.heartbeat_interval
+                beat_number = self._beat_number
+
+                # one stack per stall, taken as soon as the stall passes the threshold
+                is_captured = self._captured_stack is not None and self._captured_stack[0] == beat_number
+
+            if blocked_time < self.threshold or is_captured:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+
+            if frame is None:
+                continue
+
+            stack = traceback.extract_stack(frame)
+
+            # the frame is released right away, holding it keeps every local variable of the stack alive
+            del frame
+
+            with self._lock:
+                # the loop might have beaten while the stack was extracted, then the stack belongs to the next beat
+                if self._beat_number == beat_number:
+                    self._captured_stack = (beat_number, stack)
+
+
+# the detector is only started by the server's main function when stall detection is enabled (see --stall-threshold)
+loop_stall_detector = LoopStallDetector()
@@ -0,0 +1,136 @@
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator
+
+from asqlite import ProxiedConnection, Cursor
+from sqlite3 import Row
+
+from Utils.tracing import record_span
+
+
+@dataclass
+class StatementStatistics:
+    calls: int = 0
+    total_time: float = 0.0  # in seconds
+    max_time: float = 0.0  # in seconds
+    rows: int = 0
+    """fetched rows for SELECT statements, changed rows for everything else"""
+
+
+class StatementRegistry:
+    """
+    every SQL statement is registered once under a stable name, and is then executed by its name.
+
+    since the SQL of a statement never changes (lists are passed as a single JSON parameter, see json_list), sqlite's
+    statement cache can reuse the prepared statement on every connection, instead of preparing a new statement for
+    every list length.
+
+    the registry also records how long every statement takes, and how many rows it returned (or changed), so that slow
+    statements can be found by name (and adds every execution to the request's trace, see Utils.tracing).
+    """
+
+    def __init__(self):
+        self._statements: dict[str, str] = {}
+        """
+        dict[statement name -> SQL]
+        """
+
+        self._statistics: dict[str, StatementStatistics] = {}
+
+    def register(self, name: str, sql: str) -> str:
+        """
+        :param name: the statement's stable name (e.g. "user.fetch_user")
+        :param sql: the statement's SQL. it must not change based on the parameters
+        :returns: the name, so that it can be saved and used to execute the statement
+        """
+
+        if name in self._statements:
+            raise ValueError(f"the statement {name} is already registered")
+
+        self._statements[name] = sql
+        self._statistics[name] = StatementStatistics()
+
+        return name
+
+    def sql(self, name: str) -> str:
+        return self._statements[name]
+
+    @staticmethod
+    def json_list(values: Iterable[Any]) -> str:
+        """
+        turns a list into a single parameter, which can be used as `IN (SELECT value FROM json_each(?))` instead of
+        `IN (?, ?, ...)` (which would be a different statement for every list length)
+        """
+        return json.dumps(list(values))
+
+    def _record(self, name: str, started_at: float, rows: int):
+        elapsed = time.perf_counter() - started_at
+
+        statistics = self._statistics[name]
+        statistics.calls += 1
+        statistics.total_time += elapsed
+        statistics.max_time = max(statistics.max_time, elapsed)
+        statistics.rows += max(rows, 0)
+
+        record_span("db.query", started_at, statement=name, rows=rows)
+
+    async def fetchone(self, connection: ProxiedConnection, name: str, *parameters: Any) -> Row | None:
+        started_at = time.perf_counter()
+        row = await connection.fetchone(self._statements[name], *parameters)
+        self._record(name, started_at, rows=1 if row else 0)
+
+        return row
+
+    async def fetchall(self, connection: ProxiedConnection, name: str, *parameters: Any) -> list[Row]:
+        started_at = time.perf_counter()
+        rows = await connection.fetchall(self._statements[name], *parameters)
+        self._record(name, started_at, rows=len(rows))
+
+        return rows
+
+    async def execute(self, connection: ProxiedConnection, name: str, *parameters: Any) -> Cursor:
+        started_at = time.perf_counter()
+        cursor = await connection.execute(self._statements[name], *parameters)
+        self._record(name, started_at, rows=cursor.get_cursor().rowcount)
+
+        return cursor
+
+    async def executemany(self, connection: ProxiedConnection, name: str,
+                          seq_of_parameters: Iterable[Iterable[Any]]) -> Cursor:
+        started_at = time.perf_counter()
+        cursor = await connection.executemany(self._statements[name], seq_of_parameters)
+        self._record(name, started_at, rows=cursor.get_cursor().rowcount)
+
+        return cursor
+
+    def statistics(self) -> dict[str, dict[str, int | float]]:
+        """:returns: the statistics of every statement that was executed at least once, the slowest (in total) first"""
+
+        executed = [(name, statistics) for name, statistics in self._statistics.items() if statistics.calls]
+        executed.sort(key=lambda item: item[1].total_time, reverse=True)
+
+        return {
+            name: {
+                "calls": statistics.calls,
+                "total_time": statistics.total_time,
+                "average_time": statistics.total_time / statistics.calls,
+                "max_time": statistics.max_time,
+                "rows": statistics.rows,
+            }
+            for name, statistics in executed
+        }
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        """iterates over (name, SQL) of every registered statement"""
+        return iter(self._statements.items())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._statements
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+
+# all the statements of queries.py are registered here
+statements = StatementRegistry()
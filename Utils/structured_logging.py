@@ -0,0 +1,359 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Any
+
+from Utils.tracing import current_trace_id
+
+# every category is a child of this logger, so that the server's logs can be configured without touching the logs of
+# the libraries (or of the GUI, which uses the root logger)
+ROOT_LOGGER_NAME = "server"
+
+# the attribute of the log record that the structured fields are kept under
+FIELDS_ATTRIBUTE = "fields"
+
+
+class _EventSampler:
+    """
+    a token bucket per event: lets through up to burst records at once, and then rate records per second. the records
+    that were dropped are counted, and the count is added to the next record of the event that is let through (as the
+    "suppressed" field), so that the amount of events can still be told from the logs.
+    """
+
+    __slots__ = ("rate", "burst", "_buckets", "_lock")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+        self._buckets: dict[str, list[float]] = {}
+        """
+        dict[event -> [tokens, last refill (time.monotonic), suppressed records]]
+        """
+
+        # the sampler can be used from the default executor's threads as well as the event loop
+        self._lock = threading.Lock()
+
+    def sample(self, event: str) -> int | None:
+        """:returns: None if the record should be dropped, or the amount of records that were dropped before it"""
+
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(event)
+
+            if bucket is None:
+                bucket = self._buckets[event] = [float(self.burst), now, 0]
+
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return None
+
+            bucket[0] -= 1
+
+            suppressed = bucket[2]
+            bucket[2] = 0
+
+            return suppressed
+
+
+class StructuredLogger:
+    """
+    a logger of a single category (e.g. "upload", "preview"), whose records are an event name with fields:
+
+        log = get_logger("upload")
+        log.info("created file ID", request_id=request_id, file_id=file_id)
+
+    the fields are formatted by the writer thread (see LogQueue), so a record costs the event loop a level check, and
+    putting the record in the queue. the level is checked before anything else, so disabled records are almost free.
+
+    events that happen per chunk (or per message) should be logged with sampled=True, which lets through at most
+    sample_rate of them per second (see _EventSampler).
+    """
+
+    def __init__(self, category: str, sample_rate: float = 1.0, sample_burst: int = 5):
+        """
+        :param sample_rate: how many sampled records of every event are let through per second
+        :param sample_burst: how many sampled records of every event are let through at once
+        """
+        self.category = category
+        self.logger = logging.getLogger(f"{ROOT_LOGGER_NAME}.{category}")
+
+        self._sampler = _EventSampler(rate=sample_rate, burst=sample_burst)
+
+    def is_enabled_for(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level: int, event: str, *, sampled: bool = False, exc_info: Any = None, **fields: Any):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        if sampled:
+            suppressed = self._sampler.sample(event)
+
+            if suppressed is None:
+                return
+
+            if suppressed:
+                fields["suppressed"] = suppressed
+
+        # taken here, since the writer thread doesn't have the request's context
+        trace_id = current_trace_id()
+        if trace_id:
+            fields["trace_id"] = trace_id
+
+        self.logger.log(level, event, exc_info=exc_info, extra={FIELDS_ATTRIBUTE: fields})
+
+    def debug(self, event: str, **fields: Any):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields: Any):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields: Any):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields: Any):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event: str, **fields: Any):
+        """logs an error with the traceback of the exception that is currently handled"""
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+_loggers: dict[str, StructuredLogger] = {}
+
+
+def get_logger(category: str) -> StructuredLogger:
+    """:returns: the category's logger (every category has a single logger, so that it has a single sampler)"""
+
+    structured_logger = _loggers.get(category)
+
+    if structured_logger is None:
+        structured_logger = _loggers[category] = StructuredLogger(category)
+
+    return structured_logger
+
+
+def _format_value(value: Any) -> str:
+    text = value if isinstance(value, str) else repr(value)
+
+    # values with spaces are quoted, so that every field can still be told apart
+    if not text or any(character in text for character in " \"=\n"):
+        return json.dumps(text)
+
+    return text
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    formats a record as a single line, either as text:
+
+        2026-10-19 12:00:00.123 INFO upload: created file ID request_id=... file_id=...
+
+    or as a JSON object (one per line), which is easier to search through with jq or to ship to a log collector.
+    records that don't come from a StructuredLogger (e.g. logging.error calls) are formatted the same way, without fields.
+    """
+
+    def __init__(self, as_json: bool = False):
+        super().__init__()
+
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        category = record.name.removeprefix(f"{ROOT_LOGGER_NAME}.")
+        fields: dict[str, Any] = getattr(record, FIELDS_ATTRIBUTE, {})
+
+        # queued records already have their traceback formatted (see _DroppingQueueHandler.prepare)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if self.as_json:
+            json_record = {
+                "time": record.created,
+                "level": record.levelname,
+                "category": category,
+                "event": record.getMessage(),
+                **fields,
+            }
+
+            if record.exc_text:
+                json_record["traceback"] = record.exc_text
+
+            return json.dumps(json_record, default=repr)
+
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        line = f"{timestamp}.{int(record.msecs):03d} {record.levelname} {category}: {record.getMessage()}"
+
+        if fields:
+            line += " " + " ".join(f"{name}={_format_value(value)}" for name, value in fields.items())
+
+        # the traceback goes after the fields, so that the fields stay on the event's line
+        if record.exc_text:
+            line += f"\n{record.exc_text}"
+
+        return line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """a QueueHandler that drops (and counts) records when the queue is full, instead of blocking the event loop"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        the traceback has to be formatted before the record is queued (the exception's frames can't be used from the
+        writer thread), but unlike QueueHandler.prepare it is kept apart from the message, for the formatter to place
+        """
+
+        record = copy.copy(record)
+
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogQueue:
+    """
+    moves the writing of the logs off the event loop: the records are put in a queue, and a background thread formats
+    them and writes them to stdout (or to a file). a slow terminal or pipe then slows down the writer thread, and not
+    the clients. when the writer can't keep up, records are dropped (and counted) instead of piling up in memory.
+
+    the levels are set per category, e.g. {"upload": "DEBUG"} logs the upload's per chunk events while every other
+    category stays at the default level.
+    """
+
+    def __init__(self, max_pending: int = 10000):
+        """:param max_pending: the maximum amount of records that wait to be written"""
+        self.max_pending = max_pending
+
+        self._handler: _DroppingQueueHandler | None = None
+        self._listener: logging.handlers.QueueListener | None = None
+        self._output_handler: logging.Handler | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._listener is not None
+
+    def start(self, level: str | int = "INFO", category_levels: dict[str, str | int] | None = None,
+              path: str | None = None, as_json: bool = False):
+        """
+        :param level: the level of the categories that aren't given in category_levels, and of the other loggers
+        :param category_levels: dict[category -> its level]
+        :param path: a file to append the logs to, instead of writing them to stdout
+        :param as_json: write every record as a JSON object instead of a line of text
+        """
+
+        if self.is_running:
+            return
+
+        if path:
+            self._output_handler = logging.FileHandler(path, encoding="utf-8")
+        else:
+            self._output_handler = logging.StreamHandler(sys.stdout)
+
+        self._output_handler.setFormatter(StructuredFormatter(as_json=as_json))
+
+        self._handler = _DroppingQueueHandler(queue.Queue(maxsize=self.max_pending))
+
+        self._listener = logging.handlers.QueueListener(
+            self._handler.queue,
+            self._output_handler,
+            respect_handler_level=True
+        )
+        self._listener.start()
+
+        # every logger (including the libraries' and the logging.error calls) goes through the queue
+        root_logger = logging.getLogger()
+        root_logger.addHandler(self._handler)
+        root_logger.setLevel(level)
+
+        logging.getLogger(ROOT_LOGGER_NAME).setLevel(level)
+
+        for category, category_level in (category_levels or {}).items():
+            logging.getLogger(f"{ROOT_LOGGER_NAME}.{category}").setLevel(category_level)
+
+    def stop(self):
+        """writes the records that are still queued, and stops the writer thread"""
+
+        if not self.is_running:
+            return
+
+        logging.getLogger().removeHandler(self._handler)
+
+        self._listener.stop()
+        self._output_handler.close()
+
+        if self._handler.dropped:
+            print(f"dropped {self._handler.dropped} log records, since the log writer couldn't keep up")
+
+        self._handler = None
+        self._listener = None
+        self._output_handler = None
+
+    def reset_after_fork(self):
+        """
+        a forked process inherits the parent's queue, but not the writer thread, so the records that it queues would
+        never be written. this drops them (without stopping the thread, which belongs to the parent), so that the
+        process can start its own
+        """
+
+        if not self.is_running:
+            return
+
+        logging.getLogger().removeHandler(self._handler)
+
+        self._handler = None
+        self._listener = None
+        self._output_handler = None
+
+    def gauges(self) -> dict[str, int]:
+        """the amount of queued and dropped records, for the metrics export"""
+
+        if not self._handler:
+            return {"pending": 0, "dropped": 0}
+
+        return {"pending": self._handler.queue.qsize(), "dropped": self._handler.dropped}
+
+
+def parse_category_levels(values: list[str]) -> dict[str, str]:
+    """:returns: dict[category -> level] from "category=LEVEL" values (e.g. from the command line)"""
+
+    category_levels = {}
+
+    for value in values:
+        category, separator, level = value.partition("=")
+
+        if not separator or not category or not level:
+            raise ValueError(f"invalid category level {value!r}, expected category=LEVEL")
+
+        category_levels[category] = level.upper()
+
+    return category_levels
+
+
+# the log queue is shared by the whole process, it is started (and stopped) by the server's main function (and by the
+# supervisor, see server.supervise)
+log_queue = LogQueue()
@@ -0,0 +1,352 @@
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import traceback
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class Span:
+    """
+    name - what the span measured (e.g. db.query, subprocess, transport.write)
+    span_id - the span's ID, unique inside its trace
+    parent_id - the ID of the span that was open when this span started (None for the trace's top level)
+    start - when the span started (time.perf_counter)
+    duration - how long the span took (in seconds), None while it is open
+    attributes - anything else about the span (e.g. the statement's name, the written bytes)
+    """
+
+    name: str
+    span_id: int
+    parent_id: int | None
+    start: float
+    duration: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+
+@dataclass
+class Trace:
+    """
+    everything that happened while the server handled a single request: the request's endpoint, and a span for every
+    database, disk, subprocess and socket operation that was done for it.
+
+    trace_id - the trace's ID (written to the sink, so that a slow request can be found by it)
+    is_sampled - whether the trace is written even if it isn't slow (see Tracer.sample_rate)
+    endpoint - the requested endpoint (known once the request was decrypted)
+    """
+
+    trace_id: str
+    is_sampled: bool
+    endpoint: str | None = None
+    started_at: float = field(default_factory=time.time)
+    start: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    status: str | None = None
+    spans: list[Span] = field(default_factory=list)
+    dropped_spans: int = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "endpoint": self.endpoint,
+            "started_at": self.started_at,
+            "duration_ms": _milliseconds(self.duration),
+            "status": self.status,
+            "dropped_spans": self.dropped_spans,
+            "spans": [
+                {
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "start_ms": _milliseconds(span.start - self.start),
+                    "duration_ms": _milliseconds(span.duration),
+                    **span.attributes,
+                }
+                for span in self.spans
+            ],
+        }
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+MAX_SPANS_PER_TRACE = 500
+
+# the trace of the request that the running code handles, asyncio copies the context into every task that is created,
+# so the trace follows the request's server action (and the tasks it creates) without passing it around
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class _SpanScope:
+    """opens a span when entered and closes it when exited, works with both "with" and "async with" """
+
+    __slots__ = ("_trace", "_name", "_attributes", "_span", "_token")
+
+    def __init__(self, trace: Trace, name: str, attributes: dict[str, Any]):
+        self._trace = trace
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self) -> Span:
+        parent = _current_span.get()
+
+        self._span = Span(
+            name=self._name,
+            span_id=len(self._trace.spans) + 1,
+            parent_id=parent.span_id if parent else None,
+            start=time.perf_counter(),
+            attributes=self._attributes
+        )
+        self._trace.spans.append(self._span)
+
+        self._token = _current_span.set(self._span)
+
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._span.duration = time.perf_counter() - self._span.start
+
+        if exc_type is not None:
+            self._span.attributes["error"] = exc_type.__name__
+
+        _current_span.reset(self._token)
+
+    async def __aenter__(self) -> Span:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        self.__exit__(exc_type, exc_value, exc_traceback)
+
+
+class _NoSpan:
+    """what span() returns outside of a trace, so that untraced requests (most of them) pay almost nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    async def __aenter__(self) -> None:
+        return None
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _tracing_trace() -> Trace | None:
+    """:returns: the current trace, if a new span can be added to it"""
+
+    trace = _current_trace.get()
+
+    # a span that starts after its trace finished (e.g. in a task that outlived the request) isn't recorded
+    if trace is None or trace.duration is not None:
+        return None
+
+    # long requests (e.g. an audio download writes a message per chunk) keep only their first spans
+    if len(trace.spans) >= MAX_SPANS_PER_TRACE:
+        trace.dropped_spans += 1
+        return None
+
+    return trace
+
+
+def span(name: str, **attributes: Any) -> _SpanScope | _NoSpan:
+    """
+    measures the code inside the block as a span of the current request's trace (if the request is traced):
+
+        async with span("db.acquire"):
+            ...
+
+        with span("transport.write", bytes=len(data)) as current_span:
+            ...
+
+    the block gets the Span (or None if the request isn't traced), which can be given more attributes with set()
+    """
+
+    trace = _tracing_trace()
+
+    if trace is None:
+        return _NO_SPAN
+
+    return _SpanScope(trace, name, attributes)
+
+
+def record_span(name: str, started_at: float, **attributes: Any):
+    """
+    adds a span that already ended, for code that measures its own time anyway (e.g. the statements' statistics)
+
+    :param started_at: when the span started (time.perf_counter), it ends now
+    """
+
+    trace = _tracing_trace()
+
+    if trace is None:
+        return
+
+    parent = _current_span.get()
+
+    trace.spans.append(
+        Span(
+            name=name,
+            span_id=len(trace.spans) + 1,
+            parent_id=parent.span_id if parent else None,
+            start=started_at,
+            duration=time.perf_counter() - started_at,
+            attributes=attributes
+        )
+    )
+
+
+def current_trace_id() -> str | None:
+    trace = _current_trace.get()
+
+    return trace.trace_id if trace else None
+
+
+class JsonlTraceSink:
+    """
+    writes the finished traces to a JSONL file (one trace per line) from a background thread, so that the event loop
+    never waits for the disk. if the disk can't keep up, traces are dropped (and counted) instead of piling up.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000):
+        self.path = path
+        self.dropped = 0
+
+        self._traces: queue.Queue[dict | None] = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._write_traces, name="trace-sink", daemon=True)
+        self._thread.start()
+
+    def add(self, trace: Trace):
+        try:
+            self._traces.put_nowait(trace.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """writes the traces that are still pending, and stops the writing thread"""
+
+        self._traces.put(None)
+        self._thread.join()
+
+    def _write_traces(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, "a") as trace_file:
+            while True:
+                trace = self._traces.get()
+
+                if trace is None:
+                    break
+
+                try:
+                    trace_file.write(json.dumps(trace, default=str) + "\n")
+                except Exception:
+                    traceback.print_exc()
+
+                # flushed once the queue is empty, so a burst of traces is written together
+                if self._traces.empty():
+                    trace_file.flush()
+
+
+class Tracer:
+    """
+    decides which requests are traced, and writes their traces to the sink once they finish.
+
+    sample_rate of the requests are traced and always written. if slower_than is given, every request is traced, and
+    the ones that took longer than it are written as well (so the tail latency can be looked into, even if it is rare).
+    tracing is disabled until configure() is called with a sink path.
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.slower_than: float | None = None
+
+        self._sink: JsonlTraceSink | None = None
+
+    @property
+    def is_enabled(self) -> bool:
+        return self._sink is not None
+
+    def configure(self, path: str, sample_rate: float = 0.01, slower_than: float | None = None):
+        """
+        :param path: the JSONL file that the traces are appended to
+        :param sample_rate: the fraction of the requests whose traces are always written
+        :param slower_than: the traces of requests that took longer than this (in seconds) are written as well
+        """
+
+        self.sample_rate = sample_rate
+        self.slower_than = slower_than
+
+        self._sink = JsonlTraceSink(path)
+
+    def close(self):
+        if self._sink:
+            self._sink.close()
+
+            if self._sink.dropped:
+                print(f"dropped {self._sink.dropped} traces, since the trace sink couldn't keep up")
+
+            self._sink = None
+
+    def start_trace(self) -> Trace | None:
+        """
+        starts tracing a request, if it is picked. the trace only collects spans while it is the current trace (see
+        enter_trace), and the tasks that are created while it is the current trace carry it.
+
+        :returns: the trace, or None if the request isn't traced
+        """
+
+        if not self._sink:
+            return None
+
+        is_sampled = random.random() < self.sample_rate
+
+        if not is_sampled and self.slower_than is None:
+            return None
+
+        return Trace(trace_id=secrets.token_hex(8), is_sampled=is_sampled)
+
+    @staticmethod
+    def enter_trace(trace: Trace | None) -> Token:
+        """makes the trace the current trace, :returns: a token for exit_trace"""
+        return _current_trace.set(trace)
+
+    @staticmethod
+    def exit_trace(token: Token):
+        _current_trace.reset(token)
+
+    def finish_trace(self, trace: Trace | None, status: str | int):
+        if trace is None:
+            return
+
+        trace.duration = time.perf_counter() - trace.start
+        trace.status = str(status)
+
+        is_slow = self.slower_than is not None and trace.duration >= self.slower_than
+
+        if self._sink and (trace.is_sampled or is_slow):
+            self._sink.add(trace)
+
+
+# the tracer is shared by all the clients, it is configured by the server's main function (see --trace-file)
+tracer = Tracer()
@@ -0,0 +1,64 @@
+import asyncio
+import argparse
+import sys
+
+from Utils.sqlite3_ext import create_connection_pool
+from queries import UserStats
+
+
+async def check_user_stats(database: str, backfill: bool) -> int:
+    """
+    compares every user's counters (see queries.UserStats) with the real amount of songs and comments they uploaded.
+
+    :param database: the path of the server's database
+    :param backfill: whether to recount the counters of every user (after checking them)
+    :returns: the amount of users whose counters were wrong
+    """
+
+    db_pool = await create_connection_pool(database, readers=1)
+
+    try:
+        async with db_pool.acquire() as connection:
+            inconsistencies = await UserStats.find_inconsistencies(connection=connection)
+
+        for inconsistency in inconsistencies:
+            print(
+                f"{inconsistency['user_id']}: "
+                f"song uploads {inconsistency['song_uploads']} (actually {inconsistency['actual_song_uploads']}), "
+                f"comments {inconsistency['comments']} (actually {inconsistency['actual_comments']})"
+            )
+
+        print(f"{len(inconsistencies)} users have wrong counters")
+
+        if backfill:
+            async with db_pool.acquire_writer() as connection:
+                async with connection.transaction():
+                    recounted = await UserStats.backfill(connection=connection)
+
+            print(f"recounted the counters of {recounted} users")
+    finally:
+        await db_pool.close()
+
+    return len(inconsistencies)
+
+
+def main() -> int:
+    """
+    python -m Utils.user_stats_check [--backfill] [--database database.db]
+
+    exits with 1 if any counter was wrong (even if it was backfilled), so that it can be used as a check
+    """
+
+    parser = argparse.ArgumentParser(description="checks (and optionally backfills) the users' upload counters")
+    parser.add_argument("--database", default="database.db")
+    parser.add_argument("--backfill", action="store_true", help="recount the counters of every user")
+
+    arguments = parser.parse_args()
+
+    inconsistencies_amount = asyncio.run(check_user_stats(arguments.database, arguments.backfill))
+
+    return 1 if inconsistencies_amount else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
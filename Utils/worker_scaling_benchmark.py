@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+from LoadTest.headless_client import IP, HeadlessClient, ServerError
+from LoadTest.local_server import LocalServer
+
+
+async def run_session(port: int):
+    """
+    a full session of a client that isn't logged in: the key exchange (which is where most of the server's CPU time per
+    client goes), and then a login attempt of a user that doesn't exist (a request that is answered without writing to
+    the database)
+    """
+
+    client = HeadlessClient(host=IP, port=port)
+
+    try:
+        await client.connect()
+
+        try:
+            await client.login("benchmark", "benchmark")
+        except ServerError:
+            # the user doesn't exist, the error is the expected answer
+            pass
+    finally:
+        await client.close()
+
+
+async def _generate_load(port: int, connections: int, duration: float) -> tuple[int, int]:
+    deadline = time.monotonic() + duration
+
+    completed_sessions = 0
+    failed_sessions = 0
+
+    async def virtual_client():
+        nonlocal completed_sessions, failed_sessions
+
+        while time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(run_session(port), timeout=30)
+                completed_sessions += 1
+            except Exception:
+                # refused connections, timeouts and error responses all count as failed sessions
+                failed_sessions += 1
+
+    await asyncio.gather(*(virtual_client() for _ in range(connections)))
+
+    return completed_sessions, failed_sessions
+
+
+def _run_client_process(port: int, connections: int, duration: float) -> tuple[int, int]:
+    return asyncio.run(_generate_load(port, connections, duration))
+
+
+def measure_throughput(workers: int, port: int, connections: int, client_processes: int,
+                       duration: float) -> tuple[float, int]:
+    """
+    starts the server with the amount of workers (on an empty temporary database, see LoadTest.local_server), and runs
+    sessions against it from multiple client processes (the client's side of the key exchange is CPU heavy as well, one
+    client process can't load more than one worker).
+
+    :returns: tuple[completed sessions per second, failed sessions]
+    """
+
+    with LocalServer(port=port, workers=workers):
+        connections_per_process = max(1, connections // client_processes)
+
+        with multiprocessing.Pool(client_processes) as pool:
+            results = pool.starmap(
+                _run_client_process,
+                [(port, connections_per_process, duration)] * client_processes
+            )
+
+    completed_sessions = sum(completed for completed, _ in results)
+    failed_sessions = sum(failed for _, failed in results)
+
+    return completed_sessions / duration, failed_sessions
+
+
+def main() -> int:
+    """
+    python -m Utils.worker_scaling_benchmark [--workers 1 2 4] [--duration 10] [--connections 200]
+
+    measures how many client sessions per second the server handles with every amount of workers (see
+    server.supervise), to show how the throughput scales with the amount of cores that are used.
+    run it from the project's root directory on linux or macOS (the workers require SO_REUSEPORT and fork, see
+    server.supervise for the platforms that are supported).
+    """
+
+    parser = argparse.ArgumentParser(description="measures the server's throughput with different amounts of workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--connections", type=int, default=200, help="concurrent client connections")
+    parser.add_argument("--client-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--duration", type=float, default=10, help="seconds per measurement")
+    parser.add_argument("--port", type=int, default=5600)
+
+    arguments = parser.parse_args()
+
+    print(f"{'workers':>8} {'sessions/s':>12} {'speedup':>8} {'failed':>8}")
+
+    baseline_throughput = None
+
+    for workers in arguments.workers:
+        throughput, failed_sessions = measure_throughput(
+            workers=workers,
+            port=arguments.port,
+            connections=arguments.connections,
+            client_processes=arguments.client_processes,
+            duration=arguments.duration
+        )
+
+        if baseline_throughput is None:
+            baseline_throughput = throughput
+
+        speedup = throughput / baseline_throughput if baseline_throughput else 0
+
+        print(f"{workers:>8} {throughput:>12.1f} {speedup:>7.2f}x {failed_sessions:>8}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ import asyncio
 from asyncio import transports, Task
 
 from Caches.user_cache import ClientSideUserCache
+from Caches.media_cache import MediaCache
 from pseudo_http_protocol import ClientMessage, ServerMessage, MalformedMessage
 
 from Endpoints.client_endpoints import EndPoints
@@ -23,6 +24,9 @@ PORT = 5555
 
 # this is a cache that the client keeps in order to track their own keys and session tokens
 client_user_cache = ClientSideUserCache()
+
+# a local on-disk cache of downloaded media (audio, sheets), so that re-opening a song does not re-download it
+client_media_cache = MediaCache()
 client_endpoints = EndPoints()
 client_error_endpoints = ErrorEndPoints()
 
@@ -127,6 +131,7 @@ class ClientProtocol(asyncio.Protocol):
 
 async def main(page: ft.Page):
     page.server_error = PageError(page).error
+    page.media_cache = client_media_cache
 
     page.window.min_width = 1000
     page.window.min_height = 600
@@ -148,6 +153,9 @@ async def main(page: ft.Page):
     finally:
         transport.close()
 
+        # writes the last cache hits, which are only written every few seconds (see MediaCache)
+        await client_media_cache.flush()
+
 if __name__ == "__main__":
     # flet natively supports async environment, for this reason we do not need to use asyncio.run() and only use flet.app().
     ft.app(main, assets_dir="GUI/Assets")
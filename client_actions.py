@@ -1,12 +1,11 @@
 import asyncio
-import os
 
 import GUI.upload_song
 from pseudo_http_protocol import ServerMessage, ClientMessage
 from Caches.user_cache import ClientSideUserCache
 
 from encryptions import EncryptedTransport
-from DHE.dhe import DHE, generate_dhe_response
+from Utils.key_exchange import complete_key_exchange
 
 import flet as ft
 from flet import Page
@@ -15,8 +14,6 @@ from GUI.home_page import HomePage
 from GUI.tempo_finder import AudioInformation
 from GUI.settings import Settings
 
-from RSASigning.public import verify_async, async_rsa_encrypt
-
 
 async def complete_authentication(
         _: Page,
@@ -47,59 +44,45 @@ async def complete_authentication(
     }
     """
 
-    payload = server_message.payload
-
-    try:
-        dhe_base = payload["base"]
-        dhe_mod = payload["mod"]
-        server_public_value = payload["public"]
-
-        aes_iv = payload["iv"]
+    # the key exchange itself doesn't need the GUI, so it is shared with the headless client (see LoadTest)
+    await complete_key_exchange(transport, server_message)
 
-        signature = payload["signature"]
-    except KeyError:
-        raise Exception("invalid message sent from server. this is likely a hacking attempt")
-
-    server_ip, server_port = transport.get_extra_info('peername')
-
-    is_message_from_server = await verify_async(server_ip.encode(), signature)
-
-    if not is_message_from_server:
-        raise Exception("invalid message sent from server. this is likely a hacking attempt")
 
-    client_dhe: DHE = generate_dhe_response(mod=dhe_mod, base=dhe_base)
-
-    client_public_value = client_dhe.calculate_public()
+async def answer_heartbeat(
+        _: Page,
+        transport: EncryptedTransport,
+        __: ServerMessage,
+        ___: ClientSideUserCache
+):
+    """
+    this function is used to let the server know that the client is still connected (the server disconnects clients
+    that stay idle for too long)
 
-    # this is used for anti-bit flipping. the key is encrypted with the hard-coded RSA public key, and decrypted server
-    # side using the hard-coded private key.
-    hmac_key = os.urandom(32)
+    tied to connection/heartbeat
 
-    # we use this to fully stop MITM during DHE, because IPs can be faked.
-    rsa_encrypted_public_value = await async_rsa_encrypt(str(client_public_value).encode())
+    expected payload:
+    {
+        "idle_timeout": float
+    }
 
-    rsa_encrypted_hmac_key = await async_rsa_encrypt(hmac_key)
+    expected output:
+    {
+        "alive": bool
+    }
+    """
 
+    # the heartbeat is answered without a session token, so that it is accepted whether the user is logged in or not
     transport.write(
         ClientMessage(
             authentication=None,
             method="respond",
-            endpoint="authentication/key_exchange",
+            endpoint="connection/heartbeat",
             payload={
-                "public": rsa_encrypted_public_value,
-                "HMAC_key": rsa_encrypted_hmac_key
+                "alive": True
             }
         ).encode()
     )
 
-    mutual_key_value = client_dhe.calculate_mutual(peer_public_value=server_public_value)
-
-    aes_key = client_dhe.kdf_derive(mutual_key=mutual_key_value, iterations=10000, size=16)
-
-    transport.iv = aes_iv
-    transport.key = aes_key
-    transport.hmac_key = hmac_key
-
 
 async def user_login(
         page: Page,
@@ -207,7 +190,9 @@ class DownloadSong:
                 "artist_name": str,
                 "album_name": str,
                 "song_name":  str,
-                "genres": list[str]
+                "genres": list[str],
+                "media_version": str,
+                "sheet_count": int
         }
 
         expected output:
@@ -231,6 +216,10 @@ class DownloadSong:
             song_length: int = payload["song_length"]  # in milliseconds
             genres: list[str] = payload["genres"]
             is_favorite_song: bool = payload["is_favorite_song"]
+
+            # used in order to validate the locally cached media of the song
+            media_version: str = payload.get("media_version", "")
+            sheet_count: int = payload.get("sheet_count", 0)
         except KeyError:
             raise Exception("invalid message sent from server. this is likely a hacking attempt")
 
@@ -245,7 +234,9 @@ class DownloadSong:
                 song_name=song_name,
                 genres=genres,
                 song_length=song_length,
-                is_favorite_song=is_favorite_song
+                is_favorite_song=is_favorite_song,
+                media_version=media_version,
+                sheet_count=sheet_count
             )
 
         async with self._lock:
@@ -435,6 +426,45 @@ async def load_sheet_images(
         )
 
 
+async def load_song_preview_cursor(
+        page: Page,
+        transport: EncryptedTransport,
+        server_message: ServerMessage,
+        user_cache: ClientSideUserCache
+):
+    """
+    this function is used in order to save the cursor of the next page of song previews
+
+    tied to song/download/preview/cursor
+
+    expected payload:
+    {
+        "cursor": str | None,
+        "endpoint": str,
+        "query": str | None,
+        "count": int
+    }
+
+    expected output:
+    None
+    """
+
+    payload = server_message.payload
+
+    try:
+        cursor: str | None = payload["cursor"]
+        endpoint: str = payload["endpoint"]
+    except KeyError:
+        raise Exception("invalid message sent from server. this is likely a hacking attempt")
+
+    if hasattr(page, "view") and isinstance(page.view, HomePage):
+        page.view.set_page_cursor(
+            endpoint=endpoint,
+            query=payload.get("query"),
+            cursor=cursor
+        )
+
+
 async def load_genre_browser(
         page: Page,
         transport: EncryptedTransport,
@@ -490,7 +520,8 @@ async def load_song_comments(
                 "uploaded_by_display": str
             }
         ],
-        "ai_summary": str
+        "ai_summary": str,
+        "cursor": str | None
     }
 
     expected output:
@@ -502,13 +533,57 @@ async def load_song_comments(
     try:
         comments: list[dict] = payload["comments"]
         ai_summary: str = payload["ai_summary"]
+        cursor: str | None = payload.get("cursor")
     except KeyError:
         raise Exception("invalid message sent from server. this is likely a hacking attempt")
 
     if hasattr(page, "view") and isinstance(page.view, HomePage):
         await page.view.add_song_comments(
             comments=comments,
-            ai_summary=ai_summary
+            ai_summary=ai_summary,
+            cursor=cursor
+        )
+
+
+async def load_new_song_comment(
+        page: Page,
+        transport: EncryptedTransport,
+        server_message: ServerMessage,
+        user_cache: ClientSideUserCache
+):
+    """
+    this function is used in order to show a comment that another user just uploaded, to a song whose comments are open
+
+    tied to song/comments/new
+
+    expected payload:
+    {
+        "song_id": int,
+        "comment": {
+            "comment_id": int,
+            "text": str,
+            "uploaded_at": int,
+            "uploaded_by": str,
+            "uploaded_by_display": str
+        }
+    }
+
+    expected output:
+    None
+    """
+
+    payload = server_message.payload
+
+    try:
+        song_id: int = payload["song_id"]
+        comment: dict = payload["comment"]
+    except KeyError:
+        raise Exception("invalid message sent from server. this is likely a hacking attempt")
+
+    if hasattr(page, "view") and isinstance(page.view, HomePage):
+        await page.view.add_new_song_comment(
+            song_id=song_id,
+            comment=comment
         )
 
 
@@ -2,6 +2,7 @@
 import asyncio
 
 import GUI.upload_song
+import GUI.home_page
 from pseudo_http_protocol import ServerMessage
 from Caches.user_cache import ClientSideUserCache
 
@@ -166,3 +167,34 @@ async def song_upload_error(page: Page, _: EncryptedTransport, server_message: S
         )
     )
 
+
+async def song_preview_error(page: Page, _: EncryptedTransport, server_message: ServerMessage, __: ClientSideUserCache):
+    """
+    this function is used to display an error that occurred when requesting a page of song previews (including the
+    rate limit error), and to allow the home page to request the page again
+
+    tied to song/download/preview/error, song/recommended/download/preview/error, song/genres/download/preview/error and
+    song/favorite/download/preview/error
+
+    expected output:
+    None
+
+    expected page location:
+    HomePage
+    """
+
+    status_code = server_message.status.get("code")
+    status_message = server_message.status.get("message")
+
+    # the endpoint of the request is the error's endpoint without the "/error" suffix
+    requested_endpoint = server_message.endpoint.removesuffix("/error")
+
+    if hasattr(page, "view") and isinstance(page.view, GUI.home_page.HomePage):
+        page.view.page_request_failed(endpoint=requested_endpoint)
+
+    page.server_error(
+        ft.Text(
+            f"{status_message}\n\nstatus: {status_code}"
+        )
+    )
+
@@ -1,8 +1,9 @@
 import base64
+import binascii
 import secrets
 
 import asyncio
-from typing import Optional
+from typing import Callable, Optional
 
 from AES_128 import cbc
 
@@ -13,6 +14,11 @@ from hmac import compare_digest
 
 from dataclasses import dataclass
 
+from Utils.tracing import span
+from Utils.structured_logging import get_logger
+
+log = get_logger("transport")
+
 
 def pad(plaintext):
     """Pads the plaintext to make its length a multiple of 16 bytes (block size)."""
@@ -39,8 +45,9 @@ def aes_cbc_encrypt(plaintext, key, iv):
 
 def aes_cbc_decrypt(ciphertext, key):
     """Decrypts ciphertext using AES CBC mode."""
-    # Decode the Base64 encoded ciphertext
-    ciphertext = base64.b64decode(ciphertext)
+    # Decode the Base64 encoded ciphertext. a2b_base64 is what b64decode calls, but b64decode first copies anything that
+    # isn't bytes (e.g. the memoryview that EncryptedTransport.read passes) into bytes
+    ciphertext = binascii.a2b_base64(ciphertext)
 
     # Extract the IV (first 16 bytes) and the encrypted message
     iv = ciphertext[:16]
@@ -53,12 +60,44 @@ def aes_cbc_decrypt(ciphertext, key):
     return unpad(plaintext)
 
 
+class HMACContext:
+    """
+    an HMAC of a message that is hashed in parts: update() can be called with every part (bytes or memoryview slices,
+    so a big message never has to be copied into one bytes object), and digest() returns the same tag that
+    HMAC.derive would for the concatenated parts.
+    """
+
+    __slots__ = ("_inner", "_outer")
+
+    def __init__(self, inner, outer):
+        self._inner = inner
+        self._outer = outer
+
+    def update(self, data: bytes | memoryview):
+        self._inner.update(data)
+
+    def digest(self) -> bytes:
+        outer = self._outer.copy()
+        outer.update(self._inner.digest())
+
+        return outer.digest()
+
+
 @dataclass(frozen=True)
 class HMAC:
     key: bytes
     size: int = 32
     _algorithm = sha256
 
+    def __post_init__(self):
+        key_1, key_2 = self.create_expanded_keys()
+
+        # the expanded keys are hashed once per key, and every message continues from a copy of these states. hashing
+        # key + data instead would copy the whole message (twice per message, once when writing and once when reading)
+        # just to put the key in front of it
+        object.__setattr__(self, "_inner_state", self._algorithm(key_1))
+        object.__setattr__(self, "_outer_state", self._algorithm(key_2))
+
     def hash(self, data: bytes) -> bytes:
         return self._algorithm(data).digest()
 
@@ -80,16 +119,22 @@ class HMAC:
 
         return key_1, key_2
 
-    def derive(self, data: bytes) -> bytes:
-        key_1: bytes = getattr(self, "_key_1", None)
-        key_2: bytes = getattr(self, "_key_2", None)
+    def new(self) -> HMACContext:
+        """:returns: a context to hash a message in parts with"""
+        return HMACContext(self._inner_state.copy(), self._outer_state)
+
+    def derive(self, data: bytes | memoryview) -> bytes:
+        """:returns: hash(key_2 + hash(key_1 + data))"""
+
+        context = self.new()
+        context.update(data)
 
-        if key_1 is None or key_2 is None:
-            key_1, key_2 = self.create_expanded_keys()
-            object.__setattr__(self, "_key_1", key_1)
-            object.__setattr__(self, "_key_2", key_2)
+        return context.digest()
 
-        return self.hash(key_2 + self.hash(key_1 + data))
+    def verify(self, data: bytes | memoryview, tag: bytes | memoryview) -> bool:
+        # i use compare_digest instead of == to prevent timing attacks. Unlike ==, compare_digest performs a constant-time
+        # comparison, preventing attackers from inferring information based on comparison timing.
+        return compare_digest(self.derive(data), tag)
 
 
 class EncryptedTransport(asyncio.Transport):
@@ -99,7 +144,10 @@ class EncryptedTransport(asyncio.Transport):
             key: Optional[bytes] = None,
             iv: Optional[bytes] = None,
             hmac_key: Optional[bytes] = None,
+            on_write: Optional[Callable[[int], None]] = None,
     ):
+        """:param on_write: called with the size of every write (after encryption), e.g. to count the bytes sent"""
+
         super().__init__()
         self._transport = transport
         self.key = key
@@ -112,6 +160,8 @@ class EncryptedTransport(asyncio.Transport):
         if self.hmac_key:
             self.hmac = HMAC(self.hmac_key)
 
+        self.on_write = on_write
+
         self._buffer = b""  # Buffer for incoming fragmented data
         self._expected_data_length = None
 
@@ -132,27 +182,24 @@ class EncryptedTransport(asyncio.Transport):
 
         return True
 
-    def _implement_hmac(self, data: bytes) -> bytes:
-        """adds a 32 byte HMAC using a given key and sha256"""
+    def _create_hmac(self, data: bytes) -> bytes:
+        """:returns: the 32 byte HMAC of the data (using the HMAC key and sha256), or nothing if there is no HMAC key"""
 
         if not self._does_hmac_exist():
-            return data
+            return b""
 
-        added_hmac = self.hmac.derive(data)
+        return self.hmac.derive(data)
 
-        return data + added_hmac
+    def _verify_hmac(self, data: bytes | memoryview) -> bytes | memoryview:
+        """:returns: the data without its HMAC (a slice of the same memory, the data isn't copied)"""
 
-    def _verify_hmac(self, data: bytes) -> bytes:
         if not self._does_hmac_exist():
             return data
 
+        data = memoryview(data)
         added_hmac, original_data = data[-32:], data[:-32]
 
-        expected_hmac = self.hmac.derive(original_data)
-
-        # i use compare_digest instead of == to prevent timing attacks. Unlike ==, compare_digest performs a constant-time comparison,
-        # preventing attackers from inferring information based on comparison timing.
-        if not compare_digest(expected_hmac, added_hmac):
+        if not self.hmac.verify(original_data, added_hmac):
             raise ValueError("HMAC verification failed")
 
         return original_data
@@ -163,6 +210,11 @@ class EncryptedTransport(asyncio.Transport):
         Data is only encrypted if a key and IV are passed.
         """
 
+        # the encryption is part of the span, since it's most of the write's cost
+        with span("transport.write", bytes=len(data)):
+            self._write(data)
+
+    def _write(self, data: bytes) -> None:
         if self.key and self.iv:
             encrypted_data = aes_cbc_encrypt(data, key=self.key, iv=self.iv)
 
@@ -171,12 +223,16 @@ class EncryptedTransport(asyncio.Transport):
             # this is why i now generate new IVs after every message.
             self._generate_new_iv()
 
-            encrypted_data = self._implement_hmac(encrypted_data)
+            added_hmac = self._create_hmac(encrypted_data)
 
             # Calculate and include the length prefix (16 bytes), this is practically a buffer protocol
-            data_length_block = str(len(encrypted_data)).rjust(16, "0").encode()
+            data_length_block = str(len(encrypted_data) + len(added_hmac)).rjust(16, "0").encode()
+
+            # joined once, instead of copying the encrypted data for the HMAC and then again for the length prefix
+            data = b"".join((data_length_block, encrypted_data, added_hmac))
 
-            data = data_length_block + encrypted_data
+        if self.on_write:
+            self.on_write(len(data))
 
         # Write the data to the transport
         self._transport.write(data)
@@ -209,7 +265,7 @@ class EncryptedTransport(asyncio.Transport):
                     self._expected_data_length = int(self._buffer[:16].decode())
                     self._buffer = self._buffer[16:]  # Remove the length prefix
                 else:
-                    print("Invalid length prefix, clearing buffer.")
+                    log.warning("invalid length prefix, clearing the buffer", buffered=len(self._buffer))
                     self._buffer = b""  # Clear invalid data
                     return b""
 
@@ -217,8 +273,8 @@ class EncryptedTransport(asyncio.Transport):
             if len(self._buffer) < self._expected_data_length:
                 return b""  # Wait for more data
 
-            # Extract the full payload
-            cipher = self._buffer[:self._expected_data_length]
+            # Extract the full payload (as a view of the buffer, so that the cipher isn't copied before it is decoded)
+            cipher = memoryview(self._buffer)[:self._expected_data_length]
             self._buffer = self._buffer[self._expected_data_length:]  # Remove processed data
 
             # now that we have the whole cipher, we can finally check that the HMAC matches before decrypting
@@ -1,17 +1,57 @@
 import sqlite3
 import os
+from typing import Callable
 
-spell_fix_extension = os.path.abspath("./Sqlite3Extensions/spellfix.dll")
+from Utils.structured_logging import get_logger, log_queue
 
+log = get_logger("database")
+
+# no file suffix, sqlite adds the platform's own (spellfix.dll on windows, spellfix.so on linux, see
+# Sqlite3Extensions/README.md)
+spell_fix_extension = os.path.abspath("./Sqlite3Extensions/spellfix")
+
+
+class DatabaseMigrations:
+    """
+    brings the database's schema up to date.
+
+    the schema version is saved in the database itself (PRAGMA user_version), and every migration that the database
+    did not run yet is ran in order, each inside of its own transaction (so a failed migration leaves the database at
+    the previous version instead of half migrated). a migration that writes a lot of rows may commit in between (see
+    version 6), as long as running it again starts over.
+
+    to change the schema, add a new migration to the end of self.migrations. never edit a migration that was already
+    released, since databases that already ran it will not run it again.
+    """
+
+    BACKFILL_USERS_PER_BATCH = 100
+    """the amount of users whose recommendation candidates are inserted per transaction (see version 6)"""
 
-class CreateTables:
     def __init__(self, database: str):
         self.database = database
 
-    def init(self):
+        self.migrations: list[Callable[[sqlite3.Cursor], None]] = [
+            self._create_tables,  # version 1
+            self._create_lookup_indexes,  # version 2
+            self._create_user_stats_table,  # version 3
+            self._create_comment_summary_window,  # version 4
+            self._create_comment_cursor_index,  # version 5
+            self._backfill_recommendation_candidates,  # version 6
+        ]
+
+    @property
+    def latest_version(self) -> int:
+        return len(self.migrations)
+
+    def migrate(self) -> int:
+        """
+        :returns: the amount of migrations that were ran
+        """
+
         connection = None
         try:
-            connection = sqlite3.connect(self.database)
+            # autocommit mode, so that the transactions are controlled explicitly (sqlite's DDL is transactional)
+            connection = sqlite3.connect(self.database, isolation_level=None)
             connection.enable_load_extension(True)
 
             cursor = connection.cursor()
@@ -19,32 +59,213 @@ class CreateTables:
             # Load extensions
             self._load_extensions(cursor)
 
-            # Create tables
-            self._create_users(cursor)
-            self._create_file_cluster_table(cursor)
-            self._create_file_table(cursor)
-            self._create_song_info_table(cursor)
-            self._create_media_files_table(cursor)
-            self._create_genres_table(cursor)
-            self._create_favorite_genres_tale(cursor)
-            self._create_comments_table(cursor)
-            self._create_ai_summarization_comments_table(cursor)
-            self._create_favorite_songs_table(cursor)
-
-            # Commit changes
-            connection.commit()
-        except Exception as e:
-            raise e
+            current_version = cursor.execute("PRAGMA user_version;").fetchone()[0]
+
+            if current_version > self.latest_version:
+                raise RuntimeError(
+                    f"the database is at schema version {current_version}, "
+                    f"but the latest known version is {self.latest_version}"
+                )
+
+            for version in range(current_version + 1, self.latest_version + 1):
+                cursor.execute("BEGIN;")
+
+                try:
+                    self.migrations[version - 1](cursor)
+
+                    # pragmas can't take parameters, the version is always an int
+                    cursor.execute(f"PRAGMA user_version = {version};")
+                    cursor.execute("COMMIT;")
+                except Exception:
+                    cursor.execute("ROLLBACK;")
+                    raise
+
+                log.info("migrated the database", database=self.database, version=version)
+
+            return self.latest_version - current_version
         finally:
             if connection:
                 connection.close()
 
+    def _create_tables(self, cursor):
+        """
+        version 1, the original schema. it uses IF NOT EXISTS, so that databases that were created before the
+        migrations existed (at version 0) can run it too
+        """
+
+        self._create_users(cursor)
+        self._create_file_cluster_table(cursor)
+        self._create_file_table(cursor)
+        self._create_song_info_table(cursor)
+        self._create_media_files_table(cursor)
+        self._create_genres_table(cursor)
+        self._create_favorite_genres_tale(cursor)
+        self._create_recommendation_candidates_table(cursor)
+        self._create_comments_table(cursor)
+        self._create_ai_summarization_comments_table(cursor)
+        self._create_favorite_songs_table(cursor)
+
+    @staticmethod
+    def _create_lookup_indexes(cursor):
+        """
+        version 2, indexes for the lookups that used to scan the whole table (see Utils.query_plan_check)
+        """
+
+        indexes = (
+            # User.fetch_user, on every login
+            "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);",
+            # the user's uploaded songs (statistics and search)
+            "CREATE INDEX IF NOT EXISTS idx_song_info_user_id ON song_info(user_id);",
+            # searching songs by artist
+            "CREATE INDEX IF NOT EXISTS idx_song_info_artist_name ON song_info(artist_name);",
+            # a song's audio / sheet / cover file
+            "CREATE INDEX IF NOT EXISTS idx_media_files_song_type ON media_files(song_id, file_type);",
+            # the primary key starts with song_id, so searching by genre needs its own index
+            "CREATE INDEX IF NOT EXISTS idx_genres_genre_name ON genres(genre_name, song_id);",
+            # the primary key starts with user_id, but a new song is added to the candidates of every user with its genres
+            "CREATE INDEX IF NOT EXISTS idx_favorite_genres_genre ON favorite_genres(genre, user_id, score);",
+            # the primary key starts with song_id, and the user's favorites are paged by song_id
+            "CREATE INDEX IF NOT EXISTS idx_favorite_songs_user_id ON favorite_songs(user_id, song_id);",
+            # the user's comments (statistics and deleting a user)
+            "CREATE INDEX IF NOT EXISTS idx_song_comments_uploaded_by ON song_comments(uploaded_by);",
+            # finding a cluster that is not full yet
+            "CREATE INDEX IF NOT EXISTS idx_clusters_current_size ON clusters(current_size);",
+        )
+
+        for index in indexes:
+            cursor.execute(index)
+
+    @staticmethod
+    def _create_user_stats_table(cursor):
+        """
+        version 3, the user's upload counters (see queries.UserStats). the counters of existing users are filled from
+        their existing songs and comments
+        """
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id TEXT PRIMARY KEY,
+                song_uploads INTEGER NOT NULL DEFAULT 0,
+                comments INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            );
+            """
+        )
+
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO user_stats (user_id, song_uploads, comments)
+            SELECT
+                users.user_id,
+                (SELECT COUNT(*) FROM song_info WHERE song_info.user_id = users.user_id),
+                (SELECT COUNT(*) FROM song_comments WHERE song_comments.uploaded_by = users.user_id)
+            FROM users;
+            """
+        )
+
+    @staticmethod
+    def _create_comment_summary_window(cursor):
+        """
+        version 4, the values that the AI comment summary needs are saved with every comment (instead of being
+        calculated from every comment on every summary), and the summary knows if it's missing newer comments
+        (see queries.Comments.fetch_comments_for_summary)
+        """
+
+        from GroqAI.api import hybrid_token_estimate, is_spam_comment
+
+        cursor.execute("ALTER TABLE song_comments ADD COLUMN token_estimate INTEGER NOT NULL DEFAULT 0;")
+        cursor.execute("ALTER TABLE song_comments ADD COLUMN is_spam INTEGER NOT NULL DEFAULT 0;")
+
+        comments = cursor.execute("SELECT comment_id, comment_text FROM song_comments;").fetchall()
+
+        cursor.executemany(
+            "UPDATE song_comments SET token_estimate = ?, is_spam = ? WHERE comment_id = ?;",
+            [
+                (hybrid_token_estimate(comment_text), is_spam_comment(comment_text), comment_id)
+                for comment_id, comment_text in comments
+            ]
+        )
+
+        # the newest comments of a song that aren't spam (the comments that are summarized)
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_song_comments_summary_window 
+            ON song_comments(song_id, is_spam, uploaded_at, comment_id);
+            """
+        )
+
+        # the newest comment that the summary includes, and whether the song got comments since then
+        cursor.execute("ALTER TABLE ai_comment_summary ADD COLUMN last_comment_id INTEGER NOT NULL DEFAULT 0;")
+        cursor.execute("ALTER TABLE ai_comment_summary ADD COLUMN is_dirty INTEGER NOT NULL DEFAULT 0;")
+
+        # the existing summaries were made from the oldest comments, so they are regenerated from the newest ones
+        cursor.execute("UPDATE ai_comment_summary SET is_dirty = 1;")
+
+    @staticmethod
+    def _create_comment_cursor_index(cursor):
+        """
+        version 5, the song's comments are paged by (uploaded_at, comment_id) (see queries.Comments.fetch_song_comments).
+        the older idx_song_comments_song_id is kept, since it's (song_id, comment_id) for fetching the comments since a
+        comment ID
+        """
+
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_song_comments_song_cursor 
+            ON song_comments(song_id, uploaded_at, comment_id);
+            """
+        )
+
+    @staticmethod
+    def _backfill_recommendation_candidates(cursor):
+        """
+        version 6, the recommendation candidates of every user are recalculated from favorite_genres. users who had
+        genre scores before the candidates table existed only got the rows of the songs that were uploaded (or the
+        genres that were listened to) since, so their candidates are replaced instead of added to.
+
+        every user gets a row per song in their genres, so the rows are inserted a batch of users at a time, and
+        committed after every batch, so that the transaction (and the WAL) doesn't grow with the whole table. the
+        version is only changed after the last batch, so if the migration fails in between, it starts over on the next
+        run
+        """
+
+        cursor.execute("DELETE FROM recommendation_candidates;")
+
+        last_user_id = ""
+        while True:
+            rows = cursor.execute(
+                "SELECT DISTINCT user_id FROM favorite_genres WHERE user_id > ? ORDER BY user_id LIMIT ?;",
+                (last_user_id, DatabaseMigrations.BACKFILL_USERS_PER_BATCH)
+            ).fetchall()
+
+            if not rows:
+                break
+
+            cursor.execute(
+                """
+                INSERT INTO recommendation_candidates (user_id, song_id, score)
+                SELECT favorite_genres.user_id, genres.song_id, SUM(favorite_genres.score)
+                FROM favorite_genres
+                JOIN genres ON genres.genre_name = favorite_genres.genre
+                WHERE favorite_genres.user_id > ? AND favorite_genres.user_id <= ?
+                GROUP BY favorite_genres.user_id, genres.song_id;
+                """,
+                (last_user_id, rows[-1][0])
+            )
+
+            cursor.execute("COMMIT;")
+            cursor.execute("BEGIN;")
+
+            last_user_id = rows[-1][0]
+
     def _load_extensions(self, cursor):
         try:
             cursor.execute(f"SELECT load_extension('{spell_fix_extension}');")
-            print("Extension loaded successfully!")
-        except sqlite3.OperationalError as e:
-            print(f"Error loading extension: {e}")
+            log.info("loaded the sqlite extension", path=spell_fix_extension)
+        except sqlite3.OperationalError as error:
+            # the caller gets the traceback, this only says which file it was
+            log.error("failed to load the sqlite extension", path=spell_fix_extension, error=str(error))
             raise
 
     @staticmethod
@@ -162,6 +383,31 @@ class CreateTables:
             """
         )
 
+    @staticmethod
+    def _create_recommendation_candidates_table(cursor):
+        """
+        the precomputed recommended songs of every user. a song's score is the sum of the user's favorite_genres scores
+        of the song's genres (see queries.RecommendationAlgorithm)
+        """
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS recommendation_candidates (
+                user_id TEXT NOT NULL,
+                song_id INTEGER NOT NULL,
+                score INTEGER NOT NULL,
+                PRIMARY KEY (user_id, song_id),
+                FOREIGN KEY (song_id) REFERENCES song_info (song_id) ON DELETE CASCADE
+            );
+            """
+        )
+
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_recommendation_candidates_user_score 
+            ON recommendation_candidates(user_id, score DESC, song_id);
+            """
+        )
+
     @staticmethod
     def _create_comments_table(cursor):
         cursor.execute(
@@ -216,9 +462,12 @@ if __name__ == "__main__":
     # Define the database path
     database_name = "database.db"
 
-    # Initialize the database and create tables
+    log_queue.start()
+
+    # Initialize the database and bring its schema up to date
     try:
-        tables = CreateTables(database_name)
-        tables.init()
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        DatabaseMigrations(database_name).migrate()
+    except Exception:
+        log.exception("failed to migrate the database", database=database_name)
+    finally:
+        log_queue.stop()
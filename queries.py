@@ -1,6 +1,7 @@
 # this file is used as a way to organize all the needed SQL queries
 import os
 import time
+import hashlib
 import traceback
 
 import aiofiles.os as aos
@@ -9,23 +10,64 @@ from asqlite import ProxiedConnection
 from sqlite3 import Row
 
 from Utils.chunk import FileTypes
+from Caches.search_cache import SearchCache
+from Caches.random_song_sampler import RandomSongSampler
+from Caches.catalog_caches import CatalogCaches
+from Utils.cursor import encode_cursor, decode_cursor
+from Errors.raised_errors import InvalidValue
+from Utils.statement_registry import statements
 
-from GroqAI.generate_comment_summary import summarize
-from GroqAI.api import hybrid_token_estimate
+from GroqAI.api import hybrid_token_estimate, is_spam_comment
+
+# caches the ranked search results per normalized query. it is invalidated whenever a song is added or deleted
+search_cache = SearchCache()
+random_song_sampler = RandomSongSampler()
+
+# keeps both of the above up to date with the songs that were added or deleted (by this process, or by another worker)
+catalog_caches = CatalogCaches(search_cache, random_song_sampler)
 
 
 class User:
+    CREATE_USER = statements.register(
+        "user.create_user",
+        "INSERT INTO users (user_id, username, display_name, password, salt) VALUES (?, ?, ?, ?, ?)"
+    )
+    FETCH_USER = statements.register(
+        "user.fetch_user",
+        "SELECT * FROM users WHERE username = ?"
+    )
+    DELETE_FAVORITE_GENRES = statements.register(
+        "user.delete_favorite_genres",
+        "DELETE FROM favorite_genres WHERE user_id = ?"
+    )
+    DELETE_RECOMMENDATION_CANDIDATES = statements.register(
+        "user.delete_recommendation_candidates",
+        "DELETE FROM recommendation_candidates WHERE user_id = ?"
+    )
+    DELETE_FAVORITE_SONGS = statements.register(
+        "user.delete_favorite_songs",
+        "DELETE FROM favorite_songs WHERE user_id = ?"
+    )
+    ANONYMIZE_USER = statements.register(
+        "user.anonymize_user",
+        "UPDATE users SET username = ?, display_name = ?, password = ?, salt = ? WHERE user_id = ?"
+    )
+    CHANGE_DISPLAY_NAME = statements.register(
+        "user.change_display_name",
+        "UPDATE users SET display_name = ? WHERE user_id = ?"
+    )
+
     @staticmethod
     async def create_user(connection: ProxiedConnection, user_id: str, username: str, display_name: str, password: str,
                           salt: bytes) -> None:
-        await connection.execute(
-            "INSERT INTO users (user_id, username, display_name, password, salt) VALUES (?, ?, ?, ?, ?)",
+        await statements.execute(
+            connection, User.CREATE_USER,
             user_id, username, display_name, password, salt
         )
 
     @staticmethod
     async def fetch_user(connection: ProxiedConnection, username: str) -> Row:
-        row = await connection.fetchone("SELECT * FROM users WHERE username = ?", username)
+        row = await statements.fetchone(connection, User.FETCH_USER, username)
         return row
 
     @staticmethod
@@ -50,38 +92,195 @@ class User:
                 deleted_user = f"deleted_user_{int(time.time())}_{os.urandom(8).hex()}"
 
         # Delete user's favorite genres
-        await connection.execute(
-            "DELETE FROM favorite_genres WHERE user_id = ?",
-            user_id
-        )
+        await statements.execute(connection, User.DELETE_FAVORITE_GENRES, user_id)
+
+        # and the recommendations that were calculated from them
+        await statements.execute(connection, User.DELETE_RECOMMENDATION_CANDIDATES, user_id)
 
         # Delete user's favorite songs
-        await connection.execute(
-            "DELETE FROM favorite_songs WHERE user_id = ?",
-            user_id
-        )
+        await statements.execute(connection, User.DELETE_FAVORITE_SONGS, user_id)
+
+        # the user's songs and comments are kept (under the anonymized user), so the user's stats are kept as well
 
         # Delete the user record
-        await connection.execute(
-            "UPDATE users SET username = ?, display_name = ?, password = ?, salt = ? WHERE user_id = ?",
+        await statements.execute(
+            connection, User.ANONYMIZE_USER,
             deleted_user, "deleted_user", "0", b"0", user_id
         )
 
     @staticmethod
     async def change_display_name(connection: ProxiedConnection, user_id: str, display_name: str):
-        await connection.execute(
-            "UPDATE users SET display_name = ? WHERE user_id = ?",
-            display_name, user_id
+        await statements.execute(connection, User.CHANGE_DISPLAY_NAME, display_name, user_id)
+
+
+class UserStats:
+    """
+    the user's upload counters (songs and comments), so that the user's statistics are a single primary key lookup
+    instead of counting the user's rows in song_info and song_comments on every request.
+
+    the counters are changed in the same transaction as the rows they count (see Music.add_song, Music.delete_song,
+    Comments.upload_comment and Comments.delete_comment). a user without a row simply has no uploads.
+
+    if the counters ever drift, Utils.user_stats_check can find the difference and backfill them from the real rows.
+    """
+
+    CHANGE_SONG_UPLOADS = statements.register(
+        "user_stats.change_song_uploads",
+        """
+        INSERT INTO user_stats (user_id, song_uploads) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET song_uploads = song_uploads + excluded.song_uploads
+        """
+    )
+    CHANGE_COMMENTS = statements.register(
+        "user_stats.change_comments",
+        """
+        INSERT INTO user_stats (user_id, comments) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET comments = comments + excluded.comments
+        """
+    )
+    FETCH_SONG_COMMENT_COUNTS = statements.register(
+        "user_stats.fetch_song_comment_counts",
+        "SELECT uploaded_by, COUNT(*) FROM song_comments WHERE song_id = ? GROUP BY uploaded_by"
+    )
+    FETCH_USER_STATS = statements.register(
+        "user_stats.fetch_user_stats",
+        "SELECT song_uploads, comments FROM user_stats WHERE user_id = ?"
+    )
+    BACKFILL = statements.register(
+        "user_stats.backfill",
+        """
+        INSERT INTO user_stats (user_id, song_uploads, comments)
+        SELECT
+            users.user_id,
+            (SELECT COUNT(*) FROM song_info WHERE song_info.user_id = users.user_id),
+            (SELECT COUNT(*) FROM song_comments WHERE song_comments.uploaded_by = users.user_id)
+        FROM users WHERE true
+        ON CONFLICT(user_id) DO UPDATE SET
+            song_uploads = excluded.song_uploads,
+            comments = excluded.comments
+        """
+    )
+    FIND_INCONSISTENCIES = statements.register(
+        "user_stats.find_inconsistencies",
+        """
+        WITH actual AS (
+            SELECT
+                users.user_id AS user_id,
+                (SELECT COUNT(*) FROM song_info WHERE song_info.user_id = users.user_id) AS song_uploads,
+                (SELECT COUNT(*) FROM song_comments WHERE song_comments.uploaded_by = users.user_id) AS comments
+            FROM users
         )
+        SELECT
+            actual.user_id, 
+            COALESCE(user_stats.song_uploads, 0), actual.song_uploads, 
+            COALESCE(user_stats.comments, 0), actual.comments
+        FROM actual
+        LEFT JOIN user_stats ON user_stats.user_id = actual.user_id
+        WHERE COALESCE(user_stats.song_uploads, 0) != actual.song_uploads
+           OR COALESCE(user_stats.comments, 0) != actual.comments
+        """
+    )
+
+    @staticmethod
+    async def change_song_uploads(connection: ProxiedConnection, user_id: str, amount: int):
+        await statements.execute(connection, UserStats.CHANGE_SONG_UPLOADS, user_id, amount)
+
+    @staticmethod
+    async def change_comments(connection: ProxiedConnection, user_id: str, amount: int):
+        await statements.execute(connection, UserStats.CHANGE_COMMENTS, user_id, amount)
+
+    @staticmethod
+    async def fetch_song_comment_counts(connection: ProxiedConnection, song_id: int) -> dict[str, int]:
+        """:returns: dict[user ID -> the amount of comments the user uploaded to the song]"""
+
+        rows = await statements.fetchall(connection, UserStats.FETCH_SONG_COMMENT_COUNTS, song_id)
+
+        return {row[0]: row[1] for row in rows}
+
+    @staticmethod
+    async def fetch_user_stats(connection: ProxiedConnection, user_id: str) -> tuple[int, int]:
+        """:returns: tuple[song uploads, comments]"""
+
+        stats = await statements.fetchone(connection, UserStats.FETCH_USER_STATS, user_id)
+
+        if not stats:
+            return 0, 0
+
+        return stats[0], stats[1]
+
+    @staticmethod
+    async def backfill(connection: ProxiedConnection) -> int:
+        """
+        recounts the counters of every user from song_info and song_comments
+
+        :returns: the amount of users that were recounted
+        """
+
+        cursor = await statements.execute(connection, UserStats.BACKFILL)
+
+        return cursor.get_cursor().rowcount
+
+    @staticmethod
+    async def find_inconsistencies(connection: ProxiedConnection) -> list[dict[str, str | int]]:
+        """:returns: every user whose counters don't match the real amount of songs and comments they uploaded"""
+
+        rows = await statements.fetchall(connection, UserStats.FIND_INCONSISTENCIES)
+
+        return [
+            {
+                "user_id": row[0],
+                "song_uploads": row[1],
+                "actual_song_uploads": row[2],
+                "comments": row[3],
+                "actual_comments": row[4],
+            } for row in rows
+        ]
 
 
 class FileSystem:
+    FIND_FREE_CLUSTER = statements.register(
+        "file_system.find_free_cluster",
+        "SELECT cluster_id FROM clusters WHERE current_size < ?"
+    )
+    FETCH_CLUSTER = statements.register(
+        "file_system.fetch_cluster",
+        "SELECT * FROM clusters WHERE cluster_id = ?"
+    )
+    CREATE_CLUSTER = statements.register(
+        "file_system.create_cluster",
+        # default for current_size is 0, so we don't need to set it.
+        "INSERT INTO clusters (cluster_id) VALUES (?)"
+    )
+    CREATE_BASE_FILE = statements.register(
+        "file_system.create_base_file",
+        """
+        INSERT INTO files
+        (file_id, file_cluster_id, user_uploaded_id, size, uploaded_at, raw_file_id, file_format) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """
+    )
+    INCREASE_CLUSTER_SIZE = statements.register(
+        "file_system.increase_cluster_size",
+        "UPDATE clusters SET current_size = current_size + 1 WHERE cluster_id = ?"
+    )
+    FETCH_FILE = statements.register(
+        "file_system.fetch_file",
+        "SELECT * FROM files WHERE file_id = ?"
+    )
+    REDUCE_CLUSTER_SIZE = statements.register(
+        "file_system.reduce_cluster_size",
+        "UPDATE clusters SET current_size = current_size - ? WHERE cluster_id = ?"
+    )
+    DELETE_FILE = statements.register(
+        "file_system.delete_file",
+        "DELETE FROM files WHERE file_id = ?"
+    )
+
     # clusters
     @staticmethod
     async def find_free_cluster(connection: ProxiedConnection, max_size: int) -> str | None:
         """:returns: the cluster's name (ID). find files with main_dir/cluster_id/file_id"""
 
-        row = await connection.fetchone("SELECT cluster_id FROM clusters WHERE current_size < ?", max_size)
+        row = await statements.fetchone(connection, FileSystem.FIND_FREE_CLUSTER, max_size)
 
         if row:
             return row["cluster_id"]
@@ -92,7 +291,7 @@ class FileSystem:
     async def does_cluster_exist(connection: ProxiedConnection, cluster_id: str) -> bool:
         """:returns: whether the cluster exists or not (True means it exists)"""
 
-        cluster = await connection.fetchone("SELECT * FROM clusters WHERE cluster_id = ?", cluster_id)
+        cluster = await statements.fetchone(connection, FileSystem.FETCH_CLUSTER, cluster_id)
 
         if cluster:
             return True
@@ -101,8 +300,7 @@ class FileSystem:
 
     @staticmethod
     async def create_new_cluster(connection: ProxiedConnection, cluster_id: str) -> None:
-        # default for current_size is 0, so we don't need to set it.
-        await connection.execute("INSERT INTO clusters (cluster_id) VALUES (?)", cluster_id)
+        await statements.execute(connection, FileSystem.CREATE_CLUSTER, cluster_id)
 
     @staticmethod
     async def create_base_file(
@@ -117,27 +315,21 @@ class FileSystem:
 
         current_time = int(time.time())
 
-        await connection.execute(
-            """
-            INSERT INTO files
-            (file_id, file_cluster_id, user_uploaded_id, size, uploaded_at, raw_file_id, file_format) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
+        await statements.execute(
+            connection, FileSystem.CREATE_BASE_FILE,
             file_id, cluster_id, user_uploaded_id, size, current_time, raw_file_id, file_format
         )
 
         # since you can upload songs without cover images, the default cover image is stored in 1 place and does not
         # need to be added to a cluster. and this the cluster ID *can* be None
         if cluster_id:
-            await connection.execute(
-                """UPDATE clusters SET current_size = current_size + 1 WHERE cluster_id = ?""",
-                cluster_id
-            )
+            await statements.execute(connection, FileSystem.INCREASE_CLUSTER_SIZE, cluster_id)
 
     @staticmethod
     async def does_file_exist(connection: ProxiedConnection, file_id: str) -> bool:
         """:returns: whether the file exists or not (True means it exists)"""
 
-        file = await connection.fetchone("SELECT * FROM files WHERE file_id = ?", file_id)
+        file = await statements.fetchone(connection, FileSystem.FETCH_FILE, file_id)
 
         if file:
             return True
@@ -146,15 +338,55 @@ class FileSystem:
 
     @staticmethod
     async def reduce_cluster_size(connection: ProxiedConnection, cluster_id: str, amount: int):
-        await connection.execute(
-            """
-            UPDATE clusters SET current_size = current_size - ? WHERE cluster_id = ?
-            """,
-            amount, cluster_id
-        )
+        await statements.execute(connection, FileSystem.REDUCE_CLUSTER_SIZE, amount, cluster_id)
 
 
 class MediaFiles:
+    CREATE_MEDIA_FILE = statements.register(
+        "media_files.create_media_file",
+        """
+        INSERT INTO media_files
+        (song_id, file_id, file_type, file_path) VALUES (?, ?, ?, ?)
+        """
+    )
+    BULK_FETCH_PATHS = statements.register(
+        "media_files.bulk_fetch_paths",
+        """
+        SELECT file_path
+        FROM media_files
+        WHERE song_id IN (SELECT value FROM json_each(?))
+        ORDER BY song_id; -- Ensures the order matches the song_ids list
+        """
+    )
+    FETCH_PATH_BY_TYPE = statements.register(
+        "media_files.fetch_path_by_type",
+        """
+        SELECT file_path
+        FROM media_files
+        WHERE song_id = ? AND file_type = ?
+        """
+    )
+    BULK_FETCH_PREVIEW_PATHS = statements.register(
+        "media_files.bulk_fetch_preview_paths",
+        """
+        SELECT song_id, file_path
+        FROM media_files
+        WHERE song_id IN (SELECT value FROM json_each(?)) AND file_type = 'cover'
+        """
+    )
+    BULK_FETCH_MEDIA_FILE_IDS = statements.register(
+        "media_files.bulk_fetch_media_file_ids",
+        """
+        SELECT song_id, file_id, file_type
+        FROM media_files
+        WHERE song_id IN (SELECT value FROM json_each(?))
+        """
+    )
+    FETCH_SONG_FILE_PATHS = statements.register(
+        "media_files.fetch_song_file_paths",
+        "SELECT file_path FROM media_files WHERE song_id = ?"
+    )
+
     @staticmethod
     async def create_media_file(
             connection: ProxiedConnection,
@@ -163,13 +395,7 @@ class MediaFiles:
             file_type: str,
             file_path: str,
     ):
-        await connection.execute(
-            """
-            INSERT INTO media_files
-            (song_id, file_id, file_type, file_path) VALUES (?, ?, ?, ?)
-            """,
-            song_id, file_id, file_type, file_path
-        )
+        await statements.execute(connection, MediaFiles.CREATE_MEDIA_FILE, song_id, file_id, file_type, file_path)
 
     @staticmethod
     async def bulk_create_media_file(
@@ -179,11 +405,8 @@ class MediaFiles:
             file_type: str,
             file_paths: list[str]
     ):
-        await connection.executemany(
-            """
-            INSERT INTO media_files
-            (song_id, file_id, file_type, file_path) VALUES (?, ?, ?, ?)
-            """,
+        await statements.executemany(
+            connection, MediaFiles.CREATE_MEDIA_FILE,
             [(song_id, file_id, file_type, file_path) for file_id, file_path in zip(file_ids, file_paths)]
         )
 
@@ -246,16 +469,7 @@ class MediaFiles:
         if not song_ids:
             return []
 
-        # Use a parameterized query to prevent SQL injection
-        placeholders = ", ".join(["?"] * len(song_ids))  # Create placeholders (?, ?, ?, ...)
-        query = f"""
-           SELECT file_path
-           FROM media_files
-           WHERE song_id IN ({placeholders})
-           ORDER BY song_id; -- Ensures the order matches the song_ids list
-           """
-
-        results = await connection.fetchall(query, tuple(song_ids))
+        results = await statements.fetchall(connection, MediaFiles.BULK_FETCH_PATHS, statements.json_list(song_ids))
 
         # Extract the file_path values from the results
         return [row[0] for row in results]
@@ -266,13 +480,10 @@ class MediaFiles:
             song_id: int,
             default_cover_image_path: str = None
     ) -> str:
-        query = f"""
-           SELECT file_path
-           FROM media_files
-           WHERE song_id = ? AND file_type = 'cover'
-        """
-
-        result = await connection.fetchone(query, song_id)
+        result = await statements.fetchone(
+            connection, MediaFiles.FETCH_PATH_BY_TYPE,
+            song_id, FileTypes.COVER.value
+        )
 
         if not result:
             return default_cover_image_path
@@ -288,15 +499,10 @@ class MediaFiles:
         if not song_ids:
             return []
 
-        # Use a parameterized query to prevent SQL injection
-        placeholders = ", ".join(["?"] * len(song_ids))  # Create placeholders (?, ?, ?, ...)
-        query = f"""
-           SELECT song_id, file_path
-           FROM media_files
-           WHERE song_id IN ({placeholders}) AND file_type = 'cover'
-           """
-
-        results = await connection.fetchall(query, tuple(song_ids))
+        results = await statements.fetchall(
+            connection, MediaFiles.BULK_FETCH_PREVIEW_PATHS,
+            statements.json_list(song_ids)
+        )
 
         # Create a mapping of song_id to file_path
         song_paths = {row[0]: row[1] for row in results}
@@ -304,18 +510,50 @@ class MediaFiles:
         # Ensure all song_ids are accounted for, using a default path if missing
         return [song_paths.get(song_id, default_cover_image_path) for song_id in song_ids]
 
+    @staticmethod
+    async def bulk_fetch_media_versions(
+            connection: ProxiedConnection,
+            song_ids: list[int],
+    ) -> dict[int, dict[str, str | int]]:
+        """
+        songs are never edited after they are uploaded, which means that the (unique) file IDs of a song's media files
+        identify its content. the client uses this version in order to know if its locally cached media is still valid.
+
+        :returns: dict[song_id -> {"media_version": str, "sheet_count": int}]
+        """
+        if not song_ids:
+            return {}
+
+        results = await statements.fetchall(
+            connection, MediaFiles.BULK_FETCH_MEDIA_FILE_IDS,
+            statements.json_list(song_ids)
+        )
+
+        song_file_ids: dict[int, list[str]] = {}
+        sheet_counts: dict[int, int] = {}
+        for song_id, file_id, file_type in results:
+            song_file_ids.setdefault(song_id, []).append(f"{file_type}:{file_id}")
+
+            if file_type == FileTypes.SHEET.value:
+                sheet_counts[song_id] = sheet_counts.get(song_id, 0) + 1
+
+        return {
+            song_id: {
+                "media_version": hashlib.sha256(",".join(sorted(file_ids)).encode()).hexdigest()[:32],
+                "sheet_count": sheet_counts.get(song_id, 0)
+            }
+            for song_id, file_ids in song_file_ids.items()
+        }
+
     @staticmethod
     async def fetch_audio_path(
             connection: ProxiedConnection,
             song_id: int,
     ) -> str | None:
-        query = f"""
-           SELECT file_path
-           FROM media_files
-           WHERE song_id = ? AND file_type = 'audio'
-        """
-
-        result = await connection.fetchone(query, song_id)
+        result = await statements.fetchone(
+            connection, MediaFiles.FETCH_PATH_BY_TYPE,
+            song_id, FileTypes.AUDIO.value
+        )
 
         if not result:
             return None
@@ -327,13 +565,10 @@ class MediaFiles:
             connection: ProxiedConnection,
             song_id: int,
     ) -> list[str]:
-        query = f"""
-           SELECT file_path
-           FROM media_files
-           WHERE song_id = ? AND file_type = 'sheet'
-        """
-
-        results = await connection.fetchall(query, song_id)
+        results = await statements.fetchall(
+            connection, MediaFiles.FETCH_PATH_BY_TYPE,
+            song_id, FileTypes.SHEET.value
+        )
 
         if not results:
             return []
@@ -342,6 +577,63 @@ class MediaFiles:
 
 
 class Music:
+    CREATE_SONG = statements.register(
+        "music.create_song",
+        """
+        INSERT INTO song_info (user_id, artist_name, album_name, song_name, song_length)
+        VALUES (?, ?, ?, ?, ?)
+        """
+    )
+    INDEX_SONG_NAME_FTS5 = statements.register(
+        "music.index_song_name_fts5",
+        """
+        INSERT INTO song_info_fts (rowid, song_name)
+        VALUES (?, ?);
+        """
+    )
+    INDEX_SONG_NAME_SPELLFIX = statements.register(
+        "music.index_song_name_spellfix",
+        """
+        INSERT INTO song_name_trigrams (word)
+        VALUES (?);
+        """
+    )
+    BULK_FETCH_SONG_DATA = statements.register(
+        "music.bulk_fetch_song_data",
+        """
+        SELECT 
+            song_info.song_id,
+            song_info.user_id,
+            users.username,
+            artist_name,
+            album_name,
+            song_name,
+            song_length,
+            GROUP_CONCAT(genres.genre_name, ',') AS genre_list
+        FROM song_info
+        LEFT JOIN genres ON song_info.song_id = genres.song_id
+        LEFT JOIN users ON song_info.user_id = users.user_id
+        WHERE song_info.song_id IN (SELECT value FROM json_each(?))
+        GROUP BY song_info.song_id
+        """
+    )
+    FETCH_FAVORITE_SONG_IDS = statements.register(
+        "music.fetch_favorite_song_ids",
+        "SELECT song_id FROM favorite_songs WHERE user_id = ?"
+    )
+    CREATE_GENRE = statements.register(
+        "music.create_genre",
+        "INSERT INTO genres (song_id, genre_name) VALUES (?, ?)"
+    )
+    FETCH_USER_SONG = statements.register(
+        "music.fetch_user_song",
+        "SELECT * FROM song_info WHERE song_id = ? AND user_id = ?"
+    )
+    DELETE_SONG = statements.register(
+        "music.delete_song",
+        "DELETE FROM song_info WHERE song_id = ? RETURNING user_id"
+    )
+
     @staticmethod
     async def add_song(
             connection: ProxiedConnection,
@@ -353,30 +645,20 @@ class Music:
     ):
         """:returns: the song_id of the newly created song entry"""
 
-        cursor = await connection.execute(
-            """
-            INSERT INTO song_info (user_id, artist_name, album_name, song_name, song_length)
-            VALUES (?, ?, ?, ?, ?)
-            """, user_id, artist_name, album_name, song_name, song_length_milliseconds
+        cursor = await statements.execute(
+            connection, Music.CREATE_SONG,
+            user_id, artist_name, album_name, song_name, song_length_milliseconds
         )
 
         song_id = cursor.get_cursor().lastrowid
 
         # Index the song_name in the FTS5 table
-        await connection.execute(
-            """
-            INSERT INTO song_info_fts (rowid, song_name)
-            VALUES (?, ?);
-            """, song_id, song_name
-        )
+        await statements.execute(connection, Music.INDEX_SONG_NAME_FTS5, song_id, song_name)
 
         # Insert the song name into the spellfix1 table
-        await connection.execute(
-            """
-            INSERT INTO song_name_trigrams (word)
-            VALUES (?);
-            """, (song_name,)
-        )
+        await statements.execute(connection, Music.INDEX_SONG_NAME_SPELLFIX, song_name)
+
+        await UserStats.change_song_uploads(connection=connection, user_id=user_id, amount=1)
 
         return song_id
 
@@ -388,26 +670,7 @@ class Music:
         if not song_ids:
             return []
 
-        # Use a parameterized query to prevent SQL injection
-        placeholders = ", ".join(["?"] * len(song_ids))  # Create placeholders (?, ?, ?, ...)
-        query = f"""
-           SELECT 
-               song_info.song_id,
-               song_info.user_id,
-               users.username,
-               artist_name,
-               album_name,
-               song_name,
-               song_length,
-               GROUP_CONCAT(genres.genre_name, ',') AS genre_list
-           FROM song_info
-           LEFT JOIN genres ON song_info.song_id = genres.song_id
-           LEFT JOIN users ON song_info.user_id = users.user_id
-           WHERE song_info.song_id IN ({placeholders})
-           GROUP BY song_info.song_id
-        """
-
-        results = await connection.fetchall(query, tuple(song_ids))
+        results = await statements.fetchall(connection, Music.BULK_FETCH_SONG_DATA, statements.json_list(song_ids))
 
         # Create a dictionary mapping song_id to its corresponding result
         result_dict = {
@@ -432,10 +695,7 @@ class Music:
             connection: ProxiedConnection,
             user_id: str
     ) -> set[int]:
-        song_ids = await connection.fetchall(
-            """SELECT song_id FROM favorite_songs WHERE user_id = ?""",
-            user_id
-        )
+        song_ids = await statements.fetchall(connection, Music.FETCH_FAVORITE_SONG_IDS, user_id)
 
         return {song_id[0] for song_id in song_ids}
 
@@ -449,6 +709,16 @@ class Music:
             song_paths = await MediaFiles.bulk_fetch_preview_paths(connection=connection, song_ids=song_ids,
                                                                    default_cover_image_path=default_cover_image_path)
             song_data_dicts = await Music.bulk_fetch_song_data(connection=connection, song_ids=song_ids)
+            media_versions = await MediaFiles.bulk_fetch_media_versions(connection=connection, song_ids=song_ids)
+
+        # adds the media version (see MediaFiles.bulk_fetch_media_versions) so that the client can validate its cache
+        for song_data in song_data_dicts:
+            if not song_data:
+                continue
+
+            song_data.update(
+                media_versions.get(song_data["song_id"], {"media_version": "", "sheet_count": 0})
+            )
 
         return zip(song_paths, song_data_dicts)
 
@@ -458,26 +728,21 @@ class Music:
             song_id: int,
             genres: list[str]
     ):
-        await connection.executemany(
-            """INSERT INTO genres (song_id, genre_name) VALUES (?, ?)""",
+        await statements.executemany(
+            connection, Music.CREATE_GENRE,
             [(song_id, genre_name) for genre_name in genres]
         )
 
-    @staticmethod
-    async def fetch_user_song_upload_count(connection: ProxiedConnection, user_id: str) -> int:
-        upload_count = await connection.fetchone(
-            """SELECT COUNT(*) FROM song_info WHERE user_id = ?""",
-            user_id
+        # the new song needs to be recommended to users who like its genres
+        await RecommendationAlgorithm.add_song_to_candidates(
+            connection=connection,
+            song_id=song_id,
+            genres=genres
         )
 
-        return upload_count[0]
-
     @staticmethod
     async def does_user_own_song(connection: ProxiedConnection, user_id: str, song_id: int) -> bool:
-        comment = await connection.fetchone(
-            """SELECT * FROM song_info WHERE song_id = ? AND user_id = ?""",
-            song_id, user_id
-        )
+        comment = await statements.fetchone(connection, Music.FETCH_USER_SONG, song_id, user_id)
 
         if comment:
             return True
@@ -487,10 +752,7 @@ class Music:
     @staticmethod
     async def delete_song(connection: ProxiedConnection, song_id: int):
         try:
-            song_files = await connection.fetchall(
-                """SELECT file_path FROM media_files WHERE song_id = ?""",
-                song_id
-            )
+            song_files = await statements.fetchall(connection, MediaFiles.FETCH_SONG_FILE_PATHS, song_id)
 
             clusters_removed: dict[str, int] = {}
             for file in song_files:
@@ -505,10 +767,7 @@ class Music:
 
                 await aos.remove(file_path)
 
-                await connection.execute(
-                    """DELETE FROM files WHERE file_id = ?""",
-                    file_id
-                )
+                await statements.execute(connection, FileSystem.DELETE_FILE, file_id)
 
             for cluster_id, amount_removed in clusters_removed.items():
                 await FileSystem.reduce_cluster_size(
@@ -517,42 +776,210 @@ class Music:
                     amount=amount_removed
                 )
 
-            await connection.execute(
-                """DELETE FROM song_info WHERE song_id = ?""",
-                song_id
-            )
+            # the song's comments are deleted with it (ON DELETE CASCADE), so they are counted before deleting
+            comment_counts = await UserStats.fetch_song_comment_counts(connection=connection, song_id=song_id)
+
+            # fetchall (and not fetchone) steps the statement until it's done, so the delete is never left half finished
+            deleted_songs = await statements.fetchall(connection, Music.DELETE_SONG, song_id)
+
+            for deleted_song in deleted_songs:
+                await UserStats.change_song_uploads(connection=connection, user_id=deleted_song[0], amount=-1)
+
+                for user_id, comment_count in comment_counts.items():
+                    await UserStats.change_comments(connection=connection, user_id=user_id, amount=-comment_count)
         except Exception as e:
             traceback.print_exc()
             raise e
 
 
 class MusicSearch:
+    # how many ranked song IDs are cached per search query. pages (through the cursor) are cut from this list
+    SEARCH_CACHE_DEPTH = 100
+
+    SEARCH_SONG_BY_NAME = statements.register(
+        "music_search.search_song_by_name",
+        """
+        WITH fts5_candidates AS (
+            -- 'bm25(song_info_fts)' calculates relevance based on the BM25 algorithm, which ranks text matches by 
+            -- relevance. note that bm25 is negative, and the lower (more negative) it is, the more relevant the match.
+            SELECT song_info_fts.rowid AS song_id, bm25(song_info_fts) AS raw_score
+            FROM song_info_fts
+            
+            -- Matches song names using FTS5's full-text search (e.g., "duc*" matches "duck")
+            WHERE song_info_fts.song_name MATCH ?
+        ),
+        
+        fts5_best AS (
+            SELECT MIN(raw_score) AS best_score FROM fts5_candidates
+        ),
+        
+        spellfix_candidates AS (
+            -- 'song_name_trigrams' stores word fragments (trigrams) for fuzzy search. its row IDs map to the song IDs
+            SELECT song_name_trigrams.rowid AS song_id, editdist3(song_name_trigrams.word, ?) AS raw_score
+            FROM song_name_trigrams
+            
+            WHERE song_name_trigrams.word LIKE ? -- Performs a prefix match for similar words (e.g., "worl%" matches "world")
+              AND editdist3(song_name_trigrams.word, ?) <= ? -- Filters words within the given edit distance threshold
+        ),
+        
+        ranked_candidates AS (
+            -- the best bm25 match gets a score of 1, and the rest are scored relative to it
+            SELECT song_id, 
+                   CASE WHEN fts5_best.best_score < 0 THEN raw_score / fts5_best.best_score ELSE 1.0 END AS score
+            FROM fts5_candidates, fts5_best
+            
+            UNION ALL
+            
+            -- an exact match (edit distance of 0) gets a score of 1, and it goes down to 0 at the edit threshold 
+            SELECT song_id, 1.0 - (raw_score * 1.0 / (? + 1)) AS score
+            FROM spellfix_candidates
+        )
+        
+        SELECT song_info.song_id, MAX(ranked_candidates.score) AS relevance
+        FROM ranked_candidates
+        
+        JOIN song_info ON ranked_candidates.song_id = song_info.song_id 
+        
+        -- a song that is found by both generators is only returned once, with its best score
+        GROUP BY song_info.song_id
+        
+        ORDER BY relevance DESC, song_info.song_id ASC
+        LIMIT ? OFFSET ?;
+        """
+    )
+    FETCH_SONG_SEARCH_INFO = statements.register(
+        "music_search.fetch_song_search_info",
+        """
+        SELECT song_name, artist_name, album_name, song_id FROM song_info 
+        WHERE song_id IN (SELECT value FROM json_each(?))
+        """
+    )
+    SEARCH_SONG_BY_GENRES = statements.register(
+        "music_search.search_song_by_genres",
+        """
+        SELECT DISTINCT song_id FROM genres 
+        WHERE genre_name IN (SELECT value FROM json_each(?)) AND song_id > ? 
+        ORDER BY song_id 
+        LIMIT ?;
+        """
+    )
+    SEARCH_SONG_BY_USER_UPLOADED = statements.register(
+        "music_search.search_song_by_user_uploaded",
+        """
+        SELECT song_id FROM song_info 
+        WHERE user_id = ? AND song_id NOT IN (SELECT value FROM json_each(?)) 
+        LIMIT ?;
+        """
+    )
+    SEARCH_SONG_BY_INCLUSION = statements.register(
+        "music_search.search_song_by_inclusion",
+        """
+        SELECT song_id FROM song_info 
+        WHERE song_id IN (SELECT value FROM json_each(?)) AND song_id NOT IN (SELECT value FROM json_each(?)) 
+        LIMIT ?;
+        """
+    )
+    SEARCH_SONG_BY_ARTIST = statements.register(
+        "music_search.search_song_by_artist",
+        """
+        SELECT song_id FROM song_info 
+        WHERE artist_name IN (SELECT value FROM json_each(?)) AND song_id NOT IN (SELECT value FROM json_each(?)) 
+        LIMIT ?;
+        """
+    )
+    SEARCH_SONG_BY_LENGTH = statements.register(
+        "music_search.search_song_by_length",
+        """
+        SELECT song_id FROM song_info 
+        WHERE song_length > ? 
+          -- a NULL maximum means there is no upper limit
+          AND (? IS NULL OR song_length < ?) 
+          AND song_id NOT IN (SELECT value FROM json_each(?)) 
+        LIMIT ?;
+        """
+    )
+    FETCH_ALL_SONG_IDS = statements.register(
+        "music_search.fetch_all_song_ids",
+        "SELECT song_id FROM song_info;"
+    )
+    FETCH_GENRE_NAMES = statements.register(
+        "music_search.fetch_genre_names",
+        """
+        SELECT genre_name
+        FROM genres WHERE genre_name NOT IN (SELECT value FROM json_each(?)) 
+        LIMIT 100
+        """
+    )
+
     @staticmethod
-    async def search_song(connection: ProxiedConnection, search_query: str, exclude: list[int], limit: int = 10):
-        """returns a list of song IDs based off of a search query if given, else returns a random list of song IDs"""
-        if search_query.strip():
-            return await MusicSearch.search_song_by_name(
+    async def search_song(connection: ProxiedConnection, search_query: str, cursor: str | None,
+                          limit: int = 10) -> tuple[list[int], str | None]:
+        """
+        returns a list of song IDs based off of a search query if given, else returns a random list of song IDs
+
+        :returns: tuple[song IDs, the cursor of the next page (None if there are no more pages)]
+        """
+        if not search_query.strip():
+            return await MusicSearch.get_random_songs(connection=connection, cursor=cursor, limit=limit)
+
+        cursor_values = decode_cursor(cursor, expected_keys=("offset",))
+        offset = cursor_values["offset"] if cursor_values else 0
+
+        # the offset is used to slice the cached results, so anything but a non-negative int (a bool is an int too) is
+        # rejected like any other invalid cursor
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise InvalidValue("the given cursor is invalid")
+
+        cache_key = SearchCache.create_key("song_ids", search_query)
+
+        catalog_caches.refresh()
+
+        ranked_song_ids: list[int] | None = search_cache.get(cache_key)
+
+        if ranked_song_ids is None:
+            cache_generation = search_cache.generation
+
+            # the full ranked list is cached, so that every page of the same search can be cut from it instead of
+            # re-running the search
+            ranked_song_ids = await MusicSearch.search_song_by_name(
+                connection=connection,
+                search_query=search_query,
+                limit=MusicSearch.SEARCH_CACHE_DEPTH,
+            )
+
+            search_cache.set(cache_key, ranked_song_ids, generation=cache_generation)
+
+        matching_song_ids = ranked_song_ids[offset:offset + limit]
+
+        # if the cached list ran out, but the search could have more results, we continue past the cached depth
+        if len(matching_song_ids) < limit and len(ranked_song_ids) >= MusicSearch.SEARCH_CACHE_DEPTH:
+            matching_song_ids = await MusicSearch.search_song_by_name(
                 connection=connection,
                 search_query=search_query,
                 limit=limit,
-                exclude=exclude
+                offset=offset
             )
 
-        return await MusicSearch.get_random_songs(connection=connection, limit=limit, exclude=exclude)
+        next_cursor = encode_cursor(offset=offset + limit) if len(matching_song_ids) == limit else None
+
+        return matching_song_ids, next_cursor
 
     @staticmethod
     async def search_song_by_name(connection: ProxiedConnection,
                                   search_query: str,
-                                  exclude: list[int],
                                   limit: int = 10,
+                                  offset: int = 0,
                                   fuzzy_precession: int = 10) -> list[int]:
         """
         Searches for songs by name using FTS5 and spellfix, and returns the top 'limit' results ordered by relevance.
 
+        both candidate generators (FTS5 prefix matching and spellfix fuzzy matching) run in a single statement. their
+        scores are normalized to the same 0-1 range (1 being the most relevant), so that they can be ranked together.
+
         :param connection: Database connection object.
         :param search_query: Search string entered by the user.
-        :param exclude: the list of song IDs to not include in the search
         :param limit: Number of results to return.
+        :param offset: how many of the top results to skip (used for pagination)
         :param fuzzy_precession: how exact the fuzzy search (using spellfix1) is. the larger the number, the broader it is
         (default 5)
         :return: List of song IDs ordered by relevance.
@@ -561,111 +988,89 @@ class MusicSearch:
         search_query_fts5 = f'{search_query}*'
         search_query_like = f'{search_query}%'
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude)) if exclude else "NULL"  # Prevent empty placeholders
-        exclude_clause = f"AND song_info.song_id NOT IN ({exclude_placeholders})" if exclude else ""
-
-        fts5_params = (search_query_fts5, *exclude, limit) if exclude else (search_query_fts5, limit)
-
-        # Execute the FTS5 query with ordering
-        fts5_results = await connection.fetchall(
-            f"""
-            -- 'bm25(song_info_fts)' calculates relevance based on the BM25 algorithm, which ranks text matches by relevance.
-            SELECT song_info.song_id, bm25(song_info_fts) AS relevance
-            FROM song_info_fts
-
-            JOIN song_info ON song_info_fts.rowid = song_info.song_id -- Connects the FTS5 row IDs to actual song IDs
-            -- 'song_info_fts' is the full-text search table created using FTS5. Its row IDs map to the corresponding song entries in 'song_info'.
-            
-            -- Matches song names using FTS5's full-text search (e.g., "duc*" matches "duck")
-            WHERE song_info_fts.song_name MATCH ? {exclude_clause}              
-
-            ORDER BY relevance ASC
-
-            LIMIT ?;
-            """, fts5_params
+        search_results = await statements.fetchall(
+            connection, MusicSearch.SEARCH_SONG_BY_NAME,
+            search_query_fts5,
+            search_query, search_query_like, search_query, fuzzy_precession,
+            fuzzy_precession,
+            limit, offset
         )
 
-        spellfix_params = (search_query, search_query_like, search_query, fuzzy_precession, *exclude, limit) \
-            if exclude else (search_query, search_query_like, search_query, fuzzy_precession, limit)
+        return [row[0] for row in search_results]
 
-        # Execute the spellfix query with ordering
-        spellfix_results = await connection.fetchall(
-            f"""
-            SELECT song_info.song_id, editdist3(song_name_trigrams.word, ?) AS relevance
-            FROM song_info
+    @staticmethod
+    async def search_song_info(connection: ProxiedConnection, search_query: str, limit: int = 10) -> list[dict[str, str]]:
+        # an empty query returns random songs, which shouldn't be cached
+        cache_key = SearchCache.create_key("song_info", search_query, limit=limit) if search_query.strip() else None
 
-            JOIN song_name_trigrams ON song_name_trigrams.rowid = song_info.song_id -- Connects trigram row IDs to actual song IDs
-            -- 'song_name_trigrams' stores word fragments (trigrams) for fuzzy search. Each row represents a word, broken into trigrams (e.g., "world" -> "wor", "orl", "rld").
+        if cache_key:
+            catalog_caches.refresh()
 
-            WHERE song_name_trigrams.word LIKE ? -- Performs a prefix match for similar words (e.g., "worl%" matches "world")                
-              AND editdist3(song_name_trigrams.word, ?) <= ? -- Filters words within the given edit distance threshold (using fuzzy search)
-              {exclude_clause} 
-            
-            
-            ORDER BY relevance ASC
-            LIMIT ?;
-            """, spellfix_params
-        )
-
-        # Combine results, sorting by relevance
-        combined_results = fts5_results + spellfix_results
-        sorted_results = sorted(combined_results, key=lambda x: x[1])  # Sort by relevance (lower is better)
+            cached_song_info: list[dict[str, str]] | None = search_cache.get(cache_key)
 
-        # Extract the song IDs, ensuring no duplicates
-        matching_song_ids = list({row[0] for row in sorted_results})[:limit]
+            if cached_song_info is not None:
+                return cached_song_info
 
-        return matching_song_ids
+        cache_generation = search_cache.generation
 
-    @staticmethod
-    async def search_song_info(connection: ProxiedConnection, search_query: str, limit: int = 10) -> list[dict[str, str]]:
-        song_ids = await MusicSearch.search_song(connection=connection, search_query=search_query, exclude=[],
-                                                 limit=limit)
+        song_ids, _ = await MusicSearch.search_song(connection=connection, search_query=search_query, cursor=None,
+                                                    limit=limit)
 
-        include_placeholders = ", ".join(["?"] * len(song_ids))
+        if not song_ids:
+            return []
 
-        song_info_list = await connection.fetchall(
-            f"""SELECT song_name, artist_name, album_name, song_id FROM song_info WHERE song_id IN ({include_placeholders})""",
-            *song_ids
+        song_info_list = await statements.fetchall(
+            connection, MusicSearch.FETCH_SONG_SEARCH_INFO,
+            statements.json_list(song_ids)
         )
 
-        return [
-            {
+        song_info_dict = {
+            song_info[3]: {
                 "name": song_info[0],
                 "artist": song_info[1],
                 "album": song_info[2],
                 "song_id": song_info[3]
             }
             for song_info in song_info_list
-        ]
+        }
+
+        # the results are returned in the same (relevance) order as the song IDs
+        song_info_results = [song_info_dict[song_id] for song_id in song_ids if song_id in song_info_dict]
+
+        if cache_key:
+            search_cache.set(cache_key, song_info_results, generation=cache_generation)
+
+        return song_info_results
 
     @staticmethod
-    async def search_song_by_genres(connection: ProxiedConnection, genres: list[str], exclude: list[int],
-                                    limit: int = 10) -> list[int]:
+    async def search_song_by_genres(connection: ProxiedConnection, genres: list[str], cursor: str | None,
+                                    limit: int = 10) -> tuple[list[int], str | None]:
+        """
+        :returns: tuple[song IDs, the cursor of the next page (None if there are no more pages)]
+        """
         if not genres:
-            return []
-
-        placeholders = ", ".join(["?"] * len(genres))  # Create placeholders (?, ?, ?, ...)
+            return [], None
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
+        cursor_values = decode_cursor(cursor, expected_keys=("song_id",))
+        last_song_id = cursor_values["song_id"] if cursor_values else -1
 
-        results = await connection.fetchall(
-            f"SELECT song_id FROM genres WHERE genre_name IN ({placeholders}) {exclude_query} LIMIT ?;",
-            *genres, *exclude, limit
+        results = await statements.fetchall(
+            connection, MusicSearch.SEARCH_SONG_BY_GENRES,
+            statements.json_list(genres), last_song_id, limit
         )
 
-        return [row[0] for row in results]
+        song_ids = [row[0] for row in results]
+        next_cursor = encode_cursor(song_id=song_ids[-1]) if len(song_ids) == limit else None
+
+        return song_ids, next_cursor
 
     @staticmethod
     async def search_song_by_user_uploaded(connection: ProxiedConnection, user_id: str, exclude: list[int],
                                     limit: int = 10) -> list[int]:
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
-
-        results = await connection.fetchall(
-            f"SELECT song_id FROM song_info WHERE user_id = ? {exclude_query} LIMIT ?;",
-            user_id, *exclude, limit
+        results = await statements.fetchall(
+            connection, MusicSearch.SEARCH_SONG_BY_USER_UPLOADED,
+            user_id, statements.json_list(exclude), limit
         )
 
         return [row[0] for row in results]
@@ -676,14 +1081,9 @@ class MusicSearch:
         if not include:
             return []
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
-
-        include_placeholders = ", ".join(["?"] * len(include))
-
-        results = await connection.fetchall(
-            f"SELECT song_id FROM song_info WHERE song_id  IN ({include_placeholders}) {exclude_query} LIMIT ?;",
-            *include, *exclude, limit
+        results = await statements.fetchall(
+            connection, MusicSearch.SEARCH_SONG_BY_INCLUSION,
+            statements.json_list(include), statements.json_list(exclude), limit
         )
 
         return [row[0] for row in results]
@@ -694,14 +1094,9 @@ class MusicSearch:
         if not artists:
             return []
 
-        placeholders = ", ".join(["?"] * len(artists))  # Create placeholders (?, ?, ?, ...)
-
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
-
-        results = await connection.fetchall(
-            f"SELECT song_id FROM song_info WHERE artist_name IN ({placeholders}) {exclude_query} LIMIT ?;",
-            *artists, limit
+        results = await statements.fetchall(
+            connection, MusicSearch.SEARCH_SONG_BY_ARTIST,
+            statements.json_list(artists), statements.json_list(exclude), limit
         )
 
         return [row[0] for row in results]
@@ -709,304 +1104,627 @@ class MusicSearch:
     @staticmethod
     async def search_song_by_length(connection: ProxiedConnection, exclude: list[int], maximum: int | None = None,
                                     minimum: int = 0, limit: int = 10) -> list[int]:
-        search_parameters = [minimum]
-
-        upper_limit_query = ""
-        if maximum:
-            upper_limit_query = " AND song_length < ?"
-            search_parameters.append(maximum)
-
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
+        # a maximum of 0 (or None) means there is no upper limit
+        maximum = maximum or None
 
-        results = await connection.fetchall(
-            f"""SELECT song_id FROM song_info WHERE song_length > ? {upper_limit_query} {exclude_query} LIMIT ?;""",
-            *search_parameters, limit
+        results = await statements.fetchall(
+            connection, MusicSearch.SEARCH_SONG_BY_LENGTH,
+            minimum, maximum, maximum, statements.json_list(exclude), limit
         )
 
         return [row[0] for row in results]
 
     @staticmethod
-    async def get_random_songs(connection: ProxiedConnection, exclude: list[int], limit: int = 10) -> list[int]:
+    async def get_random_songs(connection: ProxiedConnection, cursor: str | None,
+                               limit: int = 10) -> tuple[list[int], str | None]:
         """
         Fetches random songs from the song_info table based on a given limit.
 
+        the songs are picked from the in-memory random_song_sampler (instead of sorting the table by RANDOM()). the
+        cursor holds the client's sampler stream, so that the following pages never repeat a song.
+
         :param connection: Database connection object.
-        :param exclude: the list of song IDs to specifically exclude from the search
+        :param cursor: the cursor of the previous page, None for the first page
         :param limit: The number of random songs to retrieve.
-        :return: List of random song IDs.
+        :return: tuple[random song IDs, the cursor of the next page (None if there are no more pages)]
         """
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"WHERE song_id NOT IN ({exclude_placeholders})" if exclude else ""
+        cursor_values = decode_cursor(cursor, expected_keys=("stream_id",))
+        stream_id = str(cursor_values["stream_id"]) if cursor_values else RandomSongSampler.create_stream_id()
 
-        # Execute the query to fetch random song IDs
-        random_songs = await connection.fetchall(
-            f"""
-            SELECT song_id
-            FROM song_info {exclude_query} 
-            ORDER BY RANDOM()
-            LIMIT ?;
-            """, *exclude, limit
-        )
+        async def fetch_all_song_ids() -> list[int]:
+            rows = await statements.fetchall(connection, MusicSearch.FETCH_ALL_SONG_IDS)
+            return [row[0] for row in rows]
+
+        catalog_caches.refresh()
+
+        # only queries the database the first time random songs are requested (or when another worker changed the songs)
+        await random_song_sampler.load(fetch_all_song_ids)
+
+        song_ids = random_song_sampler.sample(stream_id=stream_id, limit=limit)
+
+        next_cursor = encode_cursor(stream_id=stream_id) if len(song_ids) == limit else None
 
         # Return the list of random song IDs
-        return [row[0] for row in random_songs]
+        return song_ids, next_cursor
 
     @staticmethod
     async def get_genre_names(connection: ProxiedConnection, exclude: list[str]) -> list[str]:
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"WHERE genre_name NOT IN ({exclude_placeholders})" if exclude else ""
-
-        genres = await connection.fetchall(
-            f"""
-             SELECT genre_name
-             FROM genres {exclude_query} 
-             LIMIT 100
-             """, *exclude
-        )
+        genres = await statements.fetchall(connection, MusicSearch.FETCH_GENRE_NAMES, statements.json_list(exclude))
 
         return list(set([genre[0] for genre in genres]))
 
 
 class FavoriteSongs:
+    FETCH_FAVORITE = statements.register(
+        "favorite_songs.fetch_favorite",
+        "SELECT * FROM favorite_songs WHERE user_id = ? AND song_id = ?"
+    )
+    DELETE_FAVORITE = statements.register(
+        "favorite_songs.delete_favorite",
+        "DELETE FROM favorite_songs WHERE user_id = ? AND song_id = ?"
+    )
+    CREATE_FAVORITE = statements.register(
+        "favorite_songs.create_favorite",
+        "INSERT INTO favorite_songs (user_id, song_id) VALUES (?, ?)"
+    )
+    FETCH_FAVORITE_SONGS = statements.register(
+        "favorite_songs.fetch_favorite_songs",
+        """
+        SELECT song_id FROM favorite_songs 
+        WHERE user_id = ? AND song_id > ?
+        ORDER BY song_id
+        LIMIT ?;
+        """
+    )
+
     @staticmethod
     async def change_favorite(connection: ProxiedConnection, user_id: str, song_id: int):
-        exists = await connection.fetchone(
-            "SELECT * FROM favorite_songs WHERE user_id = ? AND song_id = ?",
-            user_id, song_id
-        )
+        exists = await statements.fetchone(connection, FavoriteSongs.FETCH_FAVORITE, user_id, song_id)
 
         if exists:
-            await connection.execute(
-                "DELETE FROM favorite_songs WHERE user_id = ? AND song_id = ?",
-                user_id, song_id
-            )
+            await statements.execute(connection, FavoriteSongs.DELETE_FAVORITE, user_id, song_id)
         else:
-            await connection.execute(
-                "INSERT INTO favorite_songs (user_id, song_id) VALUES (?, ?)",
-                user_id, song_id
-            )
+            await statements.execute(connection, FavoriteSongs.CREATE_FAVORITE, user_id, song_id)
 
     @staticmethod
-    async def fetch_favorite_songs(connection: ProxiedConnection, user_id: str, exclude: list[int], limit: int = 10) -> list[int]:
+    async def fetch_favorite_songs(connection: ProxiedConnection, user_id: str, cursor: str | None,
+                                   limit: int = 10) -> tuple[list[int], str | None]:
+        """
+        :returns: tuple[song IDs, the cursor of the next page (None if there are no more pages)]
+        """
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
+        cursor_values = decode_cursor(cursor, expected_keys=("song_id",))
+        last_song_id = cursor_values["song_id"] if cursor_values else -1
 
-        query = f"""
-            SELECT song_id FROM favorite_songs WHERE user_id = ?
-            {exclude_query}
-            LIMIT ?;
-        """
+        rows = await statements.fetchall(
+            connection, FavoriteSongs.FETCH_FAVORITE_SONGS,
+            user_id, last_song_id, limit
+        )
 
-        song_ids = await connection.fetchall(query, user_id, *exclude, limit)
+        song_ids = [song_id[0] for song_id in rows]
+        next_cursor = encode_cursor(song_id=song_ids[-1]) if len(song_ids) == limit else None
 
-        return [song_id[0] for song_id in song_ids]
+        return song_ids, next_cursor
 
 
 class RecommendationAlgorithm:
+    """
+    every user has a precomputed list of recommended songs (the recommendation_candidates table). a song's score is the
+    sum of the user's genre scores (favorite_genres) of every genre the song has.
+
+    whenever a genre score of a user changes, the scores of the songs with that genre are changed by the same amount,
+    so that the list never has to be fully recalculated.
+
+    note: a score change writes a row for every song in the changed genres, so its cost grows with the catalog (the
+    songs per genre, not the whole song_info). this is accepted, since the listening events are batched (see
+    Utils.genre_score_sink), so a user's changed genres are written once per flush and not once per listen, and the
+    writes are a single INSERT...SELECT per (user, score increase) that runs on the writer connection only. a genre
+    with tens of thousands of songs would need the scores to be kept per genre and summed when a page is read instead.
+    """
+
+    INCREASE_CANDIDATE_SCORES = statements.register(
+        "recommendation.increase_candidate_scores",
+        # a song with multiple of the given genres gets the increase once per genre (just like its favorite_genres sum)
+        """
+        INSERT INTO recommendation_candidates (user_id, song_id, score)
+        SELECT ?, song_id, COUNT(*) * ? FROM genres
+        WHERE genre_name IN (SELECT value FROM json_each(?))
+        GROUP BY song_id
+        ON CONFLICT(user_id, song_id) DO UPDATE SET score = score + excluded.score
+        """
+    )
+    ADD_SONG_TO_CANDIDATES = statements.register(
+        "recommendation.add_song_to_candidates",
+        """
+        INSERT INTO recommendation_candidates (user_id, song_id, score)
+        SELECT user_id, ?, SUM(score) FROM favorite_genres
+        WHERE genre IN (SELECT value FROM json_each(?))
+        GROUP BY user_id
+        ON CONFLICT(user_id, song_id) DO UPDATE SET score = score + excluded.score
+        """
+    )
+    FETCH_SONG_GENRES = statements.register(
+        "recommendation.fetch_song_genres",
+        "SELECT genre_name FROM genres WHERE song_id = ?"
+    )
+    BULK_FETCH_SONG_GENRES = statements.register(
+        "recommendation.bulk_fetch_song_genres",
+        "SELECT song_id, genre_name FROM genres WHERE song_id IN (SELECT value FROM json_each(?))"
+    )
+    INCREASE_GENRE_SCORE = statements.register(
+        "recommendation.increase_genre_score",
+        """
+        INSERT INTO favorite_genres (user_id, genre, score)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, genre) DO UPDATE SET score = score + excluded.score
+        """
+    )
+    FETCH_TOP_GENRES = statements.register(
+        "recommendation.fetch_top_genres",
+        "SELECT genre FROM favorite_genres WHERE user_id = ? ORDER BY score DESC"
+    )
+    FETCH_FIRST_CANDIDATES_PAGE = statements.register(
+        "recommendation.fetch_first_candidates_page",
+        """
+        SELECT song_id, score FROM recommendation_candidates
+        WHERE user_id = ?
+        ORDER BY score DESC, song_id ASC
+        LIMIT ?;
+        """
+    )
+    FETCH_CANDIDATES_PAGE = statements.register(
+        "recommendation.fetch_candidates_page",
+        """
+        SELECT song_id, score FROM recommendation_candidates
+        WHERE user_id = ? AND (score < ? OR (score = ? AND song_id > ?))
+        ORDER BY score DESC, song_id ASC
+        LIMIT ?;
+        """
+    )
+
+    @staticmethod
+    async def _increase_candidate_scores(connection: ProxiedConnection, user_id: str, genres: list[str],
+                                         score_increase: int):
+        if not genres:
+            return
+
+        await statements.execute(
+            connection, RecommendationAlgorithm.INCREASE_CANDIDATE_SCORES,
+            user_id, score_increase, statements.json_list(genres)
+        )
+
+    @staticmethod
+    async def add_song_to_candidates(connection: ProxiedConnection, song_id: int, genres: list[str]):
+        """adds a newly uploaded song to the recommendation candidates of every user that has a score in its genres"""
+
+        if not genres:
+            return
+
+        await statements.execute(
+            connection, RecommendationAlgorithm.ADD_SONG_TO_CANDIDATES,
+            song_id, statements.json_list(genres)
+        )
+
     @staticmethod
     async def increase_genre_score_by_song_id(connection: ProxiedConnection, user_id: str, song_id: int,
                                               score_increase: int):
-        genres: list[Row] = await connection.fetchall(
-            """SELECT genre_name FROM genres WHERE song_id = ?""",
-            song_id,
-        )
+        genres: list[Row] = await statements.fetchall(connection, RecommendationAlgorithm.FETCH_SONG_GENRES, song_id)
 
         values = [(user_id, genre[0], score_increase) for genre in genres]
 
-        await connection.executemany(
-            """
-            INSERT INTO favorite_genres (user_id, genre, score)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id, genre) DO UPDATE SET score = score + excluded.score
-            """,
-            values
+        await statements.executemany(connection, RecommendationAlgorithm.INCREASE_GENRE_SCORE, values)
+
+        await RecommendationAlgorithm._increase_candidate_scores(
+            connection=connection,
+            user_id=user_id,
+            genres=[genre[0] for genre in genres],
+            score_increase=score_increase
         )
 
+    @staticmethod
+    async def bulk_increase_genre_scores_by_song_id(connection: ProxiedConnection,
+                                                    score_increases: dict[tuple[str, int], int]):
+        """
+        the batched version of increase_genre_score_by_song_id (see Utils.genre_score_sink).
+
+        :param score_increases: dict[tuple[user ID, song ID] -> score increase]
+        """
+
+        if not score_increases:
+            return
+
+        song_ids = {song_id for _, song_id in score_increases}
+
+        rows: list[Row] = await statements.fetchall(
+            connection, RecommendationAlgorithm.BULK_FETCH_SONG_GENRES,
+            statements.json_list(song_ids)
+        )
+
+        song_genres: dict[int, list[str]] = {}
+        for song_id, genre_name in rows:
+            song_genres.setdefault(song_id, []).append(genre_name)
+
+        # multiple songs of the same genre become a single score increase
+        genre_score_increases: dict[tuple[str, str], int] = {}
+        for (user_id, song_id), score_increase in score_increases.items():
+            for genre_name in song_genres.get(song_id, []):
+                key = (user_id, genre_name)
+                genre_score_increases[key] = genre_score_increases.get(key, 0) + score_increase
+
+        if not genre_score_increases:
+            return
+
+        await statements.executemany(
+            connection, RecommendationAlgorithm.INCREASE_GENRE_SCORE,
+            [(user_id, genre, score_increase) for (user_id, genre), score_increase in genre_score_increases.items()]
+        )
+
+        # the candidate scores are increased once per (user, increase amount), for all the genres with that amount
+        grouped_genres: dict[tuple[str, int], list[str]] = {}
+        for (user_id, genre), score_increase in genre_score_increases.items():
+            grouped_genres.setdefault((user_id, score_increase), []).append(genre)
+
+        for (user_id, score_increase), genres in grouped_genres.items():
+            await RecommendationAlgorithm._increase_candidate_scores(
+                connection=connection,
+                user_id=user_id,
+                genres=genres,
+                score_increase=score_increase
+            )
+
     @staticmethod
     async def increase_genre_score(connection: ProxiedConnection, user_id: str, genre: str, score_increase: int):
-        await connection.execute(
-            """
-            INSERT INTO favorite_genres (user_id, genre, score)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id, genre) DO UPDATE SET score = score + excluded.score
-            """,
-            user_id, genre, score_increase
+        await statements.execute(connection, RecommendationAlgorithm.INCREASE_GENRE_SCORE, user_id, genre, score_increase)
+
+        await RecommendationAlgorithm._increase_candidate_scores(
+            connection=connection,
+            user_id=user_id,
+            genres=[genre],
+            score_increase=score_increase
         )
 
     @staticmethod
     async def fetch_top_genres(connection: ProxiedConnection, user_id: str) -> list[str]:
-        genres = await connection.fetchall(
-            """SELECT genre FROM favorite_genres WHERE user_id = ? ORDER BY score DESC""",
-            user_id,
-        )
+        genres = await statements.fetchall(connection, RecommendationAlgorithm.FETCH_TOP_GENRES, user_id)
 
         top_10_list: list[str] = [genre[0] for genre in genres][:10]
 
         return top_10_list
 
     @staticmethod
-    async def fetch_recommended_songs(connection: ProxiedConnection, user_id: str, exclude: list[int],
-                                      limit: int = 10) -> list[int]:
-        recommended_genres = await RecommendationAlgorithm.fetch_top_genres(connection, user_id)
+    async def _fetch_candidates_page(connection: ProxiedConnection, user_id: str, last_score: int | None,
+                                     last_song_id: int, limit: int) -> list[Row]:
+        if last_score is None:
+            return await statements.fetchall(
+                connection, RecommendationAlgorithm.FETCH_FIRST_CANDIDATES_PAGE,
+                user_id, limit
+            )
 
-        if not recommended_genres:
-            return []
+        return await statements.fetchall(
+            connection, RecommendationAlgorithm.FETCH_CANDIDATES_PAGE,
+            user_id, last_score, last_score, last_song_id, limit
+        )
 
-        placeholders = ",".join("?" for _ in recommended_genres)
+    @staticmethod
+    async def fetch_recommended_songs(connection: ProxiedConnection, user_id: str, cursor: str | None,
+                                      limit: int = 10) -> tuple[list[int], str | None]:
+        """
+        returns the user's recommended songs, the songs that best match the user's favorite genres first.
 
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_id NOT IN ({exclude_placeholders})" if exclude else ""
+        note: scores can change between pages (when the user listens to songs), which means that a song can rarely
+        show up twice, or be skipped, while scrolling.
 
-        query = f"""
-            SELECT song_id FROM genres
-            WHERE genre_name IN ({placeholders}) {exclude_query}
-            LIMIT ?;
+        :returns: tuple[song IDs, the cursor of the next page (None if there are no more pages)]
         """
 
-        song_ids = await connection.fetchall(query, *recommended_genres, *exclude, limit)
+        cursor_values = decode_cursor(cursor, expected_keys=("score", "song_id"))
+
+        last_score, last_song_id = None, -1
+        if cursor_values:
+            last_score, last_song_id = cursor_values["score"], cursor_values["song_id"]
 
-        return list(set([song_id[0] for song_id in song_ids]))
+        rows = await RecommendationAlgorithm._fetch_candidates_page(
+            connection=connection,
+            user_id=user_id,
+            last_score=last_score,
+            last_song_id=last_song_id,
+            limit=limit
+        )
+
+        song_ids = [row[0] for row in rows]
+
+        next_cursor = None
+        if len(rows) == limit:
+            last_song_id, last_score = rows[-1]
+            next_cursor = encode_cursor(score=last_score, song_id=last_song_id)
+
+        return song_ids, next_cursor
 
 
 class Comments:
+    CREATE_COMMENT = statements.register(
+        "comments.create_comment",
+        """
+        INSERT INTO song_comments (comment_text, song_id, uploaded_by, uploaded_at, token_estimate, is_spam) 
+        VALUES (?, ?, ?, ?, ?, ?)
+        """
+    )
+    MARK_SUMMARY_DIRTY = statements.register(
+        "comments.mark_summary_dirty",
+        "UPDATE ai_comment_summary SET is_dirty = 1 WHERE song_id = ?"
+    )
+    FETCH_SONG_COMMENTS = statements.register(
+        "comments.fetch_song_comments",
+        """
+        SELECT 
+            song_comments.comment_id, song_comments.comment_text, song_comments.song_id, 
+            song_comments.uploaded_by, song_comments.uploaded_at, 
+            users.username, users.display_name
+        FROM song_comments
+        JOIN users ON song_comments.uploaded_by = users.user_id
+        WHERE song_comments.song_id = ?
+          AND (song_comments.uploaded_at, song_comments.comment_id) > (?, ?)
+        ORDER BY song_comments.uploaded_at ASC, song_comments.comment_id ASC
+        LIMIT ?
+        """
+    )
+    FETCH_SONG_COMMENTS_SINCE = statements.register(
+        "comments.fetch_song_comments_since",
+        """
+        SELECT 
+            song_comments.comment_id, song_comments.comment_text, song_comments.song_id, 
+            song_comments.uploaded_by, song_comments.uploaded_at, 
+            users.username, users.display_name
+        FROM song_comments
+        JOIN users ON song_comments.uploaded_by = users.user_id
+        WHERE song_comments.song_id = ? AND song_comments.comment_id > ?
+        ORDER BY song_comments.comment_id ASC
+        LIMIT ?
+        """
+    )
+    FETCH_COMMENT = statements.register(
+        "comments.fetch_comment",
+        """
+        SELECT 
+            song_comments.comment_id, song_comments.comment_text, song_comments.song_id, 
+            song_comments.uploaded_by, song_comments.uploaded_at, 
+            users.username, users.display_name
+        FROM song_comments
+        JOIN users ON song_comments.uploaded_by = users.user_id
+        WHERE song_comments.comment_id = ?
+        """
+    )
+    SAVE_AI_SUMMARY = statements.register(
+        "comments.save_ai_summary",
+        """
+        INSERT INTO ai_comment_summary (song_id, summary, last_updated, last_comment_id, is_dirty)
+        VALUES (
+            ?, ?, ?, ?,
+            -- comments that were uploaded while the summary was generated aren't a part of it
+            EXISTS (SELECT 1 FROM song_comments WHERE song_id = ? AND is_spam = 0 AND comment_id > ?)
+        )
+        ON CONFLICT(song_id) DO UPDATE SET
+            summary = excluded.summary,
+            last_updated = excluded.last_updated,
+            last_comment_id = excluded.last_comment_id,
+            is_dirty = excluded.is_dirty
+        """
+    )
+    FETCH_AI_SUMMARY = statements.register(
+        "comments.fetch_ai_summary",
+        "SELECT summary, last_updated, is_dirty FROM ai_comment_summary WHERE song_id = ?"
+    )
+    HAS_SUMMARY_COMMENTS = statements.register(
+        "comments.has_summary_comments",
+        "SELECT EXISTS (SELECT 1 FROM song_comments WHERE song_id = ? AND is_spam = 0)"
+    )
+    FETCH_SUMMARY_WINDOW_PAGE = statements.register(
+        "comments.fetch_summary_window_page",
+        """
+        SELECT comment_id, uploaded_at, comment_text, token_estimate
+        FROM song_comments
+        WHERE song_id = ? AND is_spam = 0 AND (uploaded_at, comment_id) < (?, ?)
+        ORDER BY uploaded_at DESC, comment_id DESC
+        LIMIT ?
+        """
+    )
+    FETCH_SONG_NAME = statements.register(
+        "comments.fetch_song_name",
+        "SELECT song_name FROM song_info WHERE song_id = ?"
+    )
+    FETCH_USER_COMMENT = statements.register(
+        "comments.fetch_user_comment",
+        "SELECT * FROM song_comments WHERE comment_id = ? AND uploaded_by = ?"
+    )
+    DELETE_COMMENT = statements.register(
+        "comments.delete_comment",
+        "DELETE FROM song_comments WHERE comment_id = ? RETURNING uploaded_by, song_id, is_spam"
+    )
+
     @staticmethod
-    async def upload_comment(connection: ProxiedConnection, text: str, uploaded_by: str, song_id: int):
+    async def upload_comment(connection: ProxiedConnection, text: str, uploaded_by: str, song_id: int) -> int:
+        """:returns: the comment_id of the new comment"""
         current_time = int(time.time())
 
-        await connection.execute(
-            """INSERT INTO song_comments (comment_text, song_id, uploaded_by, uploaded_at) VALUES (?, ?, ?, ?)""",
-            text, song_id, uploaded_by, current_time
+        # the summary's values are calculated once here, instead of on every summary
+        is_spam = is_spam_comment(text)
+
+        cursor = await statements.execute(
+            connection, Comments.CREATE_COMMENT,
+            text, song_id, uploaded_by, current_time, hybrid_token_estimate(text), is_spam
         )
 
+        await UserStats.change_comments(connection=connection, user_id=uploaded_by, amount=1)
+
+        if not is_spam:
+            await statements.execute(connection, Comments.MARK_SUMMARY_DIRTY, song_id)
+
+        return cursor.get_cursor().lastrowid
+
+    @staticmethod
+    def _comment_to_dict(comment: Row) -> dict[str, int | str]:
+        return {
+            "comment_id": comment[0],
+            "text": comment[1],
+            "uploaded_at": comment[4],
+            "uploaded_by": comment[-2],
+            "uploaded_by_display": comment[-1],
+        }
+
+    @staticmethod
+    def _create_comments_cursor(comments: list[dict[str, int | str]], cursor: str | None) -> str | None:
+        """:returns: the cursor after the last comment, or the given cursor if there are no comments"""
+        if not comments:
+            return cursor
+
+        last_comment = comments[-1]
+
+        return encode_cursor(uploaded_at=last_comment["uploaded_at"], comment_id=last_comment["comment_id"])
+
+    @staticmethod
+    async def fetch_comment(connection: ProxiedConnection, comment_id: int) -> dict[str, int | str] | None:
+        comment = await statements.fetchone(connection, Comments.FETCH_COMMENT, comment_id)
+
+        if not comment:
+            return None
+
+        return Comments._comment_to_dict(comment)
+
     @staticmethod
-    async def fetch_song_comments(connection: ProxiedConnection, song_id: int, exclude: list[int], limit: int = 100):
-        exclude_placeholders = ", ".join(["?"] * len(exclude))
-        exclude_query = f"AND song_comments.comment_id NOT IN ({exclude_placeholders})" if exclude else ""
+    async def fetch_song_comments_since(connection: ProxiedConnection, song_id: int, since_comment_id: int,
+                                        limit: int = 100) -> tuple[list[dict[str, int | str]], str | None]:
+        """
+        the delta of a song's comments, for clients that already have the comments up to since_comment_id (comment IDs
+        only grow, so every newer comment has a bigger ID)
 
-        query = f"""
-            SELECT song_comments.*, users.username, users.display_name
-            FROM song_comments
-            JOIN users ON song_comments.uploaded_by = users.user_id
-            WHERE song_comments.song_id = ?
-            {exclude_query}
-            ORDER BY song_comments.uploaded_at ASC
-            LIMIT ?
+        :returns: tuple[the comments after since_comment_id, the cursor after the last comment (see
+        fetch_song_comments)]
         """
 
-        comments = await connection.fetchall(query, song_id, *exclude, limit)
+        comments = await statements.fetchall(
+            connection, Comments.FETCH_SONG_COMMENTS_SINCE,
+            song_id, since_comment_id, limit
+        )
 
-        comments_dict = [
-            {
-                "comment_id": comment[0],
-                "text": comment[1],
-                "uploaded_at": comment[4],
-                "uploaded_by": comment[-2],
-                "uploaded_by_display": comment[-1],
-            } for comment in comments
-        ]
+        comments_dict = [Comments._comment_to_dict(comment) for comment in comments]
+
+        return comments_dict, Comments._create_comments_cursor(comments_dict, cursor=None)
+
+    @staticmethod
+    async def fetch_song_comments(connection: ProxiedConnection, song_id: int, cursor: str | None,
+                                  limit: int = 100) -> tuple[list[dict[str, int | str]], str]:
+        """
+        :returns: tuple[comments, the cursor of the next page]. since comments are only ever added after the last
+        comment, the cursor is always returned (even on the last page) so that it can be used to fetch newer comments.
+        """
+
+        cursor_values = decode_cursor(cursor, expected_keys=("uploaded_at", "comment_id"))
+
+        last_uploaded_at, last_comment_id = -1, -1
+        if cursor_values:
+            last_uploaded_at, last_comment_id = cursor_values["uploaded_at"], cursor_values["comment_id"]
+
+        comments = await statements.fetchall(
+            connection, Comments.FETCH_SONG_COMMENTS,
+            song_id, last_uploaded_at, last_comment_id, limit
+        )
+
+        comments_dict = [Comments._comment_to_dict(comment) for comment in comments]
 
-        return comments_dict
+        return comments_dict, Comments._create_comments_cursor(comments_dict, cursor=cursor)
+
+    @staticmethod
+    async def save_ai_summary(connection: ProxiedConnection, song_id: int, summary: str, last_updated: int,
+                              last_comment_id: int):
+        """
+        :param last_comment_id: the newest comment that the summary includes (see fetch_comments_for_summary)
+        """
+        await statements.execute(
+            connection, Comments.SAVE_AI_SUMMARY,
+            song_id, summary, last_updated, last_comment_id,
+            song_id, last_comment_id
+        )
 
     @staticmethod
-    async def fetch_ai_summary(connection: ProxiedConnection, song_id: int) -> str:
+    async def fetch_ai_summary(connection: ProxiedConnection, song_id: int,
+                               min_refresh_interval: int = 3600) -> tuple[str | None, bool]:
+        """
+        :param min_refresh_interval: how long (in seconds) a summary is kept before it can be regenerated
+        :returns: tuple[the saved summary (None if the song has no summary yet), whether the summary should be
+        regenerated]. a summary is only regenerated if the song got new comments since it was generated. summaries are
+        generated in the background (see Utils.comment_summarizer)
+        """
         current_time = int(time.time())
 
-        try:
-            summary = await connection.fetchone(
-                """
-                SELECT summary, last_updated FROM ai_comment_summary WHERE song_id = ?
-                """,
-                song_id
-            )
+        summary = await statements.fetchone(connection, Comments.FETCH_AI_SUMMARY, song_id)
 
-            one_hour = 3600
-            if not summary or (summary and summary["last_updated"] + one_hour < current_time):
-                comments = await connection.fetchall(
-                    """
-                    SELECT comment_text, comment_id, uploaded_at, uploaded_by
-                    FROM song_comments
-                    WHERE song_id = ?
-                    ORDER BY uploaded_at ASC
-                    """,
-                    song_id
-                )
+        if not summary:
+            has_comments = await statements.fetchone(connection, Comments.HAS_SUMMARY_COMMENTS, song_id)
 
-                total_token_approximation = 0
-                allowed_token_approximation = 1000
+            return None, bool(has_comments[0])
 
-                comments_for_summary: list[str] = []
+        should_refresh = bool(summary["is_dirty"]) and summary["last_updated"] + min_refresh_interval < current_time
 
-                for comment in comments:
-                    comment_text: str = comment[0]
+        return summary["summary"], should_refresh
 
-                    # we dont care for whitespace comments
-                    if not comment_text:
-                        continue
+    @staticmethod
+    async def fetch_comments_for_summary(connection: ProxiedConnection, song_id: int,
+                                         allowed_token_approximation: int = 1000,
+                                         page_size: int = 50) -> tuple[str | None, list[str], int]:
+        """
+        the summary is made of the song's newest comments that aren't spam, up to allowed_token_approximation tokens.
+        the comments are read newest first, a page at a time, so only the comments that fit are read (the spam flags and
+        token estimates were saved when the comments were uploaded).
 
-                    # in order to prevent spam comments (like, gibberish), we add an approximation feature to detect
-                    # common spam structures (few words with a lot of total length)
-                    if len(comment_text.split()) <= 3 and len(comment_text) > 25:
-                        continue
+        :param allowed_token_approximation: the maximum amount of (approximated) tokens of all the comments together
+        :returns: tuple[the song's name (None if the song doesn't exist), the comments to summarize (oldest first),
+        the ID of the newest comment that was included (0 if there are none)]
+        """
 
-                    # on average, sentences will have an average of 5 letters per word, so we add a bit of leeway. but this
-                    # with combination of the first statement should be a good way to remove most spam comments
-                    if len(comment_text) / len(comment_text.split()) > 9:
-                        continue
+        song_name = await statements.fetchone(connection, Comments.FETCH_SONG_NAME, song_id)
 
-                    total_token_approximation += hybrid_token_estimate(comment_text)
+        if not song_name:
+            return None, [], 0
 
-                    if total_token_approximation >= allowed_token_approximation:
-                        break
+        total_token_approximation = 0
 
-                    comments_for_summary.append(comment_text)
+        comments_for_summary: list[str] = []
+        last_comment_id = 0
 
-                if not comments_for_summary:
-                    return "Not enough comments for AI summary"
+        # the comments before which the next page starts, the first page starts from the newest comment
+        before_uploaded_at, before_comment_id = 2 ** 63 - 1, 2 ** 63 - 1
 
-                song_name = await connection.fetchone(
-                    """SELECT song_name FROM song_info WHERE song_id = ?""",
-                    song_id
-                )
+        is_window_full = False
+        while not is_window_full:
+            comments = await statements.fetchall(
+                connection, Comments.FETCH_SUMMARY_WINDOW_PAGE,
+                song_id, before_uploaded_at, before_comment_id, page_size
+            )
 
-                song_name = song_name[0]
+            for comment_id, uploaded_at, comment_text, token_estimate in comments:
+                total_token_approximation += token_estimate
 
-                comment_summary = await summarize(comments_for_summary, song_name=song_name)
+                if total_token_approximation >= allowed_token_approximation:
+                    is_window_full = True
+                    break
 
-                await connection.execute(
-                    """
-                    INSERT INTO ai_comment_summary (song_id, summary, last_updated)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(song_id) DO UPDATE SET
-                        summary = excluded.summary,
-                        last_updated = excluded.last_updated
-                    """,
-                    song_id, comment_summary, current_time
-                )
+                comments_for_summary.append(comment_text)
+                last_comment_id = max(last_comment_id, comment_id)
 
-                return comment_summary
-            else:
-                return summary[0]
-        except Exception as e:
-            print(e)
+            if len(comments) < page_size:
+                break
 
-    @staticmethod
-    async def fetch_user_comment_count(connection: ProxiedConnection, user_id: str) -> int:
-        comment_amount = await connection.fetchone(
-            """SELECT COUNT(*) FROM song_comments WHERE uploaded_by = ?""",
-            user_id
-        )
+            before_uploaded_at, before_comment_id = comments[-1][1], comments[-1][0]
 
-        return comment_amount[0]
+        # the comments are shown to the model in the order they were written
+        comments_for_summary.reverse()
+
+        return song_name[0], comments_for_summary, last_comment_id
 
     @staticmethod
     async def does_user_own_comment(connection: ProxiedConnection, user_id: str, comment_id: int) -> bool:
-        comment = await connection.fetchone(
-            """SELECT * FROM song_comments WHERE comment_id = ? AND uploaded_by = ?""",
-            comment_id, user_id
-        )
+        comment = await statements.fetchone(connection, Comments.FETCH_USER_COMMENT, comment_id, user_id)
 
         if comment:
             return True
@@ -1015,7 +1733,11 @@ class Comments:
 
     @staticmethod
     async def delete_comment(connection: ProxiedConnection, comment_id: int):
-        await connection.execute(
-            """DELETE FROM song_comments WHERE comment_id = ?""",
-            comment_id
-        )
+        deleted_comments = await statements.fetchall(connection, Comments.DELETE_COMMENT, comment_id)
+
+        for uploaded_by, song_id, is_spam in deleted_comments:
+            await UserStats.change_comments(connection=connection, user_id=uploaded_by, amount=-1)
+
+            # the deleted comment may have been a part of the summary
+            if not is_spam:
+                await statements.execute(connection, Comments.MARK_SUMMARY_DIRTY, song_id)
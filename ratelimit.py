@@ -1,5 +1,7 @@
 import time
 
+from Caches.shared_state import SharedStateStore
+
 rate_limit_threshold: dict[str, tuple[int, int]] = {
     "song/download/preview": (3, 1),
     "song/recommended/download/preview": (3, 1),
@@ -14,6 +16,7 @@ rate_limit_threshold: dict[str, tuple[int, int]] = {
 
     "song/comments": (10, 1),
     "song/comments/upload": (5, 2),
+    "song/comments/unsubscribe": (10, 1),
 
     "song/search": (100, 3),
 
@@ -35,6 +38,18 @@ class RateLimits:
         dict[tuple[user ID, endpoint] -> list[endpoint requested at timestamps]
         """
 
+        # when the server runs as multiple workers, the requests are counted in the shared store instead (otherwise
+        # every worker would allow the full rate limit)
+        self._shared_store: SharedStateStore | None = None
+
+    def use_shared_store(self, shared_store: SharedStateStore):
+        self._shared_store = shared_store
+
+    @property
+    def is_shared(self) -> bool:
+        """whether the requests are counted in the shared store, which is checked by has_reached_shared_threshold"""
+        return self._shared_store is not None
+
     def _calculate_threshold_limit(self, user_id: str, endpoint: str, how_many_requests: int, time_window_seconds: int) -> bool:
         """calculates if the user reached the rate limit threshold"""
         current_time = time.time()
@@ -68,6 +83,7 @@ class RateLimits:
         return False
 
     def has_reached_threshold(self, user_id: str, endpoint: str) -> bool:
+        """the rate limit of this process only (see has_reached_shared_threshold for the workers' shared rate limit)"""
         threshold_requests, threshold_seconds = rate_limit_threshold.get(endpoint, (None, None))
 
         if not threshold_requests or not threshold_seconds:
@@ -76,3 +92,17 @@ class RateLimits:
         return self._calculate_threshold_limit(
             user_id, endpoint, threshold_requests, threshold_seconds
         )
+
+    async def has_reached_shared_threshold(self, user_id: str, endpoint: str) -> bool:
+        """
+        the rate limit of every worker together. the shared store's write transaction can wait for another worker's, so
+        it is awaited (the store runs it in its own thread) instead of being checked in data_received
+        """
+        threshold_requests, threshold_seconds = rate_limit_threshold.get(endpoint, (None, None))
+
+        if not threshold_requests or not threshold_seconds:
+            return False
+
+        return await self._shared_store.has_reached_rate_limit(
+            user_id, endpoint, threshold_requests, threshold_seconds
+        )
@@ -13,6 +13,9 @@ from hashlib import sha256
 load_dotenv("secrets.env")
 PEPPER: str = os.getenv("PEPPER")
 
+# the (comma separated) user IDs that are allowed to use the admin endpoints, e.g. admin/profiler
+ADMIN_USER_IDS: set[str] = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
 
 def generate_salt(salt_length: int = 16) -> bytes:
     return secrets.token_bytes(salt_length)
@@ -1,10 +1,17 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
 import traceback
 
-import asqlite
 
 import ratelimit
 from Caches.user_cache import UserCache, UserCacheItem
 from Caches.client_cache import Address, ClientPackage
+from Caches.comment_subscriptions import comment_subscriptions
+from Caches.shared_state import SharedStateStore
 
 from ratelimit import RateLimits
 
@@ -17,6 +24,7 @@ from Errors.raised_errors import (
 
 import asyncio
 from asyncio import transports, Task
+from typing import Coroutine
 
 from AES_128 import cbc
 from encryptions import EncryptedTransport
@@ -24,11 +32,23 @@ from DHE.dhe import DHE, generate_initial_dhe
 
 from FileSystem.base_file_system import System, BaseFile
 
-from initiate_database import CreateTables
-from Utils.sqlite3_ext import create_connection_pool
+from initiate_database import DatabaseMigrations
+from Utils.sqlite3_ext import create_connection_pool, DatabasePool
+from Utils.genre_score_sink import genre_score_sink
+from Utils.comment_summarizer import comment_summary_refresher
+from Utils.connection_lifecycle import connection_lifecycle
+from Utils.metrics import server_metrics
+from Utils.stall_detector import loop_stall_detector
+from Utils.sampling_profiler import sampling_profiler
+from Utils.tracing import tracer, span, Trace
+from Utils.structured_logging import get_logger, log_queue, parse_category_levels
+from queries import statements, catalog_caches
 
 from RSASigning.private import sign_sync
 
+log = get_logger("actions")
+supervisor_log = get_logger("supervisor")
+
 # The IP and PORT of the server.
 IP = "127.0.0.1"
 PORT = 5555
@@ -44,7 +64,7 @@ RATE_LIMITS = RateLimits()
 
 # note that read/write using asyncio's protocol adds its own buffer, so we don't need to manually add one.
 class ServerProtocol(asyncio.Protocol):
-    def __init__(self, database_pool: asqlite.Pool):
+    def __init__(self, database_pool: DatabasePool):
         self.db_pool = database_pool
 
         self.client_package: ClientPackage | None = None
@@ -90,7 +110,7 @@ class ServerProtocol(asyncio.Protocol):
             }
         )
 
-        transport = EncryptedTransport(transport, iv=aes_iv)
+        transport = EncryptedTransport(transport, iv=aes_iv, on_write=server_metrics.add_bytes_sent)
 
         transport.write(dhe_key_exchange_message.encode())
 
@@ -114,12 +134,53 @@ class ServerProtocol(asyncio.Protocol):
         if not self.client_package:
             self.client_package = client_information
 
+        connection_lifecycle.connection_made(self.client_package)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if not self.client_package:
+            return
+
+        # cancels the client's running actions and removes everything the server kept for it (see
+        # Utils.connection_lifecycle)
+        connection_lifecycle.connection_lost(self.client_package.address)
+
     def data_received(self, data: bytes) -> None:
+        # any data (even a partial message) means that the client is still there
+        connection_lifecycle.activity(self.client_package.address)
+        server_metrics.add_bytes_received(len(data))
+
+        # the request's trace (if it is traced) is the current trace while the request is handled, so that the server
+        # action's task carries it (see Utils.tracing)
+        trace = tracer.start_trace()
+        trace_token = tracer.enter_trace(trace)
+
+        try:
+            action = self._handle_data(data, trace)
+        finally:
+            tracer.exit_trace(trace_token)
+
+        self._attach_trace(action, trace)
+
+    @staticmethod
+    def _attach_trace(action: Task | None, trace: Trace | None):
+        if action is not None:
+            action.trace = trace
+        elif trace is not None and trace.endpoint is not None:
+            # the request was answered with an error before it reached its server action
+            tracer.finish_trace(trace, status="rejected")
+
+    def _handle_data(self, data: bytes, trace: Trace | None) -> Task | None:
+        """
+        :returns: the task of the requested server action, if the request reached it (and None if the request is still
+        waiting for its session to be looked up, see _resume_session_and_dispatch)
+        """
+
         # decrypts the data
-        data = self.client_package.client.read(data)
+        with span("transport.read", bytes=len(data)):
+            data = self.client_package.client.read(data)
 
         if not data:
-            return
+            return None
 
         try:
             client_message = ClientMessage.from_bytes(data)
@@ -128,9 +189,37 @@ class ServerProtocol(asyncio.Protocol):
                 InvalidMessage("invalid message bytes data sent"),
                 endpoint="errors"
             )
-            return
+            return None
+
+        # the session might have been created on another worker. it is looked up in the shared store (which waits for
+        # another thread, see Caches.shared_state) before the message is handled
+        if self.user_cache.needs_session_lookup(self.client_package.address, client_message.authentication):
+            session_lookup = self.event_loop.create_task(self._resume_session_and_dispatch(client_message, trace))
+
+            connection_lifecycle.track_task(self.client_package.address, session_lookup)
+
+            return None
+
+        return self._dispatch(client_message, trace)
+
+    async def _resume_session_and_dispatch(self, client_message: ClientMessage, trace: Trace | None):
+        try:
+            await self.user_cache.resume_session(self.client_package.address, client_message.authentication)
+        except asyncio.CancelledError:
+            tracer.finish_trace(trace, status="cancelled")
+            raise
+
+        # the task was created inside of the request's trace, so the action's task is created inside of it as well
+        self._attach_trace(self._dispatch(client_message, trace), trace)
+
+    def _dispatch(self, client_message: ClientMessage, trace: Trace | None) -> Task | None:
+        """:returns: the task of the requested server action, if the request reached it"""
 
         requested_endpoint = client_message.endpoint
+
+        if trace:
+            trace.endpoint = requested_endpoint
+
         given_method = client_message.method
         client_session_token = client_message.authentication
 
@@ -139,6 +228,7 @@ class ServerProtocol(asyncio.Protocol):
                 Forbidden("Invalid session token passed"),
                 endpoint=requested_endpoint
             )
+            return None
 
         user_data = self.user_cache[self.client_package.address]
 
@@ -147,14 +237,17 @@ class ServerProtocol(asyncio.Protocol):
                 NotFound(f"user not found"),
                 endpoint=requested_endpoint
             )
+            return None
 
-        if requested_endpoint in ratelimit.rate_limit_threshold:
+        # the workers' shared rate limit is checked in the action's task instead (see _check_shared_rate_limit)
+        if requested_endpoint in ratelimit.rate_limit_threshold and not RATE_LIMITS.is_shared:
             user_id = user_data.user_id
             if RATE_LIMITS.has_reached_threshold(user_id, requested_endpoint):
                 self._send_error(
                     RateLimitReached(f"you have reached the rate limit threshold for {requested_endpoint}"),
                     endpoint=requested_endpoint
                 )
+                return None
 
         if EndPoint(endpoint=requested_endpoint, method=given_method,
                     authentication=client_session_token) in self.endpoints:
@@ -163,21 +256,58 @@ class ServerProtocol(asyncio.Protocol):
             # server function actions are specifically tied to endpoints that a client asks for. Functions that are not
             # directly related to an endpoint will not be inside the action list.
 
-            action = self.event_loop.create_task(
-                server_action_function(
-                    self.db_pool,
-                    self.client_package,
-                    client_message,
-                    self.user_cache
-                )
+            server_metrics.action_started(requested_endpoint)
+
+            action_coroutine = server_action_function(
+                self.db_pool,
+                self.client_package,
+                client_message,
+                self.user_cache
             )
+
+            if requested_endpoint in ratelimit.rate_limit_threshold and RATE_LIMITS.is_shared:
+                action_coroutine = self._check_shared_rate_limit(
+                    action_coroutine, user_data.user_id, requested_endpoint
+                )
+
+            action = self.event_loop.create_task(action_coroutine)
             action.add_done_callback(self.on_complete)
             action.end_point = requested_endpoint
-        else:
-            self._send_error(
-                NotFound(f"Requested endpoint ({given_method.upper()} {requested_endpoint}) not found"),
-                endpoint=requested_endpoint
-            )
+            action.started_at = time.perf_counter()
+
+            # the action is cancelled if the client disconnects before it finishes
+            connection_lifecycle.track_task(self.client_package.address, action)
+
+            return action
+
+        self._send_error(
+            NotFound(f"Requested endpoint ({given_method.upper()} {requested_endpoint}) not found"),
+            endpoint=requested_endpoint
+        )
+
+        return None
+
+    @staticmethod
+    async def _check_shared_rate_limit(action_coroutine: Coroutine, user_id: str, endpoint: str):
+        """
+        runs the server action only if the user didn't reach the endpoint's rate limit. the workers' shared rate limit
+        can't be checked in data_received, since it waits for the shared store (see Caches.shared_state). the
+        RateLimitReached error is sent to the client by on_complete, like any other error of the action
+        """
+
+        try:
+            has_reached_rate_limit = await RATE_LIMITS.has_reached_shared_threshold(user_id, endpoint)
+        except BaseException:
+            # the action never started (e.g. the client disconnected), closing it avoids the "coroutine was never
+            # awaited" warning
+            action_coroutine.close()
+            raise
+
+        if has_reached_rate_limit:
+            action_coroutine.close()
+            raise RateLimitReached(f"you have reached the rate limit threshold for {endpoint}")
+
+        return await action_coroutine
 
     def _send_error(self, error: BaseException, endpoint: str):
         # if the error is not a custom error, then it is assumed that it is an internal server error.
@@ -193,6 +323,8 @@ class ServerProtocol(asyncio.Protocol):
         if hasattr(error, "extra"):
             extra = error.extra
 
+        server_metrics.count_response(self._metric_endpoint(endpoint), error_code)
+
         transport = self.client_package.client
 
         transport.write(
@@ -214,27 +346,92 @@ class ServerProtocol(asyncio.Protocol):
 
             Any error handling related to errors thrown inside of server actions should be done here.
         """
+        server_metrics.action_finished(action.end_point, time.perf_counter() - action.started_at)
+
+        # the action was cancelled because the client disconnected, so there is no one to send the error to
+        if action.cancelled():
+            server_metrics.count_response(action.end_point, "cancelled")
+            tracer.finish_trace(action.trace, status="cancelled")
+            return
+
         if action.exception():
             # raise action.exception()
             error = action.exception()
 
-            self._send_error(error, endpoint=action.end_point)
-        else:
-            print(f"Task completed successfully with result: {action.result()}")
-
+            tracer.finish_trace(action.trace, status=getattr(error, "code", 500))
 
-async def main() -> None:
-    """Hosts a server to communicate with a client through sending and receiving string data."""
+            # errors that aren't custom errors are bugs (the client only gets "an internal server error occurred")
+            if not hasattr(error, "code"):
+                log.error("server action failed", exc_info=error, endpoint=action.end_point)
 
-    database_name = "database.db"
+            self._send_error(error, endpoint=action.end_point)
+        else:
+            tracer.finish_trace(action.trace, status=200)
+
+            server_metrics.count_response(action.end_point, 200)
+            log.debug(
+                "server action completed",
+                endpoint=action.end_point,
+                duration_ms=round((time.perf_counter() - action.started_at) * 1000, 3),
+                result=action.result()
+            )
 
-    # create all the tables in the database (this is not an async action, so it should only be used once)
-    CreateTables(database_name).init()
+    def _metric_endpoint(self, endpoint: str) -> str:
+        # the endpoint comes from the client, so unknown endpoints are counted together (instead of creating a metric
+        # for every made up endpoint)
+        return endpoint if endpoint in self.endpoints.endpoints else "unknown"
+
+
+async def main(database_name: str = "database.db", port: int = PORT, storage_directory: str = "SavedFiles",
+               shared_state_path: str | None = None, metrics_port: int | None = None,
+               metrics_path: str | None = None, stall_threshold: float | None = None, trace_path: str | None = None,
+               trace_sample_rate: float = 0.01, trace_slower_than: float | None = None, log_level: str = "INFO",
+               log_category_levels: dict[str, str] | None = None, log_path: str | None = None,
+               log_as_json: bool = False) -> None:
+    """
+    Hosts a server to communicate with a client through sending and receiving string data.
+
+    :param database_name: the path of the server's database
+    :param port: the port the server listens on
+    :param storage_directory: the directory that the uploaded files are saved under
+    :param shared_state_path: only given to the supervisor's workers (see supervise), the path of the store that the
+    workers share their sessions, rate limits and catalog version through
+    :param metrics_port: a local-only port to export the metrics on, in the prometheus format (see Utils.metrics)
+    :param metrics_path: a file to write the metrics to every few seconds, in the prometheus format
+    :param stall_threshold: if given, reports the code that blocks the event loop for longer than this (in seconds), see
+    Utils.stall_detector
+    :param trace_path: if given, the traces of the sampled (and the slow) requests are appended to this JSONL file, see
+    Utils.tracing
+    :param trace_sample_rate: the fraction of the requests that are traced
+    :param trace_slower_than: if given, every request is traced, and the ones that took longer than this (in seconds) are
+    written as well
+    :param log_level: the level of the logs (see Utils.structured_logging)
+    :param log_category_levels: dict[category -> its level], e.g. {"upload": "DEBUG"}
+    :param log_path: a file to append the logs to (they are written to stdout if not given)
+    :param log_as_json: write every log record as a JSON object
+    """
+
+    # the logs are written by a background thread, so that a slow terminal or pipe doesn't block the event loop
+    log_queue.start(level=log_level, category_levels=log_category_levels, path=log_path, as_json=log_as_json)
+
+    is_worker = shared_state_path is not None
+
+    if is_worker:
+        shared_state = SharedStateStore(shared_state_path)
+
+        cached_authorization.use_shared_store(shared_state)
+        RATE_LIMITS.use_shared_store(shared_state)
+        catalog_caches.use_shared_store(shared_state)
+    else:
+        # create the tables, or bring an existing database's schema up to date (this is not an async action, so it
+        # should only be used once). the workers' database was already migrated by the supervisor
+        DatabaseMigrations(database_name).migrate()
 
     # creating an async database pool for all server-side database interactions. A db pool helps avoid race
     # conditions in async code.
     database_pool = await create_connection_pool(database_name)
 
+    System.default_main_directory = storage_directory
     file_system = System(db_pool=database_pool)
 
     # create the directory (check doc-string for more info)
@@ -247,14 +444,353 @@ async def main() -> None:
     def protocol_factory():
         return ServerProtocol(database_pool)
 
+    # everything the server keeps per client is removed once the client disconnects
+    connection_lifecycle.add_disconnect_handler(cached_authorization.remove)
+    connection_lifecycle.add_disconnect_handler(comment_subscriptions.unsubscribe_all)
+    connection_lifecycle.add_disconnect_handler(server_endpoints.upload_song_cache.release_client_uploads)
+
+    # the "leaked" gauges count state whose client is no longer connected, they should stay at 0 (other than while a
+    # disconnected client is being torn down)
+    connection_lifecycle.add_gauge("user_cache_entries", lambda: len(cached_authorization))
+    connection_lifecycle.add_gauge(
+        "leaked_user_cache_entries",
+        lambda: cached_authorization.count_disconnected(connection_lifecycle.addresses())
+    )
+    connection_lifecycle.add_gauge(
+        "upload_requests",
+        lambda: len(server_endpoints.upload_song_cache.song_information)
+    )
+    connection_lifecycle.add_gauge(
+        "leaked_upload_requests",
+        lambda: server_endpoints.upload_song_cache.count_leaked_requests(connection_lifecycle.addresses())
+    )
+    connection_lifecycle.add_gauge("comment_subscribed_songs", lambda: len(comment_subscriptions))
+    connection_lifecycle.add_gauge(
+        "leaked_comment_subscribers",
+        lambda: comment_subscriptions.count_disconnected(connection_lifecycle.addresses())
+    )
+
+    # every server action is timed and counted (see ServerProtocol.on_complete), and these are exported along with them
+    server_metrics.add_gauges("server_connections", connection_lifecycle.gauges)
+    server_metrics.add_gauges("server_database_writer", database_pool.writer_queue_metrics)
+    server_metrics.add_gauges("server_genre_score_sink", lambda: {"pending": len(genre_score_sink)})
+    server_metrics.add_gauges("server_log_records", log_queue.gauges)
+    server_metrics.add_labeled_metric(
+        "server_statement_calls_total", "counter", "statement",
+        lambda: {name: statistics["calls"] for name, statistics in statements.statistics().items()}
+    )
+    server_metrics.add_labeled_metric(
+        "server_statement_seconds_total", "counter", "statement",
+        lambda: {name: statistics["total_time"] for name, statistics in statements.statistics().items()}
+    )
+
+    # with SO_REUSEPORT every worker listens on the same port, and the kernel spreads the new connections between them
     server = await event_loop.create_server(
         protocol_factory,
         host=IP,
-        port=PORT,
+        port=port,
+        reuse_port=is_worker
     )
 
-    async with server:
-        await server.serve_forever()
+    # listening events are written to the database in batches (see Utils.genre_score_sink)
+    genre_score_sink.start(database_pool)
+
+    # AI comment summaries are generated in the background (see Utils.comment_summarizer)
+    comment_summary_refresher.start(database_pool)
+
+    # idle clients are sent heartbeats, and disconnected if they don't answer them
+    connection_lifecycle.start()
+
+    # finds the code that blocks the event loop, which delays every client while it runs
+    if stall_threshold is not None:
+        loop_stall_detector.threshold = stall_threshold
+        loop_stall_detector.start()
+
+        server_metrics.add_gauges("server_event_loop", loop_stall_detector.gauges)
+
+    await server_metrics.start(port=metrics_port, dump_path=metrics_path)
+
+    # the per-request traces, with a span for every database, disk, subprocess and socket operation
+    if trace_path:
+        tracer.configure(trace_path, sample_rate=trace_sample_rate, slower_than=trace_slower_than)
+
+    # the supervisor stops its workers with SIGTERM, cancelling main still runs the cleanup below
+    if is_worker:
+        event_loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    # kill -USR2 <pid> starts the sampling profiler, and sending it again stops it and writes the profile (see
+    # Utils.sampling_profiler). admins can do the same through admin/profiler
+    if hasattr(signal, "SIGUSR2"):
+        event_loop.add_signal_handler(signal.SIGUSR2, sampling_profiler.toggle)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # writes the listening events that were not flushed yet
+        await genre_score_sink.stop()
+        await comment_summary_refresher.stop()
+        await connection_lifecycle.stop()
+        await server_metrics.stop()
+
+        if stall_threshold is not None:
+            await loop_stall_detector.stop()
+
+        # a profile that is running when the server stops is still written
+        if sampling_profiler.is_running:
+            await asyncio.to_thread(sampling_profiler.stop)
+
+        # writes the traces that are still pending
+        await asyncio.to_thread(tracer.close)
+
+        # the last records (e.g. the errors of the cleanup above) are written before the process exits
+        await asyncio.to_thread(log_queue.stop)
+
+
+def run_worker(database_name: str, port: int, storage_directory: str, shared_state_path: str,
+               metrics_port: int | None = None, metrics_path: str | None = None, stall_threshold: float | None = None,
+               trace_path: str | None = None, trace_sample_rate: float = 0.01, trace_slower_than: float | None = None,
+               log_level: str = "INFO", log_category_levels: dict[str, str] | None = None, log_path: str | None = None,
+               log_as_json: bool = False):
+    """the entry point of the supervisor's worker processes"""
+
+    # ctrl+c only stops the supervisor, which then stops every worker with SIGTERM (so that a worker isn't interrupted
+    # again while it is cleaning up)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # the worker writes its own logs (main starts its log queue)
+    log_queue.reset_after_fork()
+
+    try:
+        asyncio.run(
+            main(
+                database_name=database_name,
+                port=port,
+                storage_directory=storage_directory,
+                shared_state_path=shared_state_path,
+                metrics_port=metrics_port,
+                metrics_path=metrics_path,
+                stall_threshold=stall_threshold,
+                trace_path=trace_path,
+                trace_sample_rate=trace_sample_rate,
+                trace_slower_than=trace_slower_than,
+                log_level=log_level,
+                log_category_levels=log_category_levels,
+                log_path=log_path,
+                log_as_json=log_as_json
+            )
+        )
+    except asyncio.CancelledError:
+        # the server already stopped (and flushed its state) when main was cancelled
+        pass
+
+
+def _worker_path(path: str | None, worker_number: int) -> str | None:
+    """:returns: the path with _<worker number> added before the extension, so that every worker writes its own file"""
+
+    if not path:
+        return None
+
+    path_stem, extension = os.path.splitext(path)
+
+    return f"{path_stem}_{worker_number}{extension}"
+
+
+def supervise(workers: int, database_name: str = "database.db", port: int = PORT,
+              storage_directory: str = "SavedFiles", metrics_port: int | None = None, metrics_path: str | None = None,
+              stall_threshold: float | None = None, trace_path: str | None = None, trace_sample_rate: float = 0.01,
+              trace_slower_than: float | None = None, log_level: str = "INFO",
+              log_category_levels: dict[str, str] | None = None, log_path: str | None = None, log_as_json: bool = False):
+    """
+    runs the server as multiple worker processes that all listen on the same port (using SO_REUSEPORT), so that the
+    encryption and serialization work of the clients is spread over multiple cores instead of one.
+
+    a client's connection (and everything kept for it, like its encryption keys and uploads) stays on one worker, only
+    the sessions and rate limits are shared (see Caches.shared_state), and the search caches are invalidated on every
+    worker when a song is added or deleted (see Caches.catalog_caches). workers that crash are restarted.
+
+    every worker has its own write connection (see Utils.sqlite3_ext.DatabasePool), so writes are only serialized
+    within a worker, the workers wait for each other's write transactions through sqlite's lock.
+
+    note that new comments are only pushed to the subscribed clients that are connected to the same worker as the
+    uploader, the other clients get them the next time they open the comments (see GUI.Controls.song_view.CommentView,
+    which requests the comments since the newest one it shows).
+
+    every worker exports its own metrics: worker N uses metrics_port + N, and writes to metrics_path with _N added
+    before the extension. the same goes for the traces and the logs, worker N appends them to trace_path and log_path
+    with _N added.
+
+    platforms: the workers need SO_REUSEPORT and the "fork" start method, so this only runs on linux (which ships with
+    Sqlite3Extensions/spellfix.so) and on macOS (after building Sqlite3Extensions/spellfix.dylib, see
+    Sqlite3Extensions/README.md). on windows, the server can only run as a single process.
+    """
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("running multiple workers requires SO_REUSEPORT, which this platform doesn't support")
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise SystemExit("running multiple workers requires the fork start method, which this platform doesn't support")
+
+    # the supervisor's own logs (the workers and the migrations) go to log_path itself
+    log_queue.start(level=log_level, category_levels=log_category_levels, path=log_path, as_json=log_as_json)
+
+    try:
+        # the workers share the schema, so it is migrated once, before any of them starts
+        DatabaseMigrations(database_name).migrate()
+
+        shared_state_path = f"{os.path.splitext(database_name)[0]}_shared_state.db"
+
+        # sessions from a previous run are useless, since every client has to do the key exchange again anyway
+        shared_state = SharedStateStore(shared_state_path)
+        shared_state.reset()
+        shared_state.close()
+
+        # the workers are forked, so they start with the supervisor's imported modules instead of importing everything
+        # again
+        context = multiprocessing.get_context("fork")
+
+        def start_worker(worker_number: int) -> multiprocessing.Process:
+            worker_metrics_port = metrics_port + worker_number if metrics_port is not None else None
+
+            worker = context.Process(
+                target=run_worker,
+                args=(
+                    database_name, port, storage_directory, shared_state_path,
+                    worker_metrics_port, _worker_path(metrics_path, worker_number), stall_threshold,
+                    _worker_path(trace_path, worker_number), trace_sample_rate, trace_slower_than,
+                    log_level, log_category_levels, _worker_path(log_path, worker_number), log_as_json
+                ),
+                name=f"server-worker-{worker_number}",
+                daemon=True
+            )
+            worker.start()
+
+            supervisor_log.info("started worker", worker_number=worker_number, pid=worker.pid)
+
+            return worker
+
+        running_workers = {worker_number: start_worker(worker_number) for worker_number in range(workers)}
+
+        # stopping the supervisor (ctrl+c, or SIGTERM from a process manager) stops the workers
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        # toggling the profiler on the supervisor toggles it on every worker (each one writes its own profile)
+        def toggle_workers_profilers(*_):
+            for worker in running_workers.values():
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGUSR2)
+
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, toggle_workers_profilers)
+
+        try:
+            while True:
+                for worker_number, worker in running_workers.items():
+                    worker.join(timeout=1 / len(running_workers))
+
+                    if not worker.is_alive():
+                        supervisor_log.warning(
+                            "worker exited, restarting it",
+                            worker_number=worker_number,
+                            pid=worker.pid,
+                            exit_code=worker.exitcode
+                        )
+                        running_workers[worker_number] = start_worker(worker_number)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # SIGTERM lets every worker run its cleanup (e.g. flushing the listening events) before exiting
+            for worker in running_workers.values():
+                worker.terminate()
+
+            for worker in running_workers.values():
+                worker.join(timeout=10)
+
+                if worker.is_alive():
+                    worker.kill()
+    finally:
+        # the records that are still queued are written before the supervisor exits
+        log_queue.stop()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="hosts the server")
+    parser.add_argument("--database", default="database.db")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--storage", default="SavedFiles", help="the directory that the uploaded files are saved under")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="the amount of worker processes (more than 1 requires SO_REUSEPORT and fork, i.e. linux or macOS)"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int,
+        help="export the metrics in the prometheus format on http://127.0.0.1:<port>/metrics"
+    )
+    parser.add_argument("--metrics-file", help="write the metrics in the prometheus format to this file every 15 seconds")
+    parser.add_argument(
+        "--stall-threshold", type=float, metavar="MILLISECONDS",
+        help="report the code that blocks the event loop for longer than this"
+    )
+    parser.add_argument("--trace-file", help="append the traces of the sampled (and the slow) requests to this JSONL file")
+    parser.add_argument(
+        "--trace-sample-rate", type=float, default=0.01,
+        help="the fraction of the requests that are traced (only with --trace-file)"
+    )
+    parser.add_argument(
+        "--trace-slower-than", type=float, metavar="MILLISECONDS",
+        help="trace every request, and write the ones that took longer than this as well (only with --trace-file)"
+    )
+
+    parser.add_argument("--log-level", default="INFO", help="the level of the logs (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument(
+        "--log-category", action="append", default=[], metavar="CATEGORY=LEVEL",
+        help="the level of a single log category, e.g. upload=DEBUG (can be given multiple times)"
+    )
+    parser.add_argument("--log-file", help="append the logs to this file instead of writing them to stdout")
+    parser.add_argument("--log-json", action="store_true", help="write every log record as a JSON object")
+
+    arguments = parser.parse_args()
+
+    try:
+        log_category_levels = parse_category_levels(arguments.log_category)
+    except ValueError as error:
+        parser.error(str(error))
+
+    stall_threshold = arguments.stall_threshold / 1000 if arguments.stall_threshold is not None else None
+    trace_slower_than = arguments.trace_slower_than / 1000 if arguments.trace_slower_than is not None else None
+
+    if arguments.workers > 1:
+        supervise(
+            arguments.workers,
+            database_name=arguments.database,
+            port=arguments.port,
+            storage_directory=arguments.storage,
+            metrics_port=arguments.metrics_port,
+            metrics_path=arguments.metrics_file,
+            stall_threshold=stall_threshold,
+            trace_path=arguments.trace_file,
+            trace_sample_rate=arguments.trace_sample_rate,
+            trace_slower_than=trace_slower_than,
+            log_level=arguments.log_level.upper(),
+            log_category_levels=log_category_levels,
+            log_path=arguments.log_file,
+            log_as_json=arguments.log_json
+        )
+    else:
+        asyncio.run(
+            main(
+                database_name=arguments.database,
+                port=arguments.port,
+                storage_directory=arguments.storage,
+                metrics_port=arguments.metrics_port,
+                metrics_path=arguments.metrics_file,
+                stall_threshold=stall_threshold,
+                trace_path=arguments.trace_file,
+                trace_sample_rate=arguments.trace_sample_rate,
+                trace_slower_than=trace_slower_than,
+                log_level=arguments.log_level.upper(),
+                log_category_levels=log_category_levels,
+                log_path=arguments.log_file,
+                log_as_json=arguments.log_json
+            )
+        )
@@ -1,4 +1,3 @@
-import logging
 import os
 import aiofiles.os as aos
 import pathlib
@@ -9,20 +8,20 @@ import traceback
 import asyncio
 
 from pseudo_http_protocol import ClientMessage, ServerMessage
-from Caches.client_cache import ClientPackage
+from Caches.client_cache import Address, ClientPackage
 from Caches.user_cache import UserCache, UserCacheItem
 
 from DHE.dhe import DHE
 
 from FileSystem.base_file_system import System, FileChunk
 
-import asqlite
 
 from secure_user_credentials import (
     generate_hashed_password,
     authenticate_password,
     generate_user_id,
-    generate_session_token
+    generate_session_token,
+    ADMIN_USER_IDS
 )
 
 import queries
@@ -33,12 +32,20 @@ from queries import (
     MusicSearch,
     RecommendationAlgorithm,
     Comments,
-    FavoriteSongs
+    FavoriteSongs,
+    UserStats
 )
 
 from MediaHandling.audio import get_audio_length
+from Utils.genre_score_sink import genre_score_sink
+from Utils.comment_summarizer import comment_summary_refresher
+from Caches.comment_subscriptions import comment_subscriptions
+from Utils.sampling_profiler import sampling_profiler
+from Utils.sqlite3_ext import DatabasePool
+from Utils.structured_logging import get_logger
 from Utils.send_to_client_chunk import (
     send_song_preview_chunks,
+    send_song_preview_cursor,
     resend_file_chunks,
     send_song_audio_chunks,
     send_song_sheet_chunks
@@ -53,14 +60,18 @@ from Errors.raised_errors import (
     TooShort,
     InvalidDataType,
     InvalidFile,
-    InvalidValue
+    InvalidValue,
+    Forbidden
 )
 
 
 from RSASigning.private import async_rsa_decrypt
 
+upload_log = get_logger("upload")
+preview_log = get_logger("preview")
 
-async def authenticate_client(_: asqlite.Pool, client_package: ClientPackage, client_message: ClientMessage,
+
+async def authenticate_client(_: DatabasePool, client_package: ClientPackage, client_message: ClientMessage,
                               user_cache: UserCache):
     """
     this function is used to finish transferring the key using dhe.
@@ -128,7 +139,39 @@ async def authenticate_client(_: asqlite.Pool, client_package: ClientPackage, cl
     client.hmac_key = decrypted_hmac_key
 
 
-async def user_signup_and_login(db_pool: asqlite.Pool, client_package: ClientPackage, client_message: ClientMessage,
+async def answer_heartbeat(_: DatabasePool, client_package: ClientPackage, __: ClientMessage, ___: UserCache):
+    """
+    this function is used to answer the server's heartbeat (see Utils.connection_lifecycle), the client's message itself
+    already marked the connection as active, so nothing else is done.
+
+    this function is tied to connection/heartbeat (RESPOND)
+
+    expected payload:
+    {
+        "alive": bool
+    }
+
+    expected output: no message sent (none)
+
+    expected cache pre-function:
+    > address
+    > iv
+    > aes_key
+
+    expected cache post-function:
+    > address
+    > iv
+    > aes_key
+    """
+
+    client = client_package.client
+
+    # checks if the client has completed the key exchange
+    if not client.key or not client.iv:
+        raise NoEncryption("missing encryption values: please re-authenticate")
+
+
+async def user_signup_and_login(db_pool: DatabasePool, client_package: ClientPackage, client_message: ClientMessage,
                                 user_cache: UserCache):
     """
     this function is used to create a new user account, and automatically logs the user in
@@ -202,7 +245,7 @@ async def user_signup_and_login(db_pool: asqlite.Pool, client_package: ClientPac
         raise TooLong("Password is too short: min 6 characters", extra={"type": "password"})
 
     # creates the user based on the client's input
-    async with db_pool.acquire() as connection:
+    async with db_pool.acquire_writer() as connection:
         # using a transaction since im creating 2 queries that rely on each other
         async with connection.transaction():
             # making sure that the user doesn't already exist
@@ -250,7 +293,7 @@ async def user_signup_and_login(db_pool: asqlite.Pool, client_package: ClientPac
     )
 
 
-async def user_signup(db_pool: asqlite.Pool, client_package: ClientPackage, client_message: ClientMessage,
+async def user_signup(db_pool: DatabasePool, client_package: ClientPackage, client_message: ClientMessage,
                       _: UserCache):
     """
     this function is used to create a new user account, however it does NOT automatically log the user in (for now, may change)
@@ -319,7 +362,7 @@ async def user_signup(db_pool: asqlite.Pool, client_package: ClientPackage, clie
         raise TooLong("Password is too short: min 6 characters", extra={"type": "password"})
 
     # creates the user based on the client's input
-    async with db_pool.acquire() as connection:
+    async with db_pool.acquire_writer() as connection:
         # using a transaction since im creating 2 queries that rely on each other
         async with connection.transaction():
             # making sure that the user doesn't already exist
@@ -353,7 +396,7 @@ async def user_signup(db_pool: asqlite.Pool, client_package: ClientPackage, clie
     )
 
 
-async def user_login(db_pool: asqlite.Pool, client_package: ClientPackage, client_message: ClientMessage,
+async def user_login(db_pool: DatabasePool, client_package: ClientPackage, client_message: ClientMessage,
                      user_cache: UserCache):
     """
     this function is used to log a user in, by accepting a password and username (then checking that they are valid)
@@ -585,9 +628,17 @@ class UploadSong:
         dict[request_id, file_id] -> list[(chunk number, chunk bytes), ...]
         """
 
+        self.request_addresses: dict[str, Address] = {}
+        """
+        this is used to find the unfinished uploads of a client that disconnected, so that their files and information
+        can be released (see release_client_uploads)
+
+        dict[request_id -> the address of the client that uploads it]
+        """
+
     async def upload_song(
             self,
-            _: asqlite.Pool,
+            _: DatabasePool,
             client_package: ClientPackage,
             client_message: ClientMessage,
             user_cache: UserCache
@@ -689,10 +740,11 @@ class UploadSong:
                 "cover_art_id": cover_art_id,
                 "image_ids": image_ids
             }
+            self.request_addresses[request_id] = address
 
     async def upload_song_finish(
             self,
-            db_pool: asqlite.Pool,
+            db_pool: DatabasePool,
             client_package: ClientPackage,
             client_message: ClientMessage,
             user_cache: UserCache
@@ -791,7 +843,7 @@ class UploadSong:
             except Exception as e:
                 raise InvalidFile("the given audio file is invalid")
 
-            async with db_pool.acquire() as connection:
+            async with db_pool.acquire_writer() as connection:
                 async with connection.transaction():
                     for file_id in file_ids:
                         if not file_id:
@@ -866,8 +918,15 @@ class UploadSong:
                         genres=genres
                     )
 
+            # the new song can change the results of any search, and can be picked as a random song. only applied once
+            # the song was committed, so that a search that runs in between can't cache results without it
+            await queries.catalog_caches.song_added(song_id)
+
             del self.song_information[request_id]
 
+            # the files are saved now, so only the upload's temporary information is removed
+            self._forget_request(request_id, file_ids)
+
             client.write(
                 ServerMessage(
                     status={
@@ -882,13 +941,12 @@ class UploadSong:
                 ).encode()
             )
         except Exception as e:
-            print(e)
-            traceback.print_exc()
+            upload_log.exception("failed to finish the song upload", request_id=request_id)
             raise e
 
     async def upload_song_file(
             self,
-            db_pool: asqlite.Pool,
+            db_pool: DatabasePool,
             client_package: ClientPackage,
             client_message: ClientMessage,
             user_cache: UserCache
@@ -972,8 +1030,6 @@ class UploadSong:
         chunk_info = self.file_save_ids.get((request_id, file_id), {})
 
         if not chunk_info:
-            print(f"created new file ID for request {request_id}")
-            print((request_id, file_id) in self.file_save_ids)
             # creates a new file ID and finds/creates a cluster ID
 
             async with self._lock:
@@ -996,6 +1052,8 @@ class UploadSong:
                     self.file_save_paths[request_id].add(os.path.join(save_directory, full_file_id))
 
                 chunk_info = self.file_save_ids[(request_id, file_id)]
+
+            upload_log.debug("created a new file ID", request_id=request_id, file_id=file_id, saved_as=full_file_id)
         else:
             # loads the values from the dictionary, so that they can be transferred into the FileChunk in order to be
             # saved onto the disc later on
@@ -1089,20 +1147,34 @@ class UploadSong:
                 chunk_content_type=file_type
             )
         except Exception as e:
-            print(f"error: {e}")
-            logging.error(e, exc_info=True)
+            upload_log.exception(
+                "failed to save the chunk",
+                request_id=request_id,
+                file_id=file_id,
+                chunk_number=chunk_number
+            )
 
             await self._delete_request_info(request_id)
 
             raise e
 
+        # logged for a few chunks per second at most, an upload has hundreds of them
+        upload_log.debug(
+            "saved a chunk",
+            sampled=True,
+            request_id=request_id,
+            file_id=file_id,
+            chunk_number=chunk_number,
+            size=current_size
+        )
+
         if is_last_chunk:
             if current_size != expected_file_size:
                 await self._delete_request_info(request_id)
 
                 raise Exception(f"received file size was less or more than expected (by {abs(current_size - expected_file_size)} bytes)")
 
-            print("last chunk was sent. deleting info now")
+            upload_log.debug("received the last chunk", request_id=request_id, file_id=file_id, size=current_size)
             await self._delete_chunk_info(request_id, file_id)
 
             self.base_file_parameters[(request_id, file_id)] = chunk_file_information
@@ -1124,12 +1196,60 @@ class UploadSong:
             self.out_of_order_chunks.pop((request_id, file_id), None)
             self.song_upload_size_info.pop(request_id, None)
 
+    def _forget_request(self, request_id: str, file_ids: list[str]):
+        """removes the temporary information of a finished upload (without deleting its files)"""
+
+        for file_id in file_ids:
+            self.file_save_ids.pop((request_id, file_id), None)
+            self.base_file_parameters.pop((request_id, file_id), None)
+            self.base_file_paths.pop((request_id, file_id), None)
+            self.out_of_order_chunks.pop((request_id, file_id), None)
+
+        self.base_file_set.pop(request_id, None)
+        self.song_upload_size_info.pop(request_id, None)
+        self.file_save_paths.pop(request_id, None)
+        self.request_addresses.pop(request_id, None)
+
+    async def release_client_uploads(self, address: Address):
+        """
+        deletes the files and information of every upload that the client didn't finish (used when the client
+        disconnects, since no one will finish the uploads)
+        """
+
+        request_ids = [
+            request_id for request_id, request_address in self.request_addresses.items() if request_address == address
+        ]
+
+        # deleting a request can wait for its files to be saved, so the requests are deleted concurrently
+        await asyncio.gather(
+            *(self._delete_request_info(request_id) for request_id in request_ids),
+            return_exceptions=True
+        )
+
+        for request_id in request_ids:
+            self.request_addresses.pop(request_id, None)
+
+    def count_leaked_requests(self, connected_addresses: set[Address]) -> int:
+        """
+        :returns: the amount of uploads that still have temporary information, even though their client is no longer
+        connected (or the upload has no client at all)
+        """
+
+        request_ids = set(self.song_information) | set(self.base_file_set) | set(self.song_upload_size_info)
+        request_ids.update(request_id for request_id, _ in self.file_save_ids)
+        request_ids.update(request_id for request_id, _ in self.base_file_paths)
+
+        return sum(
+            1 for request_id in request_ids
+            if self.request_addresses.get(request_id) not in connected_addresses
+        )
+
     async def _delete_request_info(self, request_id: str):
         try:
             request_info = self.song_information.pop(request_id, None)
 
             if not request_info:
-                print(f"request info for {request_id} not found")
+                upload_log.debug("request info not found", request_id=request_id)
                 return
 
             song_file_id: str = request_info["song_id"]
@@ -1139,7 +1259,7 @@ class UploadSong:
             request_file_ids: list[str] = [song_file_id, cover_art_file_id]
             request_file_ids.extend(sheet_music_images_file_ids)
 
-            print(request_file_ids)
+            upload_log.debug("deleting the request's files", request_id=request_id, file_ids=request_file_ids)
 
             for file_id in request_file_ids:
                 # we remove the info by popping it, since it wont be used beyond this function and we need to clear the
@@ -1147,7 +1267,7 @@ class UploadSong:
                 current_file = self.file_save_ids.pop((request_id, file_id), None)
 
                 if not current_file:
-                    print(f"couldnt find file info for {file_id}")
+                    upload_log.debug("file info not found", request_id=request_id, file_id=file_id)
                     continue
 
                 await self._delete_chunk_info(request_id, file_id)
@@ -1157,11 +1277,9 @@ class UploadSong:
                 save_dir, _, file_path = current_file["paths"]
                 file_codec = current_file["file_extension"]
 
-                print(file_codec)
-
                 if not file_codec:
-                    print(f"no codec found for {save_dir}/{file_path}")
-                    return
+                    upload_log.debug("no codec found", request_id=request_id, path=os.path.join(save_dir, file_path))
+                    continue
 
                 full_path = os.path.join(save_dir, file_path) + f".{file_codec}"
 
@@ -1185,7 +1303,6 @@ class UploadSong:
                     if does_path_currently_exist:
                         break
 
-                    print(does_path_currently_exist)
                     give_up_counter -= 1
 
                     await asyncio.sleep(10)
@@ -1193,10 +1310,8 @@ class UploadSong:
                     if give_up_counter <= 0:
                         break
 
-                print(full_path)
-
                 if give_up_counter <= 0:
-                    logging.error(f"failed to find file {full_path} in under 3 seconds. skipping file")
+                    upload_log.error("file not found in time, skipping it", request_id=request_id, path=full_path)
                     continue
 
                 async with file_async_lock:
@@ -1212,15 +1327,15 @@ class UploadSong:
             self.base_file_set.pop(request_id, None)
             self.song_upload_size_info.pop(request_id, None)
             self.file_save_paths.pop(request_id, None)
+            self.request_addresses.pop(request_id, None)
         except Exception as e:
-            import traceback
-            traceback.print_exc()
+            upload_log.exception("failed to delete the request's info", request_id=request_id)
 
             raise e
 
 
 async def send_song_previews(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -1234,7 +1349,8 @@ async def send_song_previews(
     {
         "query": str,
         "limit": int,
-        "exclude": list[song IDs],
+        -- note: the cursor is optional, not sending it (or sending null) will return the first page
+        "cursor": str | None,
 
         -- note: any filter is optional, sending 1 filter does not mean you need to send all of them
         "filters": {
@@ -1250,6 +1366,17 @@ async def send_song_previews(
     --note: this function will only FETCH the song information from the database, the chunk sending will happen in a
     Utils function (outside of server_actions)
 
+    expected output (for the cursor message, sent to song/download/preview/cursor before the previews):
+    {
+        -- note: the cursor is null if there are no more pages
+        "cursor": str | None,
+        "endpoint": str,
+        -- note: the search query (or genre) that the page was requested for, null for the pages that don't have one
+        "query": str | None,
+        -- note: the amount of previews that are sent after the cursor
+        "count": int
+    }
+
     expected output (for starting message):
     {
         "file_id": str
@@ -1262,6 +1389,8 @@ async def send_song_previews(
         "user_id": str,
         "username": str,
         "is_favorite_song": bool,
+        "media_version": str,
+        "sheet_count": int,
     }
 
     expected output (for each chunk):
@@ -1306,33 +1435,39 @@ async def send_song_previews(
     try:
         search_query = payload["query"]
         limit: int = payload["limit"]
-        exclude: list[int] = payload["exclude"]
         filters: dict[str, ...] = payload["filters"]
     except KeyError:
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
         raise InvalidPayload(
-            f"Invalid payload passed. expected key \"query\", \"limit\", \"exclude\","
-            f" \"filters\", instead got {payload_keys}"
+            f"Invalid payload passed. expected key \"query\", \"limit\", \"filters\", instead got {payload_keys}"
         )
 
+    cursor: str | None = payload.get("cursor")
+
     if len(search_query) > 100:
         raise TooLong("search query is too long, max length allowed is 100 characters")
     if limit > 50 or limit <= 0:
         raise InvalidValue("the limit must be a number between 1 and 50")
-    if len(exclude) > 100:
-        raise TooLong("the exclude list can only have up to 100 exclusions per request")
 
     if not isinstance(search_query, str):
         raise InvalidDataType(f"expected data type for \"query\" is str, got {type(search_query)} instead", extra={"type": "search"})
 
     async with db_pool.acquire() as connection:
-        matching_song_ids = await MusicSearch.search_song(
+        matching_song_ids, next_cursor = await MusicSearch.search_song(
             connection=connection,
             search_query=search_query,
             limit=limit,
-            exclude=exclude
+            cursor=cursor
         )
 
+    send_song_preview_cursor(
+        transport=client,
+        requested_endpoint="song/download/preview",
+        query=search_query,
+        cursor=next_cursor,
+        previews_amount=len(matching_song_ids)
+    )
+
     await send_song_preview_chunks(
         transport=client,
         song_ids=matching_song_ids,
@@ -1342,7 +1477,7 @@ async def send_song_previews(
 
 
 async def send_recommended_song_previews(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -1354,9 +1489,9 @@ async def send_recommended_song_previews(
 
     expected payload:
     {
-        "query": str,
         "limit": int,
-        "exclude": list[song IDs],
+        -- note: the cursor is optional, not sending it (or sending null) will return the first page
+        "cursor": str | None,
     }
 
     -- note: the output will be sent as chunks and multiple "messages". so the output here will be shown as a single
@@ -1364,6 +1499,17 @@ async def send_recommended_song_previews(
     --note: this function will only FETCH the song information from the database, the chunk sending will happen in a
     Utils function (outside of server_actions)
 
+    expected output (for the cursor message, sent to song/download/preview/cursor before the previews):
+    {
+        -- note: the cursor is null if there are no more pages
+        "cursor": str | None,
+        "endpoint": str,
+        -- note: the search query (or genre) that the page was requested for, null for the pages that don't have one
+        "query": str | None,
+        -- note: the amount of previews that are sent after the cursor
+        "count": int
+    }
+
     expected output (for starting message):
     {
         "file_id": str
@@ -1376,6 +1522,8 @@ async def send_recommended_song_previews(
         "user_id": str,
         "username": str,
         "is_favorite_song": bool,
+        "media_version": str,
+        "sheet_count": int,
     }
 
     expected output (for each chunk):
@@ -1419,26 +1567,32 @@ async def send_recommended_song_previews(
 
     try:
         limit: int = payload["limit"]
-        exclude: list[int] = payload["exclude"]
     except KeyError:
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
         raise InvalidPayload(
-            f"Invalid payload passed. expected key \"limit\", \"exclude\", instead got {payload_keys}"
+            f"Invalid payload passed. expected key \"limit\", instead got {payload_keys}"
         )
 
+    cursor: str | None = payload.get("cursor")
+
     if limit > 50 or limit <= 0:
         raise InvalidValue("the limit must be a number between 1 and 50")
-    if len(exclude) > 100:
-        raise TooLong("the exclude list can only have up to 100 exclusions per request")
 
     async with db_pool.acquire() as connection:
-        matching_song_ids = await RecommendationAlgorithm.fetch_recommended_songs(
+        matching_song_ids, next_cursor = await RecommendationAlgorithm.fetch_recommended_songs(
             connection=connection,
             user_id=client_user_cache.user_id,
             limit=limit,
-            exclude=exclude
+            cursor=cursor
         )
 
+    send_song_preview_cursor(
+        transport=client,
+        requested_endpoint="song/recommended/download/preview",
+        cursor=next_cursor,
+        previews_amount=len(matching_song_ids)
+    )
+
     await send_song_preview_chunks(
         transport=client,
         song_ids=matching_song_ids,
@@ -1448,7 +1602,7 @@ async def send_recommended_song_previews(
 
 
 async def send_genre_list(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -1527,7 +1681,7 @@ async def send_genre_list(
 
 
 async def send_songs_by_genre(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -1540,7 +1694,8 @@ async def send_songs_by_genre(
     expected payload:
     {
         "limit": int
-        "exclude": list[int]
+        -- note: the cursor is optional, not sending it (or sending null) will return the first page
+        "cursor": str | None
         "genre": str
     }
 
@@ -1549,6 +1704,17 @@ async def send_songs_by_genre(
     --note: this function will only FETCH the song information from the database, the chunk sending will happen in a
     Utils function (outside of server_actions)
 
+    expected output (for the cursor message, sent to song/download/preview/cursor before the previews):
+    {
+        -- note: the cursor is null if there are no more pages
+        "cursor": str | None,
+        "endpoint": str,
+        -- note: the search query (or genre) that the page was requested for, null for the pages that don't have one
+        "query": str | None,
+        -- note: the amount of previews that are sent after the cursor
+        "count": int
+    }
+
     expected output (for starting message):
     {
         "file_id": str
@@ -1561,6 +1727,8 @@ async def send_songs_by_genre(
         "user_id": str,
         "username": str,
         "is_favorite_song": bool,
+        "media_version": str,
+        "sheet_count": int,
     }
 
     expected output (for each chunk):
@@ -1604,27 +1772,34 @@ async def send_songs_by_genre(
 
     try:
         limit: int = payload["limit"]
-        exclude: list[int] = payload["exclude"]
         genre: str = payload["genre"]
     except KeyError:
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
         raise InvalidPayload(
-            f"Invalid payload passed. expected key \"genre\", \"limit\", \"exclude\", instead got {payload_keys}"
+            f"Invalid payload passed. expected key \"genre\", \"limit\", instead got {payload_keys}"
         )
 
+    cursor: str | None = payload.get("cursor")
+
     if limit > 50 or limit <= 0:
         raise InvalidValue("the limit must be a number between 1 and 50")
-    if len(exclude) > 100:
-        raise TooLong("the exclude list can only have up to 100 exclusions per request")
 
     async with db_pool.acquire() as connection:
-        matching_song_ids = await MusicSearch.search_song_by_genres(
+        matching_song_ids, next_cursor = await MusicSearch.search_song_by_genres(
             connection=connection,
             genres=[genre],
             limit=limit,
-            exclude=exclude
+            cursor=cursor
         )
 
+    send_song_preview_cursor(
+        transport=client,
+        requested_endpoint="song/genres/download/preview",
+        query=genre,
+        cursor=next_cursor,
+        previews_amount=len(matching_song_ids)
+    )
+
     await send_song_preview_chunks(
         transport=client,
         song_ids=matching_song_ids,
@@ -1634,7 +1809,7 @@ async def send_songs_by_genre(
 
 
 async def send_recent_song_previews(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -1667,6 +1842,8 @@ async def send_recent_song_previews(
         "user_id": str,
         "username": str,
         "is_favorite_song": bool,
+        "media_version": str,
+        "sheet_count": int,
     }
 
     expected output (for each chunk):
@@ -1740,7 +1917,7 @@ async def send_recent_song_previews(
 
 
 async def resend_song_preview(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -1806,7 +1983,7 @@ async def resend_song_preview(
 
 
 async def send_song_audio(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -1865,19 +2042,18 @@ async def send_song_audio(
         raise InvalidPayload(
             f"Invalid payload passed. expected key \"song_id\", instead got {payload_keys}")
 
-    async with db_pool.acquire() as connection:
-        await RecommendationAlgorithm.increase_genre_score_by_song_id(
-            connection=connection,
-            user_id=client_user_cache.user_id,
-            song_id=song_id,
-            score_increase=2
-        )
+    # the genre score is written later in a batch, so that it doesn't delay the file
+    genre_score_sink.add(
+        user_id=client_user_cache.user_id,
+        song_id=song_id,
+        score_increase=2
+    )
 
     await send_song_audio_chunks(transport=client, song_id=song_id, db_pool=db_pool)
 
 
 async def send_song_sheets(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -1935,19 +2111,18 @@ async def send_song_sheets(
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
         raise InvalidPayload(f"Invalid payload passed. expected key \"song_id\", instead got {payload_keys}")
 
-    async with db_pool.acquire() as connection:
-        await RecommendationAlgorithm.increase_genre_score_by_song_id(
-            connection=connection,
-            user_id=client_user_cache.user_id,
-            song_id=song_id,
-            score_increase=1
-        )
+    # the genre score is written later in a batch, so that it doesn't delay the file
+    genre_score_sink.add(
+        user_id=client_user_cache.user_id,
+        song_id=song_id,
+        score_increase=1
+    )
 
     await send_song_sheet_chunks(transport=client, song_id=song_id, db_pool=db_pool)
 
 
 async def send_song_comments(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -1960,7 +2135,16 @@ async def send_song_comments(
     expected payload:
     {
         "song_id": int,
-        "exclude": list[int],
+        -- note: the cursor is optional, not sending it (or sending null) will return the first comments
+        "cursor": str | None,
+        -- note: optional, returns only the comments after this comment ID (instead of using a cursor). used by clients
+        that already have the song's comments up to a specific comment
+        "since_comment_id": int | None,
+        -- note: optional, the maximum amount of comments to send (between 1 and 100, 50 by default)
+        "limit": int,
+        -- note: optional, when true the new comments of the song are pushed to the client (see song/comments/new) until
+        it sends song/comments/unsubscribe
+        "subscribe": bool
     }
 
     expected output:
@@ -1973,7 +2157,10 @@ async def send_song_comments(
                 "uploaded_by": str,
                 "uploaded_by_display": str
             }
-        ]
+        ],
+        "ai_summary": str,
+        -- note: send this cursor back in order to get the comments after the ones that were just sent
+        "cursor": str | None
     }
 
     expected  cache pre - function:
@@ -2005,25 +2192,69 @@ async def send_song_comments(
 
     try:
         song_id: int = payload["song_id"]
-        exclude: list[int] = payload["exclude"]
     except KeyError:
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
-        raise InvalidPayload(f"Invalid payload passed. expected key \"song_id\", \"exclude\" instead got {payload_keys}")
+        raise InvalidPayload(f"Invalid payload passed. expected key \"song_id\" instead got {payload_keys}")
+
+    cursor: str | None = payload.get("cursor")
+    since_comment_id: int | None = payload.get("since_comment_id")
+    limit: int = payload.get("limit", 50)
+    should_subscribe: bool = payload.get("subscribe", False)
 
-    if len(exclude) > 1000:
-        raise TooLong("the comment's exclude must only contain 1000 values")
+    if not isinstance(limit, int) or limit > 100 or limit <= 0:
+        raise InvalidValue("the limit must be a number between 1 and 100")
+
+    if since_comment_id is not None:
+        if not isinstance(since_comment_id, int):
+            raise InvalidDataType(
+                f"expected data type for \"since_comment_id\" is int, got {type(since_comment_id)} instead"
+            )
+
+        if cursor is not None:
+            raise InvalidPayload("only one of \"cursor\" and \"since_comment_id\" can be passed")
+
+    # the AI summary is only shown above the first page of comments
+    is_first_page = cursor is None and since_comment_id is None
+
+    ai_summary: str | None = None
+    should_refresh_summary = False
 
     async with db_pool.acquire() as connection:
-        comments = await Comments.fetch_song_comments(
-            connection=connection,
-            song_id=song_id,
-            exclude=exclude
-        )
+        if since_comment_id is not None:
+            comments, next_cursor = await Comments.fetch_song_comments_since(
+                connection=connection,
+                song_id=song_id,
+                since_comment_id=since_comment_id,
+                limit=limit
+            )
+        else:
+            comments, next_cursor = await Comments.fetch_song_comments(
+                connection=connection,
+                song_id=song_id,
+                cursor=cursor,
+                limit=limit
+            )
 
-        ai_summary = await Comments.fetch_ai_summary(
-            connection=connection,
-            song_id=song_id
-        )
+        if is_first_page:
+            ai_summary, should_refresh_summary = await Comments.fetch_ai_summary(
+                connection=connection,
+                song_id=song_id
+            )
+
+    # the summary is generated in the background, so the (possibly stale) saved summary is sent right away
+    if should_refresh_summary:
+        comment_summary_refresher.schedule_refresh(song_id)
+
+    if ai_summary is None:
+        if not is_first_page:
+            ai_summary = ""
+        elif comment_summary_refresher.is_refreshing(song_id):
+            ai_summary = "The AI summary is being generated, check again soon"
+        else:
+            ai_summary = "Not enough comments for AI summary"
+
+    if should_subscribe:
+        comment_subscriptions.subscribe(song_id, client_package)
 
     client.write(
         ServerMessage(
@@ -2035,14 +2266,15 @@ async def send_song_comments(
             endpoint="song/comments",
             payload={
                 "comments": comments,
-                "ai_summary": ai_summary
+                "ai_summary": ai_summary,
+                "cursor": next_cursor
             }
         ).encode()
     )
 
 
 async def upload_song_comment(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2061,6 +2293,19 @@ async def upload_song_comment(
     expected output:
     None
 
+    the new comment is pushed to every other client that is subscribed to the song's comments (see send_song_comments):
+    endpoint: song/comments/new
+    {
+        "song_id": int,
+        "comment": {
+            "comment_id": int,
+            "text": str,
+            "uploaded_at": int,
+            "uploaded_by": str,
+            "uploaded_by_display": str
+        }
+    }
+
     expected  cache pre - function:
     > address
     > iv
@@ -2098,16 +2343,100 @@ async def upload_song_comment(
     if len(text) > 2000:
         raise TooLong("the comment's text cannot be longer than 2000 characters")
 
+    async with db_pool.acquire_writer() as connection:
+        # the comment and the user's comment counter are saved together
+        async with connection.transaction():
+            comment_id = await Comments.upload_comment(
+                connection=connection,
+                song_id=song_id,
+                uploaded_by=client_user_cache.user_id,
+                text=text
+            )
+
+    subscribers = [
+        subscriber for subscriber in comment_subscriptions.subscribers(song_id)
+        if subscriber.address != address
+    ]
+
+    if not subscribers:
+        return
+
     async with db_pool.acquire() as connection:
-        await Comments.upload_comment(
-            connection=connection,
-            song_id=song_id,
-            uploaded_by=client_user_cache.user_id,
-            text=text
-        )
+        comment = await Comments.fetch_comment(connection=connection, comment_id=comment_id)
+
+    if not comment:
+        return
+
+    new_comment_message = ServerMessage(
+        status={
+            "code": 200,
+            "message": "success"
+        },
+        method="respond",
+        endpoint="song/comments/new",
+        payload={
+            "song_id": song_id,
+            "comment": comment
+        }
+    ).encode()
+
+    for subscriber in subscribers:
+        subscriber.client.write(new_comment_message)
 
 
-async def search_for_songs_by_name(db_pool: asqlite.Pool,
+async def unsubscribe_song_comments(
+        db_pool: DatabasePool,
+        client_package: ClientPackage,
+        client_message: ClientMessage,
+        user_cache: UserCache
+):
+    """
+    this function is used to stop pushing a song's new comments to the client (see send_song_comments)
+
+    this function is tied to song/comments/unsubscribe (POST)
+
+    expected payload:
+    {
+        "song_id": int
+    }
+
+    expected output:
+    None
+
+    expected  cache pre - function:
+    > address
+    > iv
+    > aes_key
+    > user_id
+    > session_token
+
+    expected cache post - function:
+    > address
+    > iv
+    > aes_key
+    > user_id
+    > session_token
+    """
+
+    client = client_package.client
+    address = client_package.address
+
+    # checks if the client has completed the key exchange
+    if not client.key or not client.iv:
+        raise NoEncryption("missing encryption values: please re-authenticate")
+
+    payload = client_message.payload
+
+    try:
+        song_id: int = payload["song_id"]
+    except KeyError:
+        payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
+        raise InvalidPayload(f"Invalid payload passed. expected key \"song_id\" instead got {payload_keys}")
+
+    comment_subscriptions.unsubscribe(song_id, address)
+
+
+async def search_for_songs_by_name(db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2187,7 +2516,7 @@ async def search_for_songs_by_name(db_pool: asqlite.Pool,
         raise e
 
 
-async def get_user_statistics(db_pool: asqlite.Pool,
+async def get_user_statistics(db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2234,8 +2563,7 @@ async def get_user_statistics(db_pool: asqlite.Pool,
     user_id = client_user_cache.user_id
 
     async with db_pool.acquire() as connection:
-        comment_count = await Comments.fetch_user_comment_count(connection=connection, user_id=user_id)
-        upload_count = await Music.fetch_user_song_upload_count(connection=connection, user_id=user_id)
+        upload_count, comment_count = await UserStats.fetch_user_stats(connection=connection, user_id=user_id)
 
     client.write(
         ServerMessage(
@@ -2254,7 +2582,7 @@ async def get_user_statistics(db_pool: asqlite.Pool,
 
 
 async def delete_song_request(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2307,7 +2635,7 @@ async def delete_song_request(
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
         raise InvalidPayload(f"Invalid payload passed. expected key \"song_id\" instead got {payload_keys}")
 
-    async with db_pool.acquire() as connection:
+    async with db_pool.acquire_writer() as connection:
         is_song_own = await Music.does_user_own_song(
             connection=connection,
             user_id=user_id,
@@ -2315,14 +2643,19 @@ async def delete_song_request(
         )
 
         if is_song_own:
-            await Music.delete_song(
-                connection=connection,
-                song_id=song_id
-            )
+            async with connection.transaction():
+                await Music.delete_song(
+                    connection=connection,
+                    song_id=song_id
+                )
+
+            # the deleted song could be a part of any cached search result (applied after the commit, see
+            # upload_song_finish)
+            await queries.catalog_caches.song_deleted(song_id)
 
 
 async def delete_comment_request(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2376,7 +2709,7 @@ async def delete_comment_request(
         raise InvalidPayload(f"Invalid payload passed. expected key \"song_id\" instead got {payload_keys}")
 
     try:
-        async with db_pool.acquire() as connection:
+        async with db_pool.acquire_writer() as connection:
             is_song_own = await Comments.does_user_own_comment(
                 connection=connection,
                 user_id=user_id,
@@ -2384,16 +2717,17 @@ async def delete_comment_request(
             )
 
             if is_song_own:
-                await Comments.delete_comment(
-                    connection=connection,
-                    comment_id=comment_id
-                )
+                async with connection.transaction():
+                    await Comments.delete_comment(
+                        connection=connection,
+                        comment_id=comment_id
+                    )
     except Exception as e:
         traceback.print_exc()
         raise e
 
 async def delete_user_request(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2433,9 +2767,9 @@ async def delete_user_request(
         raise NoEncryption("missing encryption values: please re-authenticate")
 
     try:
-        user_cache.logout(address)
+        await user_cache.logout(address)
 
-        async with db_pool.acquire() as connection:
+        async with db_pool.acquire_writer() as connection:
             await queries.User.delete_user(connection=connection, user_id=user_id)
     except Exception as e:
         traceback.print_exc()
@@ -2443,7 +2777,7 @@ async def delete_user_request(
 
 
 async def logout_user(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2476,10 +2810,10 @@ async def logout_user(
     if not client.key or not client.iv:
         raise NoEncryption("missing encryption values: please re-authenticate")
 
-    user_cache.logout(address)
+    await user_cache.logout(address)
 
 
-async def edit_user_display_name(db_pool: asqlite.Pool,
+async def edit_user_display_name(db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache
@@ -2531,12 +2865,12 @@ async def edit_user_display_name(db_pool: asqlite.Pool,
     if len(display_name) > 20:
         raise TooLong("Display name provided is too long: max 20 characters")
 
-    async with db_pool.acquire() as connection:
+    async with db_pool.acquire_writer() as connection:
         await queries.User.change_display_name(connection=connection, user_id=user_id, display_name=display_name)
 
 
 async def send_songs_by_favorite(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -2548,7 +2882,8 @@ async def send_songs_by_favorite(
     expected payload:
     {
         "limit": int
-        "exclude": list[int]
+        -- note: the cursor is optional, not sending it (or sending null) will return the first page
+        "cursor": str | None
     }
 
     -- note: the output will be sent as chunks and multiple "messages". so the output here will be shown as a single
@@ -2556,6 +2891,17 @@ async def send_songs_by_favorite(
     --note: this function will only FETCH the song information from the database, the chunk sending will happen in a
     Utils function (outside of server_actions)
 
+    expected output (for the cursor message, sent to song/download/preview/cursor before the previews):
+    {
+        -- note: the cursor is null if there are no more pages
+        "cursor": str | None,
+        "endpoint": str,
+        -- note: the search query (or genre) that the page was requested for, null for the pages that don't have one
+        "query": str | None,
+        -- note: the amount of previews that are sent after the cursor
+        "count": int
+    }
+
     expected output (for starting message):
     {
         "file_id": str
@@ -2568,6 +2914,8 @@ async def send_songs_by_favorite(
         "user_id": str,
         "username": str,
         "is_favorite_song": bool,
+        "media_version": str,
+        "sheet_count": int,
     }
 
     expected output (for each chunk):
@@ -2611,27 +2959,33 @@ async def send_songs_by_favorite(
 
     try:
         limit: int = payload["limit"]
-        exclude: list[int] = payload["exclude"]
     except KeyError:
         payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
         raise InvalidPayload(
-            f"Invalid payload passed. expected key \"limit\", \"exclude\", instead got {payload_keys}"
+            f"Invalid payload passed. expected key \"limit\", instead got {payload_keys}"
         )
 
+    cursor: str | None = payload.get("cursor")
+
     if limit > 50 or limit <= 0:
         raise InvalidValue("the limit must be a number between 1 and 50")
-    if len(exclude) > 100:
-        raise TooLong("the exclude list can only have up to 100 exclusions per request")
 
     async with db_pool.acquire() as connection:
-        matching_song_ids = await FavoriteSongs.fetch_favorite_songs(
+        matching_song_ids, next_cursor = await FavoriteSongs.fetch_favorite_songs(
             connection=connection,
             user_id=user_id,
             limit=limit,
-            exclude=exclude
+            cursor=cursor
         )
 
-    print(matching_song_ids)
+    preview_log.debug("fetched favorite songs", user_id=user_id, songs=len(matching_song_ids), cursor=next_cursor)
+
+    send_song_preview_cursor(
+        transport=client,
+        requested_endpoint="song/favorite/download/preview",
+        cursor=next_cursor,
+        previews_amount=len(matching_song_ids)
+    )
 
     await send_song_preview_chunks(
         transport=client,
@@ -2642,7 +2996,7 @@ async def send_songs_by_favorite(
 
 
 async def change_favorite(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -2696,7 +3050,7 @@ async def change_favorite(
             f"Invalid payload passed. expected key \"song_id\", instead got {payload_keys}"
         )
 
-    async with db_pool.acquire() as connection:
+    async with db_pool.acquire_writer() as connection:
         await FavoriteSongs.change_favorite(
             connection=connection,
             user_id=user_id,
@@ -2705,7 +3059,7 @@ async def change_favorite(
 
 
 async def send_songs_by_upload(
-        db_pool: asqlite.Pool,
+        db_pool: DatabasePool,
         client_package: ClientPackage,
         client_message: ClientMessage,
         user_cache: UserCache):
@@ -2737,6 +3091,8 @@ async def send_songs_by_upload(
         "user_id": str,
         "username": str,
         "is_favorite_song": bool,
+        "media_version": str,
+        "sheet_count": int,
     }
 
     expected output (for each chunk):
@@ -2806,3 +3162,96 @@ async def send_songs_by_upload(
         db_pool=db_pool,
         user_id=user_id
     )
+
+
+async def control_profiler(
+        _: DatabasePool,
+        client_package: ClientPackage,
+        client_message: ClientMessage,
+        user_cache: UserCache
+):
+    """
+    this function is used by admins to start and stop the sampling profiler (see Utils.sampling_profiler) while the
+    server runs, e.g. when the previews' latency spikes. only the users in ADMIN_USER_IDS (see secrets.env) can use it.
+
+    note that with multiple workers, only the worker that the admin is connected to is profiled.
+
+    this function is tied to admin/profiler (POST)
+
+    expected payload:
+    {
+        "action": "start" | "stop",
+        "duration": float | None  # (only for start) seconds until the profiler stops on its own
+    }
+
+    expected output:
+    {
+        "is_running": bool,
+        "profile_path": str | None  # the path (on the server) of the written profile, after stopping
+    }
+
+    expected  cache pre - function:
+    > address
+    > iv
+    > aes_key
+    > user_id
+    > session_token
+
+    expected cache post - function:
+    > address
+    > iv
+    > aes_key
+    > user_id
+    > session_token
+    """
+
+    client = client_package.client
+    address = client_package.address
+
+    # checks if the client has completed the key exchange
+    if not client.key or not client.iv:
+        raise NoEncryption("missing encryption values: please re-authenticate")
+
+    # gets the UserCacheItem for this specific client (and references it)
+    client_user_cache: UserCacheItem = user_cache[address]
+
+    if client_user_cache.user_id not in ADMIN_USER_IDS:
+        raise Forbidden("only admins can control the profiler")
+
+    payload = client_message.payload
+
+    try:
+        action: str = payload["action"]
+    except KeyError:
+        payload_keys = " ".join(f"\"{key}\"" for key in payload.keys())
+        raise InvalidPayload(f"Invalid payload passed. expected key \"action\" instead got {payload_keys}")
+
+    profile_path = None
+
+    if action == "start":
+        duration = payload.get("duration")
+
+        if duration is not None and (not isinstance(duration, int | float) or duration <= 0):
+            raise InvalidValue("the profiler's duration must be a positive number of seconds")
+
+        sampling_profiler.start(duration=duration)
+    elif action == "stop":
+        # stopping waits for the profile to be written, so it is done in a thread
+        profile_path = await asyncio.to_thread(sampling_profiler.stop)
+    else:
+        raise InvalidValue(f"unknown profiler action \"{action}\", expected \"start\" or \"stop\"")
+
+    client.write(
+        ServerMessage(
+            status={
+                "code": 200,
+                "message": "success"
+            },
+            method="respond",
+            endpoint="admin/profiler",
+            payload={
+                "is_running": sampling_profiler.is_running,
+                "profile_path": profile_path
+            }
+        ).encode()
+    )
@@ -0,0 +1,193 @@
+"""
+tests Utils.comment_summarizer against a local stand-in for the LLM's HTTP API (an aiohttp server that answers
+/chat/completions like the OpenAI compatible API does), which GROQ_BASE_URL is pointed at.
+
+the database is replaced with an in-memory stand-in, since only the refresher's scheduling is tested here.
+
+run from the project's root directory: python -m pytest tests (or python -m unittest tests/test_comment_summarizer.py)
+"""
+
+import asyncio
+import importlib
+import os
+import unittest
+from contextlib import asynccontextmanager
+from unittest import mock
+
+from aiohttp import web
+
+from GroqAI import generate_comment_summary
+from Utils import comment_summarizer
+from Utils.comment_summarizer import CommentSummaryRefresher
+
+SONG_ID = 1
+
+
+class StubLLMServer:
+    """
+    answers every /chat/completions request with a summary, or with an error when is_failing is set. while is_held is
+    set, the answers wait until release() is called (so a test can look at the state while a refresh is running)
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.is_failing = False
+
+        self._released = asyncio.Event()
+        self._released.set()
+
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    def hold(self):
+        self._released.clear()
+
+    def release(self):
+        self._released.set()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/chat/completions", self._answer)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _answer(self, request: web.Request) -> web.Response:
+        self.calls += 1
+
+        await self._released.wait()
+
+        if self.is_failing:
+            return web.json_response({"error": {"message": "the model is overloaded"}}, status=503)
+
+        return web.json_response({"choices": [{"message": {"content": f"summary #{self.calls}"}}]})
+
+
+class StubDatabasePool:
+    """the acquire methods of DatabasePool, without a database"""
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield None
+
+    @asynccontextmanager
+    async def acquire_writer(self):
+        yield None
+
+
+class StubComments:
+    """the queries.Comments methods that the refresher uses, saving the summaries in a dict"""
+
+    summaries: dict[int, str] = {}
+
+    @staticmethod
+    async def fetch_comments_for_summary(connection, song_id: int) -> tuple[str, list[str], int]:
+        return "song", ["great song", "the chorus is too long"], 2
+
+    @staticmethod
+    async def save_ai_summary(connection, song_id: int, summary: str, last_updated: int, last_comment_id: int):
+        StubComments.summaries[song_id] = summary
+
+
+class CommentSummaryRefresherTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.llm_server = StubLLMServer()
+        await self.llm_server.start()
+
+        # the model reads the base URL when the module is imported
+        os.environ["GROQ_BASE_URL"] = self.llm_server.base_url
+        importlib.reload(generate_comment_summary)
+
+        comments_patch = mock.patch.object(comment_summarizer, "Comments", StubComments)
+        comments_patch.start()
+        self.addCleanup(comments_patch.stop)
+
+        StubComments.summaries = {SONG_ID: "stale summary"}
+
+        self.refresher = CommentSummaryRefresher(retry_interval=0.5)
+        self.refresher.start(StubDatabasePool())
+
+    async def asyncTearDown(self):
+        self.llm_server.release()
+
+        await self.refresher.stop()
+        await self.llm_server.stop()
+
+    async def wait_for_refreshes(self):
+        await asyncio.gather(*self.refresher._refreshes.values(), return_exceptions=True)
+
+    async def wait_for_calls(self, calls: int):
+        while self.llm_server.calls < calls:
+            await asyncio.sleep(0.01)
+
+    async def test_concurrent_refreshes_are_single_flight(self):
+        self.llm_server.hold()
+
+        # every client that opens the song's comments while the summary is stale schedules a refresh
+        for _ in range(10):
+            self.refresher.schedule_refresh(SONG_ID)
+
+        await asyncio.wait_for(self.wait_for_calls(1), timeout=5)
+
+        for _ in range(10):
+            self.refresher.schedule_refresh(SONG_ID)
+
+        self.llm_server.release()
+        await self.wait_for_refreshes()
+
+        self.assertEqual(self.llm_server.calls, 1)
+        self.assertEqual(StubComments.summaries[SONG_ID], "summary #1")
+
+    async def test_stale_summary_is_served_while_refreshing(self):
+        self.llm_server.hold()
+
+        self.refresher.schedule_refresh(SONG_ID)
+        await asyncio.wait_for(self.wait_for_calls(1), timeout=5)
+
+        # the LLM didn't answer yet, so the saved (stale) summary is still the one that is served
+        self.assertTrue(self.refresher.is_refreshing(SONG_ID))
+        self.assertEqual(StubComments.summaries[SONG_ID], "stale summary")
+
+        self.llm_server.release()
+        await self.wait_for_refreshes()
+
+        self.assertFalse(self.refresher.is_refreshing(SONG_ID))
+        self.assertEqual(StubComments.summaries[SONG_ID], "summary #1")
+
+    async def test_failed_refresh_is_retried_after_retry_interval(self):
+        self.llm_server.is_failing = True
+
+        self.refresher.schedule_refresh(SONG_ID)
+        await self.wait_for_refreshes()
+
+        self.assertEqual(self.llm_server.calls, 1)
+        self.assertEqual(StubComments.summaries[SONG_ID], "stale summary")
+
+        # scheduled again before retry_interval passed, nothing is sent
+        self.refresher.schedule_refresh(SONG_ID)
+        self.assertFalse(self.refresher.is_refreshing(SONG_ID))
+        await self.wait_for_refreshes()
+
+        self.assertEqual(self.llm_server.calls, 1)
+
+        self.llm_server.is_failing = False
+        await asyncio.sleep(self.refresher.retry_interval)
+
+        self.refresher.schedule_refresh(SONG_ID)
+        await self.wait_for_refreshes()
+
+        self.assertEqual(self.llm_server.calls, 2)
+        self.assertEqual(StubComments.summaries[SONG_ID], "summary #2")
+
+
+if __name__ == "__main__":
+    unittest.main()